@@ -0,0 +1,144 @@
+"""
+Questions per minute: one /ask per question vs. /ask/batch.
+
+    sequential  what an evaluation script does today: for each question embed_query, one
+                filtered search, BM25 fusion, one LLM call
+    batch       the /ask/batch path: embed_queries (one model call), one query_batch_points
+                request with per-question source filters, BM25 fusion, then the LLM calls
+                through PipelineRunner.run_many with --parallelism
+
+The embedding model is simulated with a fixed per-call overhead plus a per-text cost (the
+forward pass of a small CPU batch is dominated by the overhead), the LLM with a fixed
+latency. Chunks live in a LocalStore (or in-process Qdrant with --qdrant) over synthetic
+clustered vectors, so the retrieval numbers are real.
+
+    python bench/bench_batch.py --questions 64 --llm-latency 0.5 --parallelism 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from bench_local_store import make_collection
+from concurrency import PipelineRunner
+from embedding_cache import CachedEmbeddings
+from geco_stub import make_text
+from hybrid import batch_hybrid_search, hybrid_search, point_document, source_filter
+from lexical_index import LexicalIndex
+from local_store import LocalStore
+
+
+class SimulatedEmbeddings(Embeddings):
+    """Looks the question up in `vectors` and sleeps like a CPU forward pass would."""
+    def __init__(self, vectors, call_overhead, per_text):
+        self.vectors = vectors
+        self.call_overhead = call_overhead
+        self.per_text = per_text
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        time.sleep(self.call_overhead + self.per_text * len(texts))
+        return [self.vectors[text].tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def load_store(client, vectors, sources, rng):
+    client.create_collection(collection_name="bench", vectors_config=VectorParams(size=vectors.shape[1], distance=Distance.COSINE))
+    chunks = []
+    for start in range(0, len(vectors), 256):
+        points = []
+        for i in range(start, min(start + 256, len(vectors))):
+            pid, text = str(uuid.uuid4()), make_text(rng, 60)
+            points.append(PointStruct(id=pid, vector=vectors[i].tolist(), payload={
+                "page_content": text, "metadata": {"source": f"source_{sources[i]}", "document": str(i // 20)}}))
+            chunks.append((pid, text, f"source_{sources[i]}"))
+        client.upsert(collection_name="bench", points=points)
+    return LexicalIndex.build(chunks)
+
+
+def sequential(client, embeddings, lexical, questions, llm_latency, k):
+    for question, source in questions:
+        vector = embeddings.embed_query(question)
+        points = client.search(collection_name="bench", query_vector=vector, query_filter=source_filter(source),
+                                limit=k, with_payload=True)
+        hybrid_search([point_document(p, "bench") for p in points], lexical, client, "bench", question, k=k, source=source)
+        time.sleep(llm_latency)
+
+
+async def batch(client, embeddings, lexical, questions, llm_latency, k, parallelism):
+    runner = PipelineRunner(max_inflight=max(parallelism, 1))
+    texts = [q for q, _ in questions]
+    start = time.perf_counter()
+    vectors = embeddings.embed_queries(texts)
+    contexts = batch_hybrid_search(client, "bench", texts, vectors, [s for _, s in questions], lexical, k=k)
+    retrieved = time.perf_counter()
+    answers = await runner.run_many(lambda item: time.sleep(llm_latency), contexts, parallelism)
+    assert not any(isinstance(a, Exception) for a in answers)
+    return retrieved - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=64)
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--embed-overhead", type=float, default=0.03, help="seconds per model call")
+    parser.add_argument("--embed-per-text", type=float, default=0.002, help="seconds per text in a call")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--parallelism", type=int, default=2)
+    parser.add_argument("--qdrant", action="store_true", help="in-process Qdrant (local mode) instead of LocalStore")
+    args = parser.parse_args()
+
+    vectors, sources = make_collection(args.points, args.sources, 384)
+    rng = np.random.default_rng(1)
+    questions, question_vectors = [], {}
+    for n, row in enumerate(rng.integers(0, args.points, size=args.questions)):
+        query = vectors[row] + 0.5 * rng.normal(size=384).astype(np.float32) / np.sqrt(384)
+        question_vectors[f"pregunta {n}"] = (query / np.linalg.norm(query)).astype(np.float32)
+        questions.append((f"pregunta {n}", f"source_{sources[row]}"))
+
+    path = tempfile.mkdtemp(prefix="bench_batch_")
+    try:
+        if args.qdrant:
+            from qdrant_client import QdrantClient
+            client = QdrantClient(":memory:")
+        else:
+            client = LocalStore(path)
+        lexical = load_store(client, vectors, sources, random.Random(0))
+        print(f"{args.questions} questions, {args.points} chunks ({'qdrant local mode' if args.qdrant else 'LocalStore'}), "
+              f"embedding {args.embed_overhead * 1000:.0f} ms/call + {args.embed_per_text * 1000:.0f} ms/text, "
+              f"LLM {args.llm_latency:.2f} s/answer")
+
+        model = SimulatedEmbeddings(question_vectors, args.embed_overhead, args.embed_per_text)
+        embeddings = CachedEmbeddings(model, "bench", cache_dir=None)
+        start = time.perf_counter()
+        sequential(client, embeddings, lexical, questions, args.llm_latency, args.k)
+        seconds = time.perf_counter() - start
+        print(f"sequential /ask: {seconds:6.2f}s  {args.questions * 60 / seconds:7.1f} questions/min  "
+              f"({model.calls} embedding calls)")
+
+        for parallelism in sorted({1, args.parallelism}):
+            model = SimulatedEmbeddings(question_vectors, args.embed_overhead, args.embed_per_text)
+            embeddings = CachedEmbeddings(model, "bench", cache_dir=None)
+            start = time.perf_counter()
+            retrieve_seconds = asyncio.run(batch(client, embeddings, lexical, questions, args.llm_latency, args.k, parallelism))
+            seconds = time.perf_counter() - start
+            print(f"/ask/batch x{parallelism}:  {seconds:6.2f}s  {args.questions * 60 / seconds:7.1f} questions/min  "
+                  f"({model.calls} embedding call, retrieval {retrieve_seconds * 1000:.0f} ms)")
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
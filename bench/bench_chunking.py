@@ -0,0 +1,77 @@
+"""
+Chunking of load.py: the former RecursiveCharacterTextSplitter against chunking.Chunker.
+
+    recursive        RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200), one thread
+    sentences        Chunker in the loader process (CHUNK_WORKERS=1)
+    sentences-xN     Chunker with a pool of N processes over the segments of each document
+
+For each: chunks, MB/s of text, and the chunks longer than the model's window (what
+all-MiniLM-L6-v2 silently drops when embedding them), counted with the tokenizer of --model
+when it exists (otherwise with chunking's estimate). Texts are synthetic Spanish: --docs
+documents of --mb megabytes in total, plus one --large-mb book.
+
+    python bench/bench_chunking.py --mb 8 --large-mb 4 --workers 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunking import CHUNK_MAX_TOKENS, Chunker, load_tokenizer, token_starts
+from geco_stub import make_text
+
+
+def make_documents(rng, docs, mb, large_mb):
+    # make_text writes ~7 characters per word; paragraphs of 100-400 words
+    def document(chars):
+        paragraphs = []
+        while chars > 0:
+            paragraphs.append(make_text(rng, rng.randint(100, 400)))
+            chars -= len(paragraphs[-1]) + 2
+        return "\n\n".join(paragraphs)
+
+    texts = [document(mb * 2 ** 20 / docs) for _ in range(docs)]
+    if large_mb:
+        texts.append(document(large_mb * 2 ** 20))
+    return texts
+
+
+def run(name, split, texts, tokenizer, limit):
+    start = time.perf_counter()
+    chunks = [chunk for text in texts for chunk in split(text)]
+    seconds = time.perf_counter() - start
+    tokens = np.array([len(token_starts(chunk, tokenizer)) for chunk in chunks])
+    over = tokens > limit
+    mb = sum(len(text) for text in texts) / 2 ** 20
+    print(f"{name:>14}: {len(chunks):7d} chunks  {mb / seconds:6.2f} MB/s  tokens p50 {np.percentile(tokens, 50):5.0f} "
+          f"max {tokens.max():5d}  over {limit}: {over.mean():6.1%} of chunks, {(tokens[over] - limit).sum() / tokens.sum():6.1%} of tokens")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="./local_models/all-MiniLM-L6-v2")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--mb", type=float, default=8.0, help="megabytes of text over the --docs documents")
+    parser.add_argument("--large-mb", type=float, default=4.0, help="size of one extra large document (0 = none)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    tokenizer_path = os.path.join(args.model, "tokenizer.json")
+    tokenizer = load_tokenizer(tokenizer_path)
+    texts = make_documents(random.Random(0), args.docs, args.mb, args.large_mb)
+    print(f"{len(texts)} documents, {sum(map(len, texts)) / 2 ** 20:.1f} MB, "
+          f"tokens {'from ' + tokenizer_path if tokenizer else 'estimated'}")
+
+    recursive = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
+    run("recursive", recursive.split_text, texts, tokenizer, CHUNK_MAX_TOKENS)
+    for workers in sorted({1, args.workers}):
+        chunker = Chunker(tokenizer_path, workers=workers)
+        run("sentences" if workers == 1 else f"sentences-x{workers}",
+            lambda text: [text[start:end] for start, end in chunker.split(text)], texts, tokenizer, CHUNK_MAX_TOKENS)
+        chunker.close()
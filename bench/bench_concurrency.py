@@ -0,0 +1,93 @@
+"""
+/ask concurrency with a stub LLM: blocking call on the event loop vs. PipelineRunner.
+
+    python bench/bench_concurrency.py --requests 8 --latency 0.5 --max-inflight 8
+
+Also checks that identical in-flight questions are coalesced into one run and that
+requests beyond the queue limit get 503 + Retry-After.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from concurrency import Overloaded, PipelineRunner
+
+
+class QuestionRequest(BaseModel):
+    question: str
+
+
+def make_app(runner, latency, calls):
+    def stub_pipeline(question):
+        # Stands in for graph.invoke / the refine chain: blocks like a llama3 generation
+        with calls["lock"]:
+            calls["n"] += 1
+        time.sleep(latency)
+        return {"answer": f"respuesta a: {question}"}
+
+    app = FastAPI()
+
+    @app.exception_handler(Overloaded)
+    async def overloaded_handler(request: Request, exc: Overloaded):
+        return JSONResponse(status_code=503, content={"error": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+    @app.post("/ask-blocking")
+    async def ask_blocking(request: QuestionRequest):
+        return stub_pipeline(request.question)
+
+    @app.post("/ask")
+    async def ask(request: QuestionRequest):
+        return await runner.run(request.question, stub_pipeline, request.question)
+
+    return app
+
+
+async def fire(client, path, questions):
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(client.post(path, json={"question": q}) for q in questions))
+    return time.perf_counter() - start, responses
+
+
+async def main(args):
+    calls = {"n": 0, "lock": threading.Lock()}
+    runner = PipelineRunner(max_inflight=args.max_inflight, max_queue=args.max_queue, queue_timeout=args.queue_timeout)
+    app = make_app(runner, args.latency, calls)
+    distinct = [f"pregunta {i}" for i in range(args.requests)]
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=None) as client:
+        elapsed, _ = await fire(client, "/ask-blocking", distinct)
+        print(f"blocking on event loop : {args.requests} requests in {elapsed:5.2f}s")
+
+        elapsed, _ = await fire(client, "/ask", distinct)
+        print(f"PipelineRunner         : {args.requests} requests in {elapsed:5.2f}s (one run = {args.latency:.2f}s)")
+
+        calls["n"] = 0
+        elapsed, _ = await fire(client, "/ask", ["misma pregunta"] * args.requests)
+        print(f"identical questions    : {args.requests} requests in {elapsed:5.2f}s, {calls['n']} pipeline run(s)")
+
+        overload = [f"otra {i}" for i in range(args.max_inflight + args.max_queue + 5)]
+        elapsed, responses = await fire(client, "/ask", overload)
+        rejected = [r for r in responses if r.status_code == 503]
+        retry = rejected[0].headers.get("Retry-After") if rejected else None
+        print(f"overload               : {len(overload)} requests, {len(rejected)} rejected with 503 (Retry-After: {retry})")
+    print(runner.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--max-inflight", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=8)
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+"""
+Prompt tokens and answer latency: refine chain vs. one "stuff" call over packed context.
+
+For each question the same 5 retrieved chunks (1500 characters, 200 overlap) are answered with
+
+    refine   the RetrievalQA refine chain the QA service used: one LLM call per chunk
+    full     one call over the 5 chunks joined as they are (the old generate())
+    stuff    one call over pack_context(): question-relevant sentences within CONTEXT_TOKEN_BUDGET
+
+The LLM is simulated (fixed overhead + prefill time per prompt token + decode time per answer
+token) unless --ollama is given. Chunks come from the collection with --qdrant, otherwise
+from synthetic Spanish text; embeddings use --model when it exists, otherwise a
+deterministic fake (token and latency numbers stay valid, sentence choice does not).
+
+    python bench/bench_context_packing.py --questions 20
+    OLLAMA_HOST=http://localhost:11435 python bench/bench_context_packing.py --ollama --qdrant
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+from langchain.chains.question_answering import load_qa_chain
+from langchain.chains.question_answering.stuff_prompt import PROMPT as STUFF_PROMPT
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from context_packing import estimate_tokens, pack_context
+from geco_stub import make_text
+
+
+class SimulatedLLM(BaseChatModel):
+    """Sleeps like a local llama3 would for the prompt it gets and records the prompt sizes."""
+    overhead: float = 0.15
+    prefill_per_token: float = 0.002
+    decode_per_token: float = 0.04
+    answer_tokens: int = 120
+    prompts: list = []
+
+    @property
+    def _llm_type(self):
+        return "simulated"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = sum(estimate_tokens(str(m.content)) for m in messages)
+        self.prompts.append(tokens)
+        time.sleep(self.overhead + tokens * self.prefill_per_token + self.answer_tokens * self.decode_per_token)
+        answer = "respuesta " * self.answer_tokens
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+
+def synthetic_retrievals(n_questions, seed=0):
+    rng = random.Random(seed)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
+    retrievals = []
+    for q in range(n_questions):
+        chunks = splitter.split_text(make_text(rng, 2500))
+        start = rng.randrange(0, max(1, len(chunks) - 5))
+        docs = [Document(page_content=c, metadata={"document": str(q), "source": f"Documento_{q}.txt"})
+                for c in chunks[start:start + 5]]
+        rng.shuffle(docs)
+        question = " ".join(rng.sample(docs[0].page_content.split(), 8)) + "?"
+        retrievals.append((question, docs))
+    return retrievals
+
+
+def collection_retrievals(n_questions, embeddings):
+    from langchain_qdrant import Qdrant
+    from bench_router import sample_questions
+
+    vector_store = Qdrant.from_existing_collection(collection_name="corpus_gecko3", embedding=embeddings,
+                                                   url=os.getenv("QDRANT_HOST", "http://qdrant:6333"))
+    questions = sample_questions(vector_store.client, "corpus_gecko3", per_source=2)[:n_questions]
+    return [(q["question"], vector_store.similarity_search(q["question"], k=5)) for q in questions]
+
+
+def run_mode(mode, llm, embeddings, retrievals, refine_chain):
+    latencies, prompt_tokens, calls, packing = [], [], [], []
+    for question, docs in retrievals:
+        before = len(llm.prompts) if isinstance(llm, SimulatedLLM) else 0
+        start = time.perf_counter()
+        if mode == "refine":
+            refine_chain.run(input_documents=docs, question=question)
+        else:
+            if mode == "stuff":
+                pack_start = time.perf_counter()
+                context, _ = pack_context(docs, embeddings.embed_query(question), embeddings)
+                packing.append(time.perf_counter() - pack_start)
+            else:
+                context = "\n\n".join(doc.page_content for doc in docs)
+            prompt = STUFF_PROMPT.format_prompt(context=context, question=question)
+            if not isinstance(llm, SimulatedLLM):
+                llm.prompts.append(estimate_tokens(prompt.to_string()))
+            llm.invoke(prompt)
+        latencies.append(time.perf_counter() - start)
+        prompts = llm.prompts[before:] if isinstance(llm, SimulatedLLM) else []
+        calls.append(len(prompts) or 1)
+        prompt_tokens.append(sum(prompts))
+    line = (f"{mode:>7}: {np.mean(calls):4.1f} LLM calls  {np.mean(prompt_tokens):7.0f} prompt tokens  "
+            f"latency p50 {np.percentile(latencies, 50):6.2f}s  p95 {np.percentile(latencies, 95):6.2f}s")
+    if packing:
+        line += f"  (packing {np.mean(packing) * 1000:.0f} ms)"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--model", default="./local_models/all-MiniLM-L6-v2")
+    parser.add_argument("--qdrant", action="store_true", help="take questions and chunks from corpus_gecko3")
+    parser.add_argument("--ollama", action="store_true", help="use llama3 on OLLAMA_HOST instead of the simulated LLM")
+    args = parser.parse_args()
+
+    if os.path.exists(args.model):
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=args.model)
+    else:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        print(f"{args.model} not found: fake embeddings, sentence choice is arbitrary")
+        embeddings = DeterministicFakeEmbedding(size=384)
+
+    if args.ollama:
+        from langchain_ollama import ChatOllama
+        llm = ChatOllama(model="llama3", base_url=os.getenv("OLLAMA_HOST", "http://ollama:11434"))
+        llm.__dict__["prompts"] = []  # refine prompt sizes are not recorded with a real model
+    else:
+        llm = SimulatedLLM()
+
+    retrievals = collection_retrievals(args.questions, embeddings) if args.qdrant else synthetic_retrievals(args.questions)
+    refine_chain = load_qa_chain(llm, chain_type="refine")
+    print(f"{len(retrievals)} questions, 5 chunks each")
+    for mode in ("refine", "full", "stuff"):
+        run_mode(mode, llm, embeddings, retrievals, refine_chain)
@@ -0,0 +1,109 @@
+"""
+Parity and throughput of the embedding backends (embedding_backend.py) against fp32 torch.
+
+    parity      cosine similarity of every chunk and query vector to the fp32 one, and the
+                overlap of each query's top --k chunks (by cosine) with the fp32 top --k;
+                exits with status 1 when a backend's minimum cosine or mean overlap falls
+                below --min-cosine / --min-overlap
+    ingestion   embed_documents over all chunks in EMBED_BATCH_SIZE calls, as load.py does
+                (texts/s, and the share of model input that was padding)
+    query       one embed_query per question (p50/p95 latency), as /ask does
+
+Chunks are synthetic Spanish text (1500 characters, like load.py); questions are sentences
+cut from random chunks. Needs the saved model, sentence-transformers, onnxruntime and torch
+(the Docker image has them; the int8 ONNX file is exported when missing).
+
+    python bench/bench_embeddings.py --model ./local_models/all-MiniLM-L6-v2 --threads 4
+    python bench/bench_embeddings.py --backends onnx-int8 --chunks 2000 --queries 200
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+
+from embedding_backend import BACKENDS, make_embeddings
+from geco_stub import make_text
+
+
+def make_inputs(n_chunks, n_queries, seed=0):
+    rng = random.Random(seed)
+    chunks = [make_text(rng, rng.randint(80, 260))[:1500] for _ in range(n_chunks)]
+    queries = []
+    while len(queries) < n_queries:
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", rng.choice(chunks)) if len(s.split()) >= 5]
+        if sentences:
+            queries.append(rng.choice(sentences))
+    return chunks, queries
+
+
+def normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def top_k(chunk_vectors, query_vectors, k):
+    return np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :k]
+
+
+def measure(embeddings, chunks, queries, batch_size):
+    start = time.perf_counter()
+    chunk_vectors = []
+    for i in range(0, len(chunks), batch_size):
+        chunk_vectors.extend(embeddings.embed_documents(chunks[i:i + batch_size]))
+    ingest_seconds = time.perf_counter() - start
+
+    query_vectors, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(query))
+        latencies.append(time.perf_counter() - start)
+    return normalized(chunk_vectors), normalized(query_vectors), ingest_seconds, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="./local_models/all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=0, help="0 = library default")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBED_BATCH_SIZE", "64")))
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--min-overlap", type=float, default=0.8)
+    args = parser.parse_args()
+
+    chunks, queries = make_inputs(args.chunks, args.queries)
+    print(f"{len(chunks)} chunks, {len(queries)} queries, batches of {args.batch_size}, "
+          f"{args.threads or 'default'} threads")
+
+    reference = None
+    failed = []
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        embeddings = make_embeddings(args.model, backend, args.threads)
+        embeddings.embed_query("warm-up")
+        chunk_vectors, query_vectors, ingest_seconds, latencies = measure(embeddings, chunks, queries, args.batch_size)
+        line = (f"{backend:>10}: ingestion {len(chunks) / ingest_seconds:7.1f} texts/s  "
+                f"query p50 {np.percentile(latencies, 50) * 1000:6.2f} ms  p95 {np.percentile(latencies, 95) * 1000:6.2f} ms")
+        if hasattr(embeddings, "padding_ratio"):
+            line += f"  padding {embeddings.padding_ratio():5.1%}"
+        if reference is None:
+            reference = (chunk_vectors, query_vectors, top_k(chunk_vectors, query_vectors, args.k), ingest_seconds)
+        else:
+            cosines = np.concatenate([(chunk_vectors * reference[0]).sum(axis=1), (query_vectors * reference[1]).sum(axis=1)])
+            hits = top_k(chunk_vectors, query_vectors, args.k)
+            overlap = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(hits, reference[2])])
+            line += (f"  x{reference[3] / ingest_seconds:4.2f} ingestion  cosine min {cosines.min():.4f} "
+                     f"mean {cosines.mean():.4f}  top-{args.k} overlap {overlap:5.1%}")
+            if cosines.min() < args.min_cosine or overlap < args.min_overlap:
+                failed.append(backend)
+        print(line)
+
+    if failed:
+        sys.exit(f"Parity below --min-cosine {args.min_cosine} / --min-overlap {args.min_overlap}: {', '.join(failed)}")
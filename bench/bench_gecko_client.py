@@ -0,0 +1,83 @@
+"""
+Sequential vs. pooled/concurrent document fetch against the local GECO stand-in.
+
+With --mirror, the same documents also go through geco_mirror.GECOMirror: the first run
+downloads and compresses them, the second revalidates them (ETag, 304 responses) and the
+third reads them offline from disk.
+
+    python bench/bench_gecko_client.py --docs 100 --latency 0.05 --workers 1 8 16
+    python bench/bench_gecko_client.py --docs 200 --words 20000 --workers 8 --mirror
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+from geco_mirror import GECOMirror
+from gecko_client import GECOClient
+from geco_stub import GECOStub, make_corpora
+
+
+def fetch_all(client, corpus_id, doc_ids):
+    failed = 0
+    for _, response in client.get_corpus_texts(corpus_id, doc_ids):
+        if isinstance(response, Exception):
+            failed += 1
+    return failed
+
+
+def fetch_mirrored(mirror, client, corpus_id, documents):
+    failed = 0
+    for _, text in mirror.fetch_texts(client, corpus_id, documents):
+        if isinstance(text, Exception):
+            failed += 1
+    mirror.save()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--words", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--token-ttl", type=float, default=None)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--mirror", action="store_true", help="also time the GECO mirror (download, revalidate, offline)")
+    args = parser.parse_args()
+
+    corpora = make_corpora(1, args.docs, args.words)
+    doc_ids = [d["id"] for d in corpora[1]["documents"]]
+    with GECOStub(corpora, latency=args.latency, fail_rate=args.fail_rate, token_ttl=args.token_ttl) as stub:
+        for workers in args.workers:
+            client = GECOClient("usuario_anonimo", "2024anonimo", base_url=stub.url,
+                                max_workers=workers, backoff_factor=0.01)
+            start = time.perf_counter()
+            failed = fetch_all(client, "1", doc_ids)
+            elapsed = time.perf_counter() - start
+            client.close()
+            print(f"workers={workers:3d}  docs={len(doc_ids)}  failed={failed}  "
+                  f"{elapsed:6.2f}s  {len(doc_ids) / elapsed:8.1f} docs/s")
+        print(f"stub requests={stub.requests} tokens issued={stub.tokens_issued}")
+
+        if args.mirror:
+            path = tempfile.mkdtemp(prefix="bench_geco_mirror_")
+            documents = {str(d["id"]): d for d in corpora[1]["documents"]}
+            client = GECOClient("usuario_anonimo", "2024anonimo", base_url=stub.url,
+                                max_workers=max(args.workers), backoff_factor=0.01)
+            try:
+                for run, run_client in (("download", client), ("revalidate", client), ("offline", None)):
+                    mirror = GECOMirror(path)
+                    requests = stub.requests
+                    start = time.perf_counter()
+                    failed = fetch_mirrored(mirror, run_client, "1", documents)
+                    elapsed = time.perf_counter() - start
+                    print(f"mirror {run:>10}  docs={len(documents)}  failed={failed}  {elapsed:6.2f}s  "
+                          f"{len(documents) / elapsed:8.1f} docs/s  requests={stub.requests - requests}  {mirror.stats()}")
+            finally:
+                client.close()
+                shutil.rmtree(path, ignore_errors=True)
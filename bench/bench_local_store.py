@@ -0,0 +1,118 @@
+"""
+Recall and latency of the embedded vector engine (local_store.py) against exact float32 search.
+
+Writes the same synthetic collection (clustered 384-d vectors, one cluster per `source`)
+with each storage dtype, then runs the same queries unfiltered and filtered by `source`.
+Recall@k is measured against a brute-force float32 search over the original vectors.
+When hnswlib is installed an HNSW graph is built and measured as well.
+
+    python bench/bench_local_store.py --points 100000 --queries 200
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+import local_store
+from local_store import LocalStore
+
+
+def make_collection(n_points, n_sources, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_sources, dim)).astype(np.float32)
+    sources = rng.integers(0, n_sources, size=n_points)
+    vectors = centers[sources] + 1.5 * rng.normal(size=(n_points, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, sources
+
+
+def exact_top_k(vectors, query, k, rows=None):
+    scores = (vectors if rows is None else vectors[rows]) @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top if rows is None else rows[top]
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) * 1000
+
+
+def measure(store, vectors, sources, queries, k, filtered):
+    ids = store._collection("bench").ids
+    latencies, recalls = [], []
+    for query, source in queries:
+        query_filter = {"source": f"source_{source}"} if filtered else None
+        start = time.perf_counter()
+        points = store.search("bench", query, query_filter=query_filter, limit=k, with_payload=False)
+        latencies.append(time.perf_counter() - start)
+        rows = np.flatnonzero(sources == source) if filtered else None
+        truth = {str(uuid.UUID(bytes=bytes(ids[i]))) for i in exact_top_k(vectors, query, k, rows)}
+        recalls.append(len(truth & {p.id for p in points}) / k)
+    return np.mean(recalls), percentile(latencies, 50), percentile(latencies, 95)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=100000)
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=256)
+    args = parser.parse_args()
+
+    vectors, sources = make_collection(args.points, args.sources, args.dim)
+    rng = np.random.default_rng(1)
+    queries = []
+    for row in rng.integers(0, args.points, size=args.queries):
+        query = vectors[row] + 0.5 * rng.normal(size=args.dim).astype(np.float32) / np.sqrt(args.dim)
+        queries.append(((query / np.linalg.norm(query)).astype(np.float32), sources[row]))
+
+    start = time.perf_counter()
+    for query, _ in queries:
+        exact_top_k(vectors, query, args.k)
+    print(f"{args.points} points x {args.dim}, {args.sources} sources, {args.queries} queries, k={args.k}")
+    print(f"exact float32 numpy (in RAM): {(time.perf_counter() - start) / args.queries * 1000:.2f} ms/query\n")
+
+    print(f"{'dtype':>8} {'write/s':>9} {'MB':>7} | {'unfiltered':>10} {'p50 ms':>8} {'p95 ms':>8} | {'filtered':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    configs = [("float32", False), ("float16", False), ("int8", False)]
+    if local_store.hnswlib is not None:
+        configs.append(("float16", True))
+    for dtype, hnsw in configs:
+        path = tempfile.mkdtemp(prefix="bench_local_store_")
+        try:
+            store = LocalStore(path, dtype=dtype)
+            store.create_collection("bench", VectorParams(size=args.dim, distance=Distance.COSINE))
+            start = time.perf_counter()
+            for i in range(0, args.points, args.batch):
+                store.upsert("bench", [
+                    PointStruct(id=str(uuid.uuid4()), vector=vectors[j].tolist(),
+                                payload={"page_content": "", "metadata": {"source": f"source_{sources[j]}", "corpus_id": "1"}})
+                    for j in range(i, min(i + args.batch, args.points))
+                ])
+            write_rate = args.points / (time.perf_counter() - start)
+            if hnsw:
+                local_store.HNSW_MIN_POINTS = 0
+                store.optimize("bench")
+            store.close()
+            size = sum(os.path.getsize(os.path.join(path, "bench", f)) for f in os.listdir(os.path.join(path, "bench")))
+
+            reader = LocalStore(path)
+            unfiltered = measure(reader, vectors, sources, queries, args.k, filtered=False)
+            filtered = measure(reader, vectors, sources, queries, args.k, filtered=True)
+            reader.close()
+            name = dtype + ("+hnsw" if hnsw else "")
+            print(f"{name:>8} {write_rate:9.0f} {size / 2**20:7.1f} | "
+                  f"{unfiltered[0]:10.3f} {unfiltered[1]:8.2f} {unfiltered[2]:8.2f} | "
+                  f"{filtered[0]:9.3f} {filtered[1]:8.2f} {filtered[2]:8.2f}")
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    if local_store.hnswlib is None:
+        print("\nhnswlib not installed: HNSW not measured (pip install hnswlib)")
@@ -0,0 +1,258 @@
+"""
+Host memory of the backend deployments: RSS and PSS (proportional set size: a page shared
+by n processes counts 1/n in each, so the sum over the processes is what the host pays) of
+every process a deployment runs, after startup and --requests questions per port.
+
+    two-services     langchain-app/main.py and langchain-app-qa/main.py, one process each
+                     (the former langchain-backend and langchain-backend-qa containers)
+    unified          serve.py with one worker: graph, refine and stuff in one process
+    unified-xN       N independent single-worker processes (N replicas, or uvicorn --workers N,
+                     which spawns the workers instead of forking them)
+    forked-xN        serve.py with WEB_WORKERS=N: workers forked after the model is loaded
+    forked-xN-lazy   the same with EMBEDDING_PRELOAD=false (only the libraries are shared)
+
+By default everything is offline like bench_suite.py: load.py fills a local store
+(VECTOR_BACKEND=local) from geco_stub, llama3 is ollama_stub and the embedding model is a
+stand-in holding --model-mb of weights (all-MiniLM-L6-v2 is ~90 MB in fp32; torch itself is
+not loaded, so the absolute numbers are lower than in the container). With --real the
+processes load the configured model and store (e.g. the repository mounted in the
+langchain-app image, next to Qdrant).
+
+    python bench/bench_memory.py --workers 4
+"""
+import argparse
+import json
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+from bench_suite import APP_DIR, SERVICES, FakeEmbeddings, install_fakes, make_questions, run_ingest
+from geco_stub import make_corpora
+from ollama_stub import OllamaStub
+
+SERVE = os.path.join(APP_DIR, "serve.py")
+# Stand-in model weights of this process (--child), kept referenced
+WEIGHTS = []
+
+
+# ==== Child processes ====
+
+def install_model_fakes(model_mb):
+    import langchain_community.embeddings
+    import langchain_huggingface
+
+    install_fakes(argparse.Namespace(embed_latency=0.0))
+
+    def embeddings(**kwargs):
+        # Written once when "loaded", then only read, like real weights
+        WEIGHTS.append(np.ones(int(model_mb * 2 ** 20) // 4, dtype=np.float32))
+        return FakeEmbeddings(size=384)
+
+    langchain_huggingface.HuggingFaceEmbeddings = embeddings
+    langchain_community.embeddings.HuggingFaceEmbeddings = embeddings
+
+    import embedding_backend
+
+    # The stand-in has no torch thread pool: the EMBEDDING_THREADS serve.py derives does not apply
+    make_embeddings = embedding_backend.make_embeddings
+    embedding_backend.make_embeddings = lambda model_path, backend="torch", threads=0: make_embeddings(model_path, backend, 0)
+
+
+def run_child(target, args):
+    if not args.real:
+        install_model_fakes(args.model_mb)
+    if target == "serve":
+        sys.argv = [SERVE]
+        runpy.run_path(SERVE, run_name="__main__")
+        return
+    import uvicorn
+
+    # What the service's Dockerfile runs: uvicorn main:app
+    app = runpy.run_path(SERVICES[target], run_name="bench_service")["app"]
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ["PORT"]), log_level="warning")
+
+
+# ==== Measurements ====
+
+def free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(root):
+    """`root` and all its descendants."""
+    parents = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    # The command name may contain spaces; the fields after it do not
+                    parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree = [root]
+    for pid in tree:
+        tree.extend(child for child, parent in parents.items() if parent == pid)
+    return tree
+
+
+def memory_mb(pid):
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key.lower()] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return values
+
+
+def wait_ready(url, workers, timeout):
+    # Every request opens a new connection, so with forked workers it lands on any of them;
+    # 2 x workers ready answers in a row make it likely they all are
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while streak < 2 * workers:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+        try:
+            streak = streak + 1 if httpx.get(f"{url}/readyz", timeout=5).status_code == 200 else 0
+        except httpx.HTTPError:
+            streak = 0
+        if streak == 0:
+            time.sleep(0.2)
+
+
+def ask(url, questions, pipelines):
+    errors = 0
+    for i, question in enumerate(questions):
+        body = {"question": question}
+        if pipelines:
+            body["pipeline"] = pipelines[i % len(pipelines)]
+        try:
+            response = httpx.post(f"{url}/ask", json=body, timeout=120)
+            errors += response.status_code != 200 or "error" in response.json()
+        except httpx.HTTPError:
+            errors += 1
+    return errors
+
+
+def deployments(workers):
+    """name -> [(child target, extra environment, worker processes, pipelines to ask)]"""
+    all_pipelines = ["graph", "refine", "stuff"]
+    return {
+        "two-services": [("main", {}, 1, ["graph"]), ("qa", {}, 1, [])],
+        "unified": [("serve", {"WEB_WORKERS": "1"}, 1, all_pipelines)],
+        f"unified-x{workers}": [("serve", {"WEB_WORKERS": "1"}, 1, all_pipelines)] * workers,
+        f"forked-x{workers}": [("serve", {"WEB_WORKERS": str(workers)}, workers, all_pipelines)],
+        f"forked-x{workers}-lazy": [("serve", {"WEB_WORKERS": str(workers), "EMBEDDING_PRELOAD": "false"},
+                                     workers, all_pipelines)],
+    }
+
+
+def measure(name, processes, questions, args):
+    launched = []
+    try:
+        for target, env, workers, pipelines in processes:
+            port = free_port()
+            child_env = {**os.environ, **env, "HOST": "127.0.0.1", "PORT": str(port)}
+            command = [sys.executable, os.path.abspath(__file__), "--child", target, "--model-mb", str(args.model_mb)]
+            if args.real:
+                command.append("--real")
+            launched.append((subprocess.Popen(command, env=child_env, stdout=subprocess.DEVNULL),
+                             f"http://127.0.0.1:{port}", workers, pipelines))
+        start = time.perf_counter()
+        for popen, url, workers, _ in launched:
+            wait_ready(url, workers, args.timeout)
+        ready = time.perf_counter() - start
+        errors = sum(ask(url, questions, pipelines) for _, url, _, pipelines in launched)
+        time.sleep(args.settle)
+        pids = [pid for popen, *_ in launched for pid in process_tree(popen.pid)]
+        usage = [memory_mb(pid) for pid in pids]
+        return {
+            "deployment": name,
+            "processes": len(pids),
+            "rss_mb": round(sum(u.get("rss", 0) for u in usage), 1),
+            "pss_mb": round(sum(u.get("pss", 0) for u in usage), 1),
+            "ready_s": round(ready, 2),
+            "errors": errors,
+        }
+    finally:
+        for popen, *_ in launched:
+            popen.terminate()
+        for popen, *_ in launched:
+            try:
+                popen.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                popen.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--deployment", nargs="+", help="subset of the deployments to measure")
+    parser.add_argument("--model-mb", type=float, default=90.0, help="stand-in model weights per loaded model (offline)")
+    parser.add_argument("--requests", type=int, default=12, help="/ask questions per port before measuring")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds between the last answer and the measurement")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds a deployment may take to get ready")
+    parser.add_argument("--real", action="store_true", help="the configured model and store instead of the offline stand-ins")
+    parser.add_argument("--corpora", type=int, default=2)
+    parser.add_argument("--docs", type=int, default=20, help="documents per corpus")
+    parser.add_argument("--words", type=int, default=2000, help="words per document")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--child", choices=["main", "qa", "serve"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args)
+        sys.exit(0)
+
+    workdir = None
+    stubs = []
+    if not args.real:
+        workdir = tempfile.mkdtemp(prefix="bench_memory_")
+        os.environ.update(VECTOR_BACKEND="local", EMBEDDING_CACHE_DIR=os.path.join(workdir, "embedding_cache"),
+                          LOCAL_STORE_PATH=os.path.join(workdir, "vector_store"),
+                          LEXICAL_INDEX_PATH=os.path.join(workdir, "lexical_index"),
+                          SECTION_ROUTER_PATH=os.path.join(workdir, "section_router.npz"),
+                          MANIFEST_PATH=os.path.join(workdir, "manifest.json"),
+                          INGEST_EPOCH_PATH=os.path.join(workdir, "ingest_epoch.json"), WARMUP_OLLAMA="false")
+        os.chdir(workdir)
+        install_fakes(argparse.Namespace(embed_latency=0.0))
+        ingest = run_ingest(make_corpora(args.corpora, args.docs, args.words),
+                            argparse.Namespace(geco_latency=0.0))
+        print(f"Ingested {ingest['documents']} documents, {ingest['chunks']} chunks")
+        stubs = [OllamaStub(latency=0.01, parallel=8).start()]
+        os.environ["OLLAMA_HOSTS"] = stubs[0].url
+
+    questions = make_questions(args.requests)
+    results = []
+    try:
+        for name, processes in deployments(args.workers).items():
+            if args.deployment and name not in args.deployment:
+                continue
+            result = measure(name, processes, questions, args)
+            results.append(result)
+            print(f"{name:>18}: {result['processes']:2d} processes  PSS {result['pss_mb']:8.1f} MB  "
+                  f"RSS {result['rss_mb']:8.1f} MB  ready {result['ready_s']:5.1f}s  errors {result['errors']}")
+    finally:
+        for stub in stubs:
+            stub.stop()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k not in ("output", "child")}, "results": results},
+                      f, ensure_ascii=False, indent=2)
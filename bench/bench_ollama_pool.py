@@ -0,0 +1,83 @@
+"""
+Throughput of ollama_pool.OllamaPool over local Ollama stubs (bench/ollama_stub.py) with
+different latencies, against the first stub alone (the single OLLAMA_HOST setup).
+
+    single     every call to the first stub
+    pool       the same calls over all stubs (per-node share shows least-outstanding-work
+               scheduling sending more to the faster ones)
+    failover   the pool again, with the first stub stopped after --kill-after calls: calls
+               in flight there fail over to another node and the rest avoid it (errors should
+               stay 0)
+
+Each stub serves --parallel calls at once, like OLLAMA_NUM_PARALLEL.
+
+    python bench/bench_ollama_pool.py --latencies 0.2 0.2 0.4 --calls 120 --concurrency 12
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+
+from ollama_pool import OllamaPool
+from ollama_stub import OllamaStub
+
+
+def run(pool, calls, concurrency, on_call=None):
+    latencies, errors = [], 0
+
+    def call(i):
+        nonlocal errors
+        if on_call is not None:
+            on_call(i)
+        start = time.perf_counter()
+        try:
+            pool.invoke(f"Pregunta {i}: ¿qué es el método de los elementos finitos?")
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(call, range(calls)))
+    return time.perf_counter() - start, latencies, errors
+
+
+def report(name, calls, seconds, latencies, errors, pool):
+    share = "  ".join(f"{n['host'].rsplit(':', 1)[1]}:{n['requests']}" for n in pool.stats())
+    print(f"{name:>9}: {calls / seconds:6.2f} calls/s  p50 {np.percentile(latencies, 50) * 1000:6.0f} ms  "
+          f"p95 {np.percentile(latencies, 95) * 1000:6.0f} ms  errors {errors}  calls per node {share}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencies", type=float, nargs="+", default=[0.2, 0.2, 0.4], help="seconds per call, one per stub")
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument("--calls", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=12)
+    parser.add_argument("--kill-after", type=int, default=30)
+    args = parser.parse_args()
+
+    stubs = [OllamaStub(latency=latency, parallel=args.parallel).start() for latency in args.latencies]
+    print(f"{len(stubs)} stubs ({', '.join(f'{s.url} {l}s' for s, l in zip(stubs, args.latencies))}), "
+          f"{args.calls} calls, {args.concurrency} at a time")
+
+    single = OllamaPool(hosts=[stubs[0].url], health_interval=0)
+    report("single", args.calls, *run(single, args.calls, args.concurrency), single)
+
+    pool = OllamaPool(hosts=[s.url for s in stubs], health_interval=1.0)
+    report("pool", args.calls, *run(pool, args.calls, args.concurrency), pool)
+
+    pool = OllamaPool(hosts=[s.url for s in stubs], health_interval=1.0)
+
+    def kill(i):
+        if i == args.kill_after:
+            stubs[0].stop()
+
+    report("failover", args.calls, *run(pool, args.calls, args.concurrency, kill), pool)
+    for stub in stubs[1:]:
+        stub.stop()
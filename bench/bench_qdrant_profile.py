@@ -0,0 +1,114 @@
+"""
+Filtered-search latency of a plain collection vs. one with the collection profile (collection_profile.py).
+
+Loads the same synthetic points (clustered 384-d vectors, `metadata.source` / `corpus_id` /
+`document` payloads like load.py writes) into two collections:
+
+    bench_plain     VectorParams(size=384, COSINE) only, as load.py used to create it
+    bench_profiled  payload indexes, HNSW settings, int8 quantization; queried with search_params()
+
+and reports upsert throughput, p50/p95 of searches filtered on `metadata.source`, and recall@k
+against exact search. Needs a Qdrant server for meaningful numbers; without --url it runs
+in-process (qdrant-client local mode), which ignores indexes and quantization and only
+checks that the profile applies.
+
+    docker run -p 6333:6333 qdrant/qdrant
+    python bench/bench_qdrant_profile.py --url http://localhost:6333 --points 200000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, FieldCondition, Filter, MatchValue, PointStruct, SearchParams, VectorParams
+
+import collection_profile
+from bench_local_store import make_collection
+
+
+def load(qdrant, collection_name, vectors, sources, batch_size, parallelism):
+    def upsert(start):
+        qdrant.upsert(collection_name=collection_name, points=[
+            PointStruct(id=str(uuid.UUID(int=i)), vector=vectors[i].tolist(),
+                        payload={"page_content": "", "metadata": {
+                            "source": f"source_{sources[i]}", "corpus_id": str(sources[i] % 5), "document": str(i // 20)}})
+            for i in range(start, min(start + batch_size, len(vectors)))
+        ])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(parallelism) as pool:
+        list(pool.map(upsert, range(0, len(vectors), batch_size)))
+    return len(vectors) / (time.perf_counter() - start)
+
+
+def wait_until_indexed(qdrant, collection_name, timeout=600):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        info = qdrant.get_collection(collection_name=collection_name)
+        if str(info.status).lower().endswith("green"):
+            return time.perf_counter() - start
+        time.sleep(0.5)
+    return None
+
+
+def measure(qdrant, collection_name, queries, k, search_params=None):
+    latencies, results = [], []
+    for query, source in queries:
+        query_filter = Filter(must=[FieldCondition(key="metadata.source", match=MatchValue(value=f"source_{source}"))])
+        start = time.perf_counter()
+        points = qdrant.query_points(collection_name=collection_name, query=query.tolist(), query_filter=query_filter,
+                                     limit=k, search_params=search_params, with_payload=False).points
+        latencies.append(time.perf_counter() - start)
+        results.append({str(p.id) for p in points})
+    return results, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 95) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Qdrant server; in-process local mode when omitted")
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--sources", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=int(os.getenv("UPSERT_BATCH_SIZE", "256")))
+    parser.add_argument("--parallelism", type=int, default=int(os.getenv("UPSERT_PARALLELISM", "2")))
+    args = parser.parse_args()
+
+    qdrant = QdrantClient(url=args.url, timeout=600) if args.url else QdrantClient(":memory:")
+    if not args.url:
+        args.parallelism = 1  # local mode is not safe for concurrent writes
+    vectors, sources = make_collection(args.points, args.sources, 384)
+    rng = np.random.default_rng(1)
+    queries = []
+    for row in rng.integers(0, args.points, size=args.queries):
+        query = vectors[row] + 0.5 * rng.normal(size=384).astype(np.float32) / np.sqrt(384)
+        queries.append(((query / np.linalg.norm(query)).astype(np.float32), sources[row]))
+
+    for name in ("bench_plain", "bench_profiled"):
+        if qdrant.collection_exists(collection_name=name):
+            qdrant.delete_collection(collection_name=name)
+    qdrant.create_collection(collection_name="bench_plain", vectors_config=VectorParams(size=384, distance=Distance.COSINE))
+    collection_profile.create_collection(qdrant, "bench_profiled", bulk_load=True)
+    collection_profile.apply_profile(qdrant, "bench_profiled")
+
+    print(f"{args.points} points, {args.sources} sources, {args.queries} filtered queries, k={args.k}"
+          + ("" if args.url else "  (in-process local mode: indexes and quantization are not used)"))
+    plain_rate = load(qdrant, "bench_plain", vectors, sources, args.batch, 1)
+    profiled_rate = load(qdrant, "bench_profiled", vectors, sources, args.batch, args.parallelism)
+    collection_profile.finish_bulk_load(qdrant, "bench_profiled")
+    print(f"upsert: plain {plain_rate:.0f} points/s (1 worker), profiled {profiled_rate:.0f} points/s "
+          f"({args.parallelism} workers, batch {args.batch}, indexing deferred)")
+    if args.url:
+        for name in ("bench_plain", "bench_profiled"):
+            print(f"{name} indexed in {wait_until_indexed(qdrant, name):.1f}s")
+
+    exact, _, _ = measure(qdrant, "bench_plain", queries, args.k, SearchParams(exact=True))
+    for name, params in (("bench_plain", None), ("bench_profiled", collection_profile.search_params())):
+        results, p50, p95 = measure(qdrant, name, queries, args.k, params)
+        recall = np.mean([len(r & e) / args.k for r, e in zip(results, exact)])
+        print(f"{name:>15}: filtered search p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  recall@{args.k} {recall:.3f}")
@@ -0,0 +1,122 @@
+"""
+Offline accuracy/latency of the centroid section router vs. the llama3 structured-output router.
+
+Questions are either a labeled JSONL file ({"question": ..., "source": ...} per line) or are
+sampled from the collection itself: one sentence from random chunks, labeled with the
+chunk's `source`.
+
+    QDRANT_HOST=http://localhost:6333 python bench/bench_router.py --per-source 20
+    OLLAMA_HOST=http://localhost:11435 python bench/bench_router.py --llm --questions labeled.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+import numpy as np
+from qdrant_client import QdrantClient
+from typing_extensions import Annotated, Literal, TypedDict
+
+from section_router import SectionRouter
+
+
+def sample_questions(qdrant, collection_name, per_source, seed=0):
+    by_source = {}
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(collection_name=collection_name, limit=1024, offset=offset, with_payload=True)
+        for point in points:
+            metadata = point.payload.get("metadata", {})
+            by_source.setdefault(metadata.get("source"), []).append(point.payload.get("page_content", ""))
+        if offset is None:
+            break
+    rng = random.Random(seed)
+    questions = []
+    for source, texts in by_source.items():
+        for text in rng.sample(texts, min(per_source, len(texts))):
+            sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if len(s.split()) >= 6]
+            if sentences:
+                questions.append({"question": rng.choice(sentences), "source": source})
+    return questions
+
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def summarize(name, predictions, latencies):
+    routed = [(p, s) for p, s in predictions if p is not None]
+    correct = sum(1 for p, s in routed if p == s)
+    total = len(predictions)
+    print(f"{name:>10}: accuracy {correct / total:6.1%}  routed {len(routed) / total:6.1%}  "
+          f"precision when routed {correct / len(routed) if routed else 0:6.1%}  "
+          f"latency p50 {percentile(latencies, 50) * 1000:8.3f} ms  p95 {percentile(latencies, 95) * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", default="corpus_gecko3")
+    parser.add_argument("--model", default="./local_models/all-MiniLM-L6-v2")
+    parser.add_argument("--questions", help="labeled JSONL file; sampled from the collection when omitted")
+    parser.add_argument("--per-source", type=int, default=20)
+    parser.add_argument("--llm", action="store_true", help="also evaluate the llama3 router (needs Ollama)")
+    args = parser.parse_args()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    qdrant = QdrantClient(url=os.getenv("QDRANT_HOST", "http://qdrant:6333"))
+    embedding_model = HuggingFaceEmbeddings(model_name=args.model)
+
+    start = time.perf_counter()
+    router = SectionRouter.from_collection(qdrant, args.collection)
+    print(f"centroids for {len(router.sources)} sources built in {time.perf_counter() - start:.2f}s")
+
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [json.loads(line) for line in f if line.strip()]
+    else:
+        questions = sample_questions(qdrant, args.collection, args.per_source)
+    print(f"{len(questions)} questions")
+
+    vectors = embedding_model.embed_documents([q["question"] for q in questions])
+    predictions, latencies = [], []
+    for q, vector in zip(questions, vectors):
+        start = time.perf_counter()
+        source, _, _ = router.route(vector)
+        latencies.append(time.perf_counter() - start)
+        predictions.append((source, q["source"]))
+    summarize("centroid", predictions, latencies)
+
+    embed_latencies = []
+    for q in questions[:50]:
+        start = time.perf_counter()
+        embedding_model.embed_query(q["question"])
+        embed_latencies.append(time.perf_counter() - start)
+    print(f"{'(embed)':>10}: query embedding p50 {percentile(embed_latencies, 50) * 1000:.1f} ms "
+          "(shared with retrieval, so not an extra cost of routing)")
+
+    if args.llm:
+        from langchain_ollama import ChatOllama
+
+        class LLMSearch(TypedDict):
+            query: Annotated[str, ..., "Search query to run."]
+            section: Annotated[Literal[tuple(router.sources)], ..., "Section to query."]
+
+        llm = ChatOllama(model="llama3", base_url=os.getenv("OLLAMA_HOST", "http://ollama:11434"))
+        structured_llm = llm.with_structured_output(LLMSearch)
+        predictions, latencies = [], []
+        for q in questions:
+            start = time.perf_counter()
+            try:
+                section = (structured_llm.invoke(q["question"]) or {}).get("section")
+            except Exception as e:
+                print("llm router failed:", e)
+                section = None
+            latencies.append(time.perf_counter() - start)
+            predictions.append((section, q["source"]))
+        summarize("llm", predictions, latencies)
@@ -0,0 +1,310 @@
+"""
+Offline benchmark suite: ingestion throughput and /ask latency, written as JSON.
+
+Everything runs in this process, with no network beyond localhost and no models:
+
+    GECO API   geco_stub.GECOStub serving synthetic Spanish corpora (--corpora/--docs/--words)
+    embeddings DeterministicFakeEmbedding (384-d, one vector per text) with --embed-latency per text
+    llama3     --ollama-nodes ollama_stub.OllamaStub servers behind the services' OllamaPool, each answering
+               after --llm-latency seconds (+ --llm-per-token per prompt token), --ollama-parallel at once
+    vectors    VECTOR_BACKEND=qdrant: qdrant-client in-process mode shared by load.py and the service
+               VECTOR_BACKEND=local:  local_store.LocalStore in a temporary directory
+
+For each backend, load.py --full is run against the stub (docs/s, chunks/s and the per-stage
+pipeline rates), then the service app (langchain-app/main.py, or langchain-app-qa/main.py with
+--service qa) gets --requests distinct questions over ASGI, --concurrency at a time
+(p50/p95/p99 latency, requests/s, 503s and errors), after measuring its import time and the
+time until /readyz reports ready.
+
+    python bench/bench_suite.py --corpora 2 --docs 40 --requests 64 --concurrency 8
+    python bench/bench_suite.py --compare bench/results/<previous commit>.json
+
+Results go to bench/results/<commit>.json unless --output is given; --compare prints the
+ratio of every metric to an earlier result file.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+APP_DIR = os.path.join(ROOT, "langchain-app")
+SERVICES = {"main": os.path.join(APP_DIR, "main.py"), "qa": os.path.join(ROOT, "langchain-app-qa", "main.py")}
+sys.path.insert(0, APP_DIR)
+
+import httpx
+import numpy as np
+import qdrant_client
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from geco_stub import GECOStub, make_corpora, make_text
+from ollama_stub import OllamaStub
+
+# ==== Offline stand-ins ====
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    per_text: float = 0.0
+
+    def embed_documents(self, texts):
+        if self.per_text:
+            time.sleep(self.per_text * len(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class SharedQdrant(qdrant_client.QdrantClient):
+    """Every QdrantClient(...) built by load.py and the services is the same in-process instance."""
+    instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls.instance is None:
+            cls.instance = super().__new__(cls)
+            super().__init__(cls.instance, ":memory:")
+        return cls.instance
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def install_fakes(args):
+    import langchain_community.embeddings
+    import langchain_huggingface
+    import langchain_qdrant.vectorstores
+
+    def embeddings(**kwargs):
+        return FakeEmbeddings(size=384, per_text=args.embed_latency)
+
+    langchain_huggingface.HuggingFaceEmbeddings = embeddings
+    langchain_community.embeddings.HuggingFaceEmbeddings = embeddings
+    qdrant_client.QdrantClient = SharedQdrant
+    langchain_qdrant.vectorstores.QdrantClient = SharedQdrant
+
+
+def preload_libraries():
+    # Imported by load.py and the services; loaded once up front so the first backend does not pay for them
+    for name in ("fastapi", "langchain.chains", "langchain_community.document_loaders",
+                 "langchain_community.vectorstores", "langchain_text_splitters", "langgraph.graph"):
+        importlib.import_module(name)
+
+
+def reset_app_modules():
+    # The app modules read their environment at import time; re-import them for every backend.
+    # metrics stays: its collectors are registered once per process
+    for name, module in list(sys.modules.items()):
+        if name != "metrics" and os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "/")) == APP_DIR:
+            del sys.modules[name]
+    SharedQdrant.instance = None
+
+
+# ==== Measurements ====
+
+def percentiles(latencies):
+    return {f"p{p}_ms": round(float(np.percentile(latencies, p)) * 1000, 1) for p in (50, 95, 99)}
+
+
+def run_ingest(corpora, args):
+    with GECOStub(corpora, latency=args.geco_latency) as stub:
+        os.environ["GECO_API_URL"] = stub.url
+        sys.argv = ["load.py", "--full"]
+        start = time.perf_counter()
+        state = runpy.run_path(os.path.join(APP_DIR, "load.py"), run_name="__main__")
+        seconds = time.perf_counter() - start
+    documents = state["counts"]["embedded"]
+    chunks = state["qdrant"].count(collection_name=state["collection_name"]).count
+    return {
+        "documents": documents,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "docs_per_s": round(documents / seconds, 2),
+        "chunks_per_s": round(chunks / seconds, 1),
+        "stages": {s.name: {"items": s.items_out, "busy_s": round(s.busy, 3), "rate": round(s.rate(), 1)}
+                   for s in state["pipeline"].stats()},
+    }
+
+
+async def fire(app, questions, concurrency):
+    latencies, rejected, errors = [], 0, 0
+    limit = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as http:
+        async def ask(question):
+            nonlocal rejected, errors
+            async with limit:
+                start = time.perf_counter()
+                response = await http.post("/ask", json={"question": question})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code == 503:
+                    rejected += 1
+                elif response.status_code != 200 or "error" in response.json():
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(q) for q in questions))
+        seconds = time.perf_counter() - start
+    return latencies, rejected, errors, seconds
+
+
+async def wait_ready(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as http:
+        while True:
+            response = await http.get("/readyz")
+            if response.status_code == 200:
+                return response.json()
+            if response.json()["errors"]:
+                raise RuntimeError(f"service failed to start: {response.json()['errors']}")
+            await asyncio.sleep(0.01)
+
+
+def run_ask(service, questions, args):
+    start = time.perf_counter()
+    app = runpy.run_path(SERVICES[service], run_name="bench_service")["app"]
+    imported = time.perf_counter() - start
+
+    async def measure():
+        # One event loop for startup and both runs: the service's PipelineRunner binds its semaphore to it
+        async with app.router.lifespan_context(app):
+            status = await wait_ready(app)
+            ready = time.perf_counter() - start
+            await fire(app, [q + " (warm-up)" for q in questions[:args.concurrency]], args.concurrency)
+            return (ready, status) + await fire(app, questions, args.concurrency)
+
+    ready, status, latencies, rejected, errors, seconds = asyncio.run(measure())
+    return {
+        "service": service,
+        "requests": len(questions),
+        "concurrency": args.concurrency,
+        "import_s": round(imported, 3),
+        "ready_s": round(ready, 3),
+        "startup_steps": status["steps"],
+        **percentiles(latencies),
+        "mean_ms": round(float(np.mean(latencies)) * 1000, 1),
+        "requests_per_s": round(len(questions) / seconds, 2),
+        "rejected": rejected,
+        "errors": errors,
+    }
+
+
+def make_questions(n, seed=0):
+    rng = random.Random(seed)
+    return [f"¿{make_text(rng, rng.randint(6, 14)).rstrip('.')}?" for _ in range(n)]
+
+
+def run_backend(backend, corpora, questions, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench_suite_{backend}_")
+    cwd = os.getcwd()
+    os.environ.update(VECTOR_BACKEND=backend, EMBEDDING_CACHE_DIR=os.path.join(workdir, "embedding_cache"),
+                      LOCAL_STORE_PATH=os.path.join(workdir, "vector_store"),
+                      LEXICAL_INDEX_PATH=os.path.join(workdir, "lexical_index"),
+                      SECTION_ROUTER_PATH=os.path.join(workdir, "section_router.npz"),
+                      MANIFEST_PATH=os.path.join(workdir, "manifest.json"),
+                      # qdrant-client's in-process mode is not safe for concurrent writes
+                      UPSERT_PARALLELISM="1", WARMUP_OLLAMA="false")
+    try:
+        os.chdir(workdir)
+        reset_app_modules()
+        ingest = run_ingest(corpora, args)
+        ask = [run_ask(service, questions, args) for service in args.service]
+        return {"backend": backend, "ingest": ingest, "ask": ask}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ==== Results ====
+
+def git_revision():
+    def git(*cmd):
+        return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def flatten(results):
+    metrics = {}
+    for result in results:
+        backend = result["backend"]
+        for key in ("docs_per_s", "chunks_per_s"):
+            metrics[f"{backend}.ingest.{key}"] = result["ingest"][key]
+        for ask in result["ask"]:
+            for key in ("p50_ms", "p95_ms", "p99_ms", "requests_per_s"):
+                metrics[f"{backend}.{ask['service']}.{key}"] = ask[key]
+    return metrics
+
+
+def compare(current, previous):
+    before = flatten(previous["results"])
+    print(f"\nvs. {previous['commit']}{' (dirty)' if previous.get('dirty') else ''}:")
+    for name, value in flatten(current["results"]).items():
+        if before.get(name):
+            # Higher is better for rates, lower for latencies
+            better = value >= before[name] if name.endswith("_per_s") else value <= before[name]
+            print(f"  {name:<32} {before[name]:>10} -> {value:>10}  x{value / before[name]:.2f} {'' if better else '  <-- worse'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", nargs="+", choices=["qdrant", "local"], default=["qdrant", "local"])
+    parser.add_argument("--service", nargs="+", choices=list(SERVICES), default=["main"])
+    parser.add_argument("--corpora", type=int, default=2)
+    parser.add_argument("--docs", type=int, default=40, help="documents per corpus")
+    parser.add_argument("--words", type=int, default=2000, help="words per document")
+    parser.add_argument("--geco-latency", type=float, default=0.01, help="seconds per GECO API request")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per embedded text")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per LLM call")
+    parser.add_argument("--llm-per-token", type=float, default=0.0, help="extra seconds per prompt token")
+    parser.add_argument("--ollama-nodes", type=int, default=1, help="Ollama stubs in OLLAMA_HOSTS")
+    parser.add_argument("--ollama-parallel", type=int, default=4, help="calls each stub serves at once")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result file (default bench/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    install_fakes(args)
+    preload_libraries()
+    ollama = [OllamaStub(latency=args.llm_latency, prefill_per_token=args.llm_per_token, parallel=args.ollama_parallel).start()
+              for _ in range(args.ollama_nodes)]
+    os.environ["OLLAMA_HOSTS"] = ",".join(stub.url for stub in ollama)
+    corpora = make_corpora(args.corpora, args.docs, args.words, seed=args.seed)
+    questions = make_questions(args.requests, seed=args.seed)
+    results = []
+    for backend in args.backend:
+        result = run_backend(backend, corpora, questions, args)
+        results.append(result)
+        ingest = result["ingest"]
+        print(f"[{backend}] ingest: {ingest['documents']} docs, {ingest['chunks']} chunks in {ingest['seconds']:.2f}s "
+              f"({ingest['docs_per_s']:.1f} docs/s, {ingest['chunks_per_s']:.0f} chunks/s)")
+        for ask in result["ask"]:
+            print(f"[{backend}] /ask ({ask['service']}, {ask['requests']} requests x{ask['concurrency']}): "
+                  f"p50 {ask['p50_ms']:.0f} ms  p95 {ask['p95_ms']:.0f} ms  p99 {ask['p99_ms']:.0f} ms  "
+                  f"{ask['requests_per_s']:.2f} req/s  rejected {ask['rejected']}  errors {ask['errors']}  "
+                  f"(import {ask['import_s']:.2f}s, ready {ask['ready_s']:.2f}s)")
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    output = args.output or os.path.join(ROOT, "bench", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("Results written to", output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
@@ -0,0 +1,195 @@
+"""
+Local HTTP stand-in for the GECO API (apidocs) used by gecko_client.GECOClient.
+
+Serves synthetic Spanish corpora with a configurable per-request latency, so
+ingestion can be exercised and benchmarked without touching the real server.
+
+    python bench/geco_stub.py --corpora 3 --docs 50 --latency 0.05 --port 8765
+    GECO_API_URL=http://127.0.0.1:8765/apidocs python langchain-app/load.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "el método de los elementos finitos divide un medio continuo en pequeños elementos "
+    "interconectados por una serie de puntos llamados nodos las ecuaciones diferenciales "
+    "parciales describen el comportamiento del sistema y se resuelven de forma numérica "
+    "la matriz de rigidez global se ensambla a partir de las matrices de cada elemento "
+    "el intestino delgado absorbe los nutrientes de los alimentos digeridos "
+    "el corpus lingüístico reúne textos de distintos géneros y registros del español "
+    "los estudiantes analizan la frecuencia de las palabras y sus concordancias"
+).split()
+
+
+def make_text(rng, n_words):
+    sentences = []
+    while n_words > 0:
+        length = min(n_words, rng.randint(8, 25))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        n_words -= length
+    return " ".join(sentences)
+
+
+def make_corpora(n_corpora=2, n_docs=20, n_words=2000, seed=0):
+    """Builds {corpus_id: {"nombre", "documents": [{id, archivo, derechos}], "texts": {doc_id: text}}}."""
+    rng = random.Random(seed)
+    corpora = {}
+    for c in range(1, n_corpora + 1):
+        documents, texts = [], {}
+        for d in range(1, n_docs + 1):
+            doc_id = c * 1000 + d
+            documents.append({
+                "id": doc_id,
+                "archivo": f"Documento ({d}) del corpus {c}.txt",
+                "derechos": d % 10 == 0,
+            })
+            texts[doc_id] = make_text(rng, n_words)
+        corpora[c] = {"nombre": f"Corpus sintético {c}", "documents": documents, "texts": texts}
+    return corpora
+
+
+class GECOStub:
+    def __init__(self, corpora, latency=0.0, fail_rate=0.0, token_ttl=None, etags=True, host="127.0.0.1", port=0):
+        self.corpora = corpora
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.token_ttl = token_ttl
+        self.etags = etags
+        self.requests = 0
+        self.not_modified = 0
+        self.tokens_issued = 0
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._rng = random.Random(1)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_port}/apidocs"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def issue_token(self):
+        with self._lock:
+            self.tokens_issued += 1
+            token = f"token-{self.tokens_issued}"
+            self._tokens[token] = time.monotonic()
+        return token
+
+    def valid_token(self, header):
+        token = (header or "").removeprefix("Token ")
+        with self._lock:
+            issued = self._tokens.get(token)
+        if issued is None:
+            return False
+        return self.token_ttl is None or time.monotonic() - issued < self.token_ttl
+
+    def route(self, path):
+        """Returns (status, payload) for an authorized GET."""
+        parts = [p for p in path.split("?")[0].split("/") if p][1:]
+        if parts == ["corpus"]:
+            proyectos = [{"id": cid, "nombre": c["nombre"]} for cid, c in self.corpora.items()]
+            return 200, {"data": {"proyectos": proyectos}}
+        if len(parts) >= 2 and parts[0] == "corpus" and re.fullmatch(r"\d+", parts[1]):
+            corpus = self.corpora.get(int(parts[1]))
+            if corpus is None:
+                return 404, {"error": "corpus not found"}
+            if len(parts) == 2:
+                return 200, {"data": corpus["documents"]}
+            if len(parts) == 3 and parts[2] == "meta":
+                return 200, {"data": {"nombre": corpus["nombre"]}}
+            if len(parts) == 3 and re.fullmatch(r"\d+", parts[2]):
+                text = corpus["texts"].get(int(parts[2]))
+                if text is None:
+                    return 404, {"error": "document not found"}
+                return 200, {"data": text}
+        return 404, {"error": "not found"}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                # Strong validator for conditional GETs (If-None-Match), as a caching server would send
+                etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+                if status == 200 and stub.etags and self.headers.get("If-None-Match") == etag:
+                    with stub._lock:
+                        stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 200 and stub.etags:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.rstrip("/").endswith("/get-token"):
+                    self.send_json(200, {"token": stub.issue_token()})
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    fail = stub._rng.random() < stub.fail_rate
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if fail:
+                    self.send_json(503, {"error": "simulated failure"})
+                elif not stub.valid_token(self.headers.get("Authorization")):
+                    self.send_json(401, {"detail": "Invalid token."})
+                else:
+                    self.send_json(*stub.route(self.path))
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpora", type=int, default=2)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--words", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    stub = GECOStub(make_corpora(args.corpora, args.docs, args.words), latency=args.latency,
+                    fail_rate=args.fail_rate, host="0.0.0.0", port=args.port)
+    print("GECO stand-in listening on", stub.url.replace("0.0.0.0", "127.0.0.1"))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,185 @@
+"""
+Local HTTP stand-in for an Ollama server serving llama3 (POST /api/chat and /api/generate,
+GET /api/version and /api/tags), used to exercise ollama_pool.OllamaPool without a GPU.
+
+A call takes --latency seconds plus --prefill-per-token per prompt token (estimated like
+context_packing does) plus --decode-per-token per answer token. At most --parallel calls
+are served at once, like OLLAMA_NUM_PARALLEL; the rest queue. --fail-rate answers that
+share of calls with a 500.
+
+    python bench/ollama_stub.py --latency 0.5 --parallel 1 --port 11500
+    OLLAMA_HOSTS=http://127.0.0.1:11500,http://127.0.0.1:11501 uvicorn main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 3.5
+
+
+def example_of(schema):
+    """A value matching a `format` JSON schema (enough for with_structured_output)."""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: example_of(prop) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    return {"string": "", "integer": 0, "number": 0, "boolean": False}.get(kind)
+
+
+class OllamaStub:
+    def __init__(self, latency=0.2, prefill_per_token=0.0, decode_per_token=0.0, answer_tokens=40, parallel=1,
+                 fail_rate=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.prefill_per_token = prefill_per_token
+        self.decode_per_token = decode_per_token
+        self.answer_tokens = answer_tokens
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.failed = 0
+        self.stopped = False
+        self.max_waiting = 0
+        self._waiting = 0
+        self._slots = threading.Semaphore(parallel)
+        self._lock = threading.Lock()
+        self._rng = random.Random(1)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # Connections the client keeps open are dropped too, as when the process dies
+        self.stopped = True
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def answer(self, request):
+        fmt = request.get("format")
+        if isinstance(fmt, dict):
+            return [json.dumps(example_of(fmt), ensure_ascii=False)]
+        return ["respuesta "] * self.answer_tokens
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def dropped(self):
+                if stub.stopped:
+                    self.close_connection = True
+                return stub.stopped
+
+            def do_GET(self):
+                if self.dropped():
+                    return
+                if self.path == "/api/version":
+                    self.send_json(200, {"version": "0.0.0-stub"})
+                elif self.path == "/api/tags":
+                    self.send_json(200, {"models": [{"name": "llama3:latest", "model": "llama3:latest"}]})
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                if self.dropped():
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path == "/api/generate":
+                    # Warm-up: a generate request without a prompt only loads the model
+                    self.send_json(200, {"model": request.get("model"), "created_at": now(), "response": "",
+                                         "done": True, "done_reason": "load"})
+                    return
+                if self.path != "/api/chat":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                with stub._lock:
+                    stub.requests += 1
+                    fail = stub._rng.random() < stub.fail_rate
+                    stub._waiting += 1
+                    stub.max_waiting = max(stub.max_waiting, stub._waiting)
+                if fail:
+                    with stub._lock:
+                        stub.failed += 1
+                        stub._waiting -= 1
+                    self.send_json(500, {"error": "simulated failure"})
+                    return
+                prompt_tokens = int(sum(len(m.get("content") or "") for m in request.get("messages", [])) / CHARS_PER_TOKEN) + 1
+                tokens = stub.answer(request)
+                with stub._slots:
+                    with stub._lock:
+                        stub._waiting -= 1
+                    time.sleep(stub.latency + prompt_tokens * stub.prefill_per_token)
+                    final = {"model": request.get("model"), "created_at": now(), "message": {"role": "assistant", "content": ""},
+                             "done": True, "done_reason": "stop", "prompt_eval_count": prompt_tokens,
+                             "eval_count": len(tokens)}
+                    if not request.get("stream", True):
+                        time.sleep(len(tokens) * stub.decode_per_token)
+                        final["message"]["content"] = "".join(tokens)
+                        self.send_json(200, final)
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    for token in tokens:
+                        time.sleep(stub.decode_per_token)
+                        self.write_chunk({"model": request.get("model"), "created_at": now(),
+                                          "message": {"role": "assistant", "content": token}, "done": False})
+                    self.write_chunk(final)
+                    self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, payload):
+                line = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--prefill-per-token", type=float, default=0.0)
+    parser.add_argument("--decode-per-token", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=11500)
+    args = parser.parse_args()
+    stub = OllamaStub(args.latency, args.prefill_per_token, args.decode_per_token, args.answer_tokens,
+                      args.parallel, args.fail_rate, port=args.port)
+    print(f"Ollama stub on {stub.url}")
+    stub.server.serve_forever()
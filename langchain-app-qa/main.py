@@ -1,18 +1,38 @@
-from fastapi import FastAPI
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from starlette.middleware.cors import CORSMiddleware
 
 from langchain_community.vectorstores import Qdrant
 from qdrant_client import QdrantClient
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.chains import RetrievalQA
-from langchain_community.chat_models import ChatOllama
-
+from embedding_cache import CachedEmbeddings, normalize_text
+from embedding_backend import embedding_model_id, make_embeddings
+from concurrency import MAX_INFLIGHT_LLM, PipelineRunner, Overloaded
+from streaming import stream_answer, SSE_HEADERS
+from lexical_index import LexicalIndexFile
+from local_store import LocalStore, LocalVectorStore, VECTOR_BACKEND
+from collection_profile import search_params
+from pipelines import PipelineRegistry, RefinePipeline, StuffPipeline
+import metrics
+from startup import WARMUP_OLLAMA, Readiness
+from ollama_pool import OllamaPool
+from typing_extensions import List, Literal
+
+import asyncio
 import os
 
 # ==== Configuration ====
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://ollama:11434")
 QDRANT_HOST = os.getenv("QDRANT_HOST", "http://qdrant:6333")
+# "refine": one llama3 call per retrieved document, as this service has always answered; "stuff"
+# (opt-in, per request or here): one call over the question-relevant sentences
+ANSWER_MODE = os.getenv("ANSWER_MODE", "refine")
+# /ask/batch: questions per request and llama3 chains a batch may have in flight
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "256"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "2"))
 
 # ==== FastAPI setup ====
 app = FastAPI()
@@ -29,60 +49,174 @@ app.add_middleware(
 # ==== Request Schema ====
 class QuestionRequest(BaseModel):
     question: str
+    mode: Literal["stuff", "refine"] = ANSWER_MODE
+    # Include the seconds spent per chain step in the response
+    timings: bool = False
+    # False generates a fresh answer instead of serving a cached one (the new answer replaces it)
+    cache: bool = True
 
-# ==== Embedding and Vector Store ====
-embedding = HuggingFaceEmbeddings(model_name="/app/local_models/all-MiniLM-L6-v2")
-
-qdrant = QdrantClient(
-    url=QDRANT_HOST,  # or remote URL
-)
-vectorstore = Qdrant(
-    client=qdrant,
-    collection_name="corpus_gecko3",  # <- replace with your collection name
-    embeddings=embedding,
-)
-
+class BatchRequest(BaseModel):
+    questions: List[str]
+    mode: Literal["stuff", "refine"] = ANSWER_MODE
+    cache: bool = True
 
 # ==== LLM (Ollama) ====
-llm = ChatOllama(model="llama3", base_url=OLLAMA_HOST)
-
-# ==== QA Chain ====
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 5})
+# Every llama3 call (refine passes, stuff, stream, batch) goes to the least busy node of
+# OLLAMA_HOSTS and reports its latency and token counts
+llm = OllamaPool(model="llama3", callbacks=[metrics.CALLBACK])
+
+# ==== Embedding, Vector Store and QA Pipelines ====
+# Built by the lifespan hook (see `startup`), so importing this module stays fast.
+# The stuff and refine pipelines are the ones the unified langchain-app service also serves
+# (pipelines.py); here each `mode` selects one of them
+embedding = None
+qdrant = None
+vectorstore = None
+lexical_index = LexicalIndexFile()
+pipelines = PipelineRegistry(default=ANSWER_MODE)
+
+def load_models():
+    global embedding, qdrant, vectorstore
+    embedding = CachedEmbeddings(
+        make_embeddings("/app/local_models/all-MiniLM-L6-v2"),
+        model_id=embedding_model_id(),
+    )
+
+    if VECTOR_BACKEND == "local":
+        # In-process engine over the files written by load.py (no Qdrant server needed)
+        qdrant = LocalStore()
+        vectorstore = LocalVectorStore(qdrant, "corpus_gecko3", embedding)
+    else:
+        qdrant = QdrantClient(
+            url=QDRANT_HOST,  # or remote URL
+        )
+        vectorstore = Qdrant(
+            client=qdrant,
+            collection_name="corpus_gecko3",  # <- replace with your collection name
+            embeddings=embedding,
+        )
+
+    for pipeline in (StuffPipeline, RefinePipeline):
+        pipelines.register(pipeline(embedding, llm, vectorstore, lexical_index, "corpus_gecko3", k=5,
+                                    search_params=search_params() if VECTOR_BACKEND != "local" else None))
+
+def load_artifacts():
+    lexical_index.get()
+
+def warm_up_embeddings():
+    # One forward pass outside the cache, so the first question does not pay for lazy initialization
+    embedding.embeddings.embed_query("warm-up")
+
+# Runs retrieval + the chain on a bounded pool so a slow llama3 call never blocks the event loop;
+# MAX_INFLIGHT_LLM slots per Ollama node
+runner = PipelineRunner(max_inflight=MAX_INFLIGHT_LLM * len(llm.nodes))
+metrics.track_runner(runner)
+
+readiness = Readiness(IMPORT_STARTED)
+startup_steps = [
+    ("load_models", load_models, True),
+    ("load_artifacts", load_artifacts, True),
+    ("warm_up_embeddings", warm_up_embeddings, True),
+]
+if WARMUP_OLLAMA:
+    # Optional: readiness does not wait for Ollama, which may still be pulling llama3
+    startup_steps.append(("warm_up_ollama", llm.warm_up, False))
+
+app = FastAPI(lifespan=readiness.lifespan(startup_steps))
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"error": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
 
-qa = RetrievalQA.from_chain_type(
-    llm=llm,
-    retriever=retriever,
-    chain_type="refine"  # Fastest; use "refine" if quality > speed
-)
-app = FastAPI()
 # ==== Endpoint ====
 @app.post("/ask")
 async def ask_question(request: QuestionRequest):
+    readiness.check()
     try:
-
-
-        # Retrieve documents manually
-        docs = retriever.get_relevant_documents(request.question)
-
-        # Deduplicate by metadata field (e.g., 'document' or '_id')
-        unique_docs = {}
-        for doc in docs:
-            doc_id = doc.metadata.get('document')  # or use '_id'
-            if doc_id not in unique_docs:
-                unique_docs[doc_id] = doc
-
-        # Display deduplicated documents
-        for i, doc in enumerate(unique_docs.values()):
-            print(f"\nDoc #{i+1}")
-            print("Content:", doc.page_content[:500])
-            print("Metadata:", doc.metadata)
-
-        answer = qa.combine_documents_chain.run(input_documents=list(unique_docs.values()), question=request.question)
-
-        return {"question": request.question, "answer": answer}
+        # Identical questions already in flight share one chain run
+        steps = await runner.run((request.mode, request.cache, normalize_text(request.question)),
+                                 pipelines.get(request.mode).run, request.question, request.mode, request.cache)
+
+        if request.timings:
+            return {"question": request.question, "answer": steps["answer"], "cached": steps["cached"], "timings": steps["timings"]}
+        return {"question": request.question, "answer": steps["answer"], "cached": steps["cached"]}
+    except Overloaded:
+        raise
     except Exception as e:
         return {"error": str(e)}
-    
+
+@app.post("/ask/stream")
+async def ask_stream(request: QuestionRequest, http_request: Request):
+    readiness.check()
+    question = request.question
+    pipeline = pipelines.get(request.mode)
+
+    return StreamingResponse(
+        stream_answer(http_request, runner, llm, lambda: pipeline.retrieve(question),
+                      lambda docs: pipeline.final_prompt(question, docs, request.mode),
+                      lambda docs: pipeline.cached(question, docs, request.mode, request.cache),
+                      lambda docs, answer, seconds: pipeline.remember(question, docs, request.mode, answer, seconds),
+                      admission=runner.admit()),
+        media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/ask/batch")
+async def ask_batch(request: BatchRequest):
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="questions is empty")
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+    readiness.check()
+    pipeline = pipelines.get(request.mode)
+    # The batch holds one place in the runner's queue until its last answer
+    with runner.admit():
+        start = time.perf_counter()
+        contexts = await asyncio.to_thread(pipeline.retrieve_batch, request.questions)
+        retrieved = time.perf_counter()
+        answers = await runner.run_many(lambda item: pipeline.answer(item[0], item[1], request.mode, request.cache)[0],
+                                        list(zip(request.questions, contexts)), BATCH_PARALLELISM)
+    seconds = time.perf_counter() - start
+    results = [{"question": q, "error": str(a)} if isinstance(a, Exception) else {"question": q, "answer": a}
+               for q, a in zip(request.questions, answers)]
+    return {
+        "results": results,
+        "questions": len(results),
+        "seconds": round(seconds, 3),
+        "questions_per_minute": round(len(results) * 60 / seconds, 2),
+        "timings": {"retrieve": round(retrieved - start, 3), "generate": round(seconds - (retrieved - start), 3)},
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    readiness.check()
+    return {"embedding": embedding.stats(), "answer": pipelines.cache_stats()}
+
+@app.get("/llm/stats")
+async def llm_stats():
+    return {"nodes": llm.stats(), "pipeline": runner.stats()}
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process serves HTTP; models may still be loading
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.status())
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return Response(body, media_type=content_type)
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.labels(endpoint=route.path if route else "other", status=response.status_code).observe(
+        time.perf_counter() - start)
+    return response
+
 # ==== FastAPI setup ==== #
 #app = FastAPI()
 # ✅ Allow CORS from all origins (or just your Flutter web origin)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from metrics import ANSWER_SECONDS_SAVED, CACHE_LOOKUPS
+
+# Answers kept in memory (0 = none) and in the optional SQLite tier shared by the workers of a service
+ANSWER_CACHE_LRU_SIZE = int(os.getenv("ANSWER_CACHE_LRU_SIZE", "1024"))
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "50000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# Cosine similarity of the question embeddings for a semantic hit; the retrieved chunks must match too
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+# Written by load.py whenever a run changes the collection
+INGEST_EPOCH_PATH = os.getenv("INGEST_EPOCH_PATH", "./ingest_epoch.json")
+
+
+def write_epoch(path=INGEST_EPOCH_PATH, **info):
+    """Starts a new ingestion epoch: answers cached before it are no longer served."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"epoch": uuid.uuid4().hex, "written": int(time.time()), **info}, f)
+    os.replace(tmp, path)
+
+
+class IngestEpochFile:
+    """Current ingestion epoch, re-read when load.py writes a new one ("" before the first)."""
+    def __init__(self, path=INGEST_EPOCH_PATH, check_every=5.0):
+        self.path = path
+        self.check_every = check_every
+        self.epoch = ""
+        self._mtime = None
+        self._checked = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked >= self.check_every:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+                if mtime != self._mtime:
+                    with open(self.path, encoding="utf-8") as f:
+                        self.epoch = json.load(f)["epoch"]
+                    self._mtime = mtime
+            except (OSError, ValueError, KeyError):
+                pass
+        return self.epoch
+
+
+def question_key(question):
+    return normalize_text(question).casefold()
+
+
+def _normalized(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class AnswerCache:
+    """
+    Generated answers keyed by the context they were generated from: sha256 of the prompt
+    version, the answer mode, the ingestion epoch and the sorted ids of the retrieved chunks.
+    Within one context a question hits exactly (same normalized text) or semantically (its
+    embedding within `similarity` cosine of a cached question's).
+
+    Retrieval still runs for every question, so a hit skips only the LLM; a new epoch from
+    load.py or different chunks never serve an old answer. Entries expire after `ttl`
+    seconds; the in-memory LRU sits in front of an optional SQLite file.
+    """
+    def __init__(self, prompt_version, path=ANSWER_CACHE_PATH, lru_size=ANSWER_CACHE_LRU_SIZE,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL_SECONDS,
+                 similarity=ANSWER_CACHE_SIMILARITY, epoch=None):
+        self.prompt_version = prompt_version
+        self.lru_size = lru_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.epoch = epoch or IngestEpochFile()
+        self._current_epoch = None
+        self._lock = threading.Lock()
+        # (context key, question key) -> entry; context key -> question keys, for semantic matches
+        self._entries = OrderedDict()
+        self._contexts = {}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS answers (context TEXT NOT NULL, question TEXT NOT NULL, "
+                            "epoch TEXT NOT NULL, vector BLOB NOT NULL, answer TEXT NOT NULL, seconds REAL NOT NULL, "
+                            "created REAL NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (context, question))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self.bypassed = 0
+        self.seconds_saved = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self.lru_size or self.db is not None)
+
+    def context_key(self, mode, docs):
+        epoch = self.epoch.get()
+        if epoch != self._current_epoch:
+            self._new_epoch(epoch)
+        ids = sorted(str(doc.metadata.get("_id")) for doc in docs)
+        return hashlib.sha256("\0".join([self.prompt_version, mode, epoch] + ids).encode("utf-8")).hexdigest()
+
+    def _new_epoch(self, epoch):
+        # Entries of older epochs can never match again
+        with self._lock:
+            self._current_epoch = epoch
+            self._entries.clear()
+            self._contexts.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM answers WHERE epoch != ?", (epoch,))
+
+    # ==== Lookups ====
+
+    def _candidates(self, context, key):
+        """Unexpired (question key, entry) pairs of one context: from memory, or from disk unless `key` is in memory."""
+        now = time.time()
+        with self._lock:
+            keys = self._contexts.get(context, ())
+            found = [(q, self._entries[(context, q)]) for q in keys]
+            if key not in keys and self.db is not None:
+                rows = self.db.execute("SELECT question, vector, answer, seconds, created FROM answers WHERE context = ?",
+                                       (context,)).fetchall()
+                found = [(q, {"vector": np.frombuffer(v, dtype=np.float32), "answer": a, "seconds": s, "created": c})
+                         for q, v, a, s, c in rows]
+                for q, entry in found:
+                    self._remember(context, q, entry)
+        return [(q, entry) for q, entry in found if now - entry["created"] < self.ttl]
+
+    def _remember(self, context, question, entry):
+        if not self.lru_size:
+            return
+        self._entries[(context, question)] = entry
+        self._entries.move_to_end((context, question))
+        self._contexts.setdefault(context, set()).add(question)
+        while len(self._entries) > self.lru_size:
+            (old_context, old_question), _ = self._entries.popitem(last=False)
+            questions = self._contexts[old_context]
+            questions.discard(old_question)
+            if not questions:
+                del self._contexts[old_context]
+
+    def get(self, question, vector, mode, docs):
+        """The cached answer for `question` (embedded as `vector`) over the retrieved `docs`, or None."""
+        if not self.enabled:
+            return None
+        context = self.context_key(mode, docs)
+        key = question_key(question)
+        candidates = self._candidates(context, key)
+        hit = next(((q, entry) for q, entry in candidates if q == key), None)
+        kind = "exact"
+        if hit is None and candidates:
+            query = _normalized(vector)
+            scores = [float(_normalized(entry["vector"]) @ query) for _, entry in candidates]
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity:
+                hit, kind = candidates[best], "semantic"
+        if hit is None:
+            with self._lock:
+                self.misses += 1
+            CACHE_LOOKUPS.labels(cache="answer", result="miss").inc()
+            return None
+        question, entry = hit
+        with self._lock:
+            self.hits[kind] += 1
+            self.seconds_saved += entry["seconds"]
+            if (context, question) in self._entries:
+                self._entries.move_to_end((context, question))
+            if self.db is not None:
+                self.db.execute("UPDATE answers SET last_used = ? WHERE context = ? AND question = ?",
+                                (time.time(), context, question))
+        CACHE_LOOKUPS.labels(cache="answer", result=kind).inc()
+        ANSWER_SECONDS_SAVED.inc(entry["seconds"])
+        return entry["answer"]
+
+    def bypass(self):
+        """Counts a request that asked not to be served from the cache."""
+        with self._lock:
+            self.bypassed += 1
+        CACHE_LOOKUPS.labels(cache="answer", result="bypass").inc()
+
+    def put(self, question, vector, mode, docs, answer, seconds):
+        """Stores an answer that took `seconds` to generate (the latency a hit saves)."""
+        if not self.enabled or not answer:
+            return
+        context = self.context_key(mode, docs)
+        key = question_key(question)
+        now = time.time()
+        entry = {"vector": np.asarray(vector, dtype=np.float32), "answer": answer, "seconds": seconds, "created": now}
+        with self._lock:
+            self._remember(context, key, entry)
+            if self.db is not None:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (context, key, self._current_epoch, entry["vector"].tobytes(), answer, seconds, now, now))
+                    self.db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+                    excess = self.db.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+                    if excess > 0:
+                        self.db.execute("DELETE FROM answers WHERE rowid IN "
+                                        "(SELECT rowid FROM answers ORDER BY last_used LIMIT ?)", (excess,))
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.hits["exact"],
+                "semantic_hits": self.hits["semantic"],
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "seconds_saved": round(self.seconds_saved, 3),
+                "memory_entries": len(self._entries),
+                "disk_entries": self.db.execute("SELECT COUNT(*) FROM answers").fetchone()[0] if self.db is not None else 0,
+                "epoch": self._current_epoch,
+            }
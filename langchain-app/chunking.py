@@ -0,0 +1,206 @@
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+from embedding_backend import EMBEDDING_MAX_LENGTH
+
+# Chunk size in all-MiniLM-L6-v2 word pieces: what the model reads, less [CLS] and [SEP], so no
+# chunk is truncated when embedded
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", str(EMBEDDING_MAX_LENGTH - 2)))
+# Word pieces of whole sentences a chunk repeats from the end of the previous one
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Processes chunking the segments of large documents; 0 = one per core, 1 = none (in the loader)
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "0"))
+# Documents are cut into segments of about this many characters (at a paragraph or sentence end)
+# that are chunked independently; it changes the chunks, so it is part of `Chunker.version`
+SEGMENT_CHARS = 200_000
+
+# A sentence ends at . ! ? or … (plus closing quotes or brackets) followed by whitespace and
+# something that can start a Spanish sentence, or at a blank line
+_BOUNDARY = re.compile(r"[.!?…][»\"'”’)\]]*(\s+)(?=[¿¡\"'“‘(«\[A-ZÁÉÍÓÚÜÑ0-9])|\n[ \t]*\n\s*")
+_LAST_WORD = re.compile(r"(\w+)\.$")
+# Periods after these (or after an initial, "J. García") do not end a sentence
+ABBREVIATIONS = frozenset("""
+    aprox art arts av avda c cap caps cf cía dcha dr dra dres dto ej fig figs izq lic
+    máx mín n núm pág págs p pp prof profa sr sra sres srta st sto sta tel ud uds vd vds vol vols
+""".split())
+# Without the model's tokenizer: a token per 3 word characters or punctuation mark, more than
+# WordPiece makes of Spanish text, so chunks err on the short side
+_ESTIMATED_TOKEN = re.compile(r"\w{1,3}|[^\w\s]")
+
+
+def load_tokenizer(path):
+    """The model's fast tokenizer (tokenizer.json), or None when it is missing."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        return None
+    tokenizer = Tokenizer.from_file(path)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def token_starts(text, tokenizer=None):
+    """Character offset of every token of `text`, ascending."""
+    if tokenizer is None:
+        return np.fromiter((m.start() for m in _ESTIMATED_TOKEN.finditer(text)), dtype=np.int64)
+    offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+    return np.fromiter((start for start, _ in offsets), dtype=np.int64, count=len(offsets))
+
+
+def sentence_spans(text):
+    """(start, end) of the sentences of `text`, without surrounding whitespace."""
+    spans, start = [], 0
+    for m in _BOUNDARY.finditer(text):
+        if m.group(1) is None:
+            end = m.start()
+        else:
+            end = m.start(1)
+            word = _LAST_WORD.search(text, max(m.start() - 12, 0), m.start() + 1)
+            if word and (word.group(1).lower() in ABBREVIATIONS or (len(word.group(1)) == 1 and word.group(1).isupper())):
+                continue
+        spans.append((start, end))
+        start = m.end()
+    spans.append((start, len(text)))
+    trimmed = []
+    for start, end in spans:
+        sentence = text[start:end]
+        if sentence.strip():
+            trimmed.append((start + len(sentence) - len(sentence.lstrip()), end - len(sentence) + len(sentence.rstrip())))
+    return trimmed
+
+
+def segment_spans(text, size=SEGMENT_CHARS):
+    """(start, end) of consecutive segments of at most `size` characters, cut at a paragraph break if possible."""
+    spans, start = [], 0
+    while len(text) - start > size:
+        end, floor = start + size, start + size // 2
+        cut = text.rfind("\n\n", floor, end)
+        if cut < 0:
+            cut = text.rfind(". ", floor, end)
+            cut = cut + 1 if cut >= 0 else text.rfind(" ", floor, end)
+        if cut <= start:
+            cut = end
+        spans.append((start, cut))
+        start = cut
+    spans.append((start, len(text)))
+    return spans
+
+
+def _units(text, starts, max_tokens):
+    """Sentences, with the ones over `max_tokens` cut into pieces at word starts."""
+    units = []
+    sentences = sentence_spans(text)
+    if not sentences:
+        return units
+    bounds = np.searchsorted(starts, np.asarray(sentences, dtype=np.int64))
+    for (start, end), (first, last) in zip(sentences, bounds.tolist()):
+        while last - first > max_tokens:
+            cut = first + max_tokens
+            # Prefer a cut before a whole word in the last quarter of the piece
+            for i in range(cut, first + 3 * max_tokens // 4, -1):
+                if text[starts[i] - 1].isspace():
+                    cut = i
+                    break
+            piece_end = int(starts[cut])
+            while text[piece_end - 1].isspace():
+                piece_end -= 1
+            units.append((start, piece_end))
+            start, first = int(starts[cut]), cut
+        units.append((start, end))
+    return units
+
+
+def chunk_spans(text, starts, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS):
+    """
+    (start, end) of the chunks of `text`: whole sentences packed up to `max_tokens` tokens
+    (`starts` from token_starts), each chunk starting with the last sentences of the previous
+    one that fit in `overlap` tokens. Only a sentence longer than a chunk is cut.
+    """
+    units = _units(text, starts, max_tokens)
+    if not units:
+        return []
+    bounds = np.searchsorted(starts, np.asarray(units, dtype=np.int64))
+    chunks, i = [], 0
+    while True:
+        j = i
+        while j + 1 < len(units) and bounds[j + 1][1] - bounds[i][0] <= max_tokens:
+            j += 1
+        chunks.append((units[i][0], units[j][1]))
+        if j + 1 == len(units):
+            return chunks
+        # Back up over the sentences that fit in the overlap, as long as the next sentence still fits too
+        k = j + 1
+        while (k - 1 > i and bounds[j][1] - bounds[k - 1][0] <= overlap
+               and bounds[j + 1][1] - bounds[k - 1][0] <= max_tokens):
+            k -= 1
+        i = k
+
+
+# ==== Process pool ====
+
+# Tokenizer and sizes of a pool worker, set by _init_worker
+_worker = {}
+
+
+def _init_worker(tokenizer_path, max_tokens, overlap):
+    _worker.update(tokenizer=load_tokenizer(tokenizer_path), max_tokens=max_tokens, overlap=overlap)
+
+
+def _chunk_segment(task):
+    segment, offset = task
+    starts = token_starts(segment, _worker["tokenizer"])
+    return [(offset + s, offset + e) for s, e in chunk_spans(segment, starts, _worker["max_tokens"], _worker["overlap"])]
+
+
+class Chunker:
+    """
+    Splits documents into chunks sized in the embedding model's tokens, at Spanish sentence
+    boundaries, and returns their character offsets in the document.
+
+    A document is cut into segments of about SEGMENT_CHARS characters first; the segments of
+    a large document are chunked in parallel by a pool of forked processes, created here so
+    that the fork happens before the loader starts its threads. The chunks only depend on the
+    text and `version`, never on the number of workers, so their indexes (and point ids) are
+    stable across runs.
+    """
+    def __init__(self, tokenizer_path=None, max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS,
+                 workers=CHUNK_WORKERS, segment_chars=SEGMENT_CHARS):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.segment_chars = segment_chars
+        workers = workers or os.cpu_count() or 1
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.get_context("fork").Pool(
+                workers, initializer=_init_worker, initargs=(tokenizer_path, max_tokens, overlap))
+        self.workers = workers if self.pool else 1
+        self.tokenizer = load_tokenizer(tokenizer_path)
+        if self.tokenizer is None:
+            print(f"No tokenizer at {tokenizer_path}: chunk sizes are estimated from the characters")
+        tokens = "wordpiece" if self.tokenizer is not None else "estimated"
+        # Part of the documents' content hash in load.py: changing it re-chunks everything
+        self.version = f"sentences/{tokens}/{max_tokens}/{overlap}/{segment_chars}"
+
+    def split(self, text):
+        """(start, end) of the chunks of `text`, in order."""
+        segments = segment_spans(text, self.segment_chars)
+        if self.pool is None or len(segments) == 1:
+            return [span for start, end in segments for span in self._chunk(text[start:end], start)]
+        parts = self.pool.map(_chunk_segment, [(text[start:end], start) for start, end in segments])
+        return [span for part in parts for span in part]
+
+    def _chunk(self, segment, offset):
+        starts = token_starts(segment, self.tokenizer)
+        return [(offset + s, offset + e) for s, e in chunk_spans(segment, starts, self.max_tokens, self.overlap)]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,83 @@
+import os
+
+from qdrant_client.models import (
+    Disabled, Distance, HnswConfigDiff, OptimizersConfigDiff, PayloadSchemaType, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams, VectorParams, VectorParamsDiff,
+)
+
+# Collection side
+QDRANT_HNSW_M = int(os.getenv("QDRANT_HNSW_M", "16"))
+QDRANT_HNSW_EF_CONSTRUCT = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "128"))
+QDRANT_ON_DISK = os.getenv("QDRANT_ON_DISK", "false").lower() == "true"
+# "int8": scalar-quantized copy of the vectors kept in RAM, originals used to rescore; "none" to disable
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "int8")
+QDRANT_INDEXING_THRESHOLD = int(os.getenv("QDRANT_INDEXING_THRESHOLD", "20000"))
+# Query side
+QDRANT_SEARCH_EF = int(os.getenv("QDRANT_SEARCH_EF", "128"))
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
+QDRANT_RESCORE = os.getenv("QDRANT_RESCORE", "true").lower() == "true"
+
+# Every filtered search goes through these; without an index Qdrant checks the payload of each candidate
+PAYLOAD_INDEXES = {
+    "metadata.source": PayloadSchemaType.KEYWORD,
+    "metadata.corpus_id": PayloadSchemaType.KEYWORD,
+    "metadata.document": PayloadSchemaType.KEYWORD,
+}
+
+
+def vectors_config(size=384):
+    return VectorParams(size=size, distance=Distance.COSINE, on_disk=QDRANT_ON_DISK)
+
+
+def hnsw_config():
+    return HnswConfigDiff(m=QDRANT_HNSW_M, ef_construct=QDRANT_HNSW_EF_CONSTRUCT, on_disk=QDRANT_ON_DISK)
+
+
+def quantization_config():
+    if QDRANT_QUANTIZATION != "int8":
+        return None
+    return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+
+
+def search_params():
+    """Query-time settings matching the collection profile; pass as `search_params=` to the searches."""
+    quantization = None
+    if QDRANT_QUANTIZATION == "int8":
+        quantization = QuantizationSearchParams(rescore=QDRANT_RESCORE, oversampling=QDRANT_OVERSAMPLING)
+    return SearchParams(hnsw_ef=QDRANT_SEARCH_EF, quantization=quantization)
+
+
+def create_collection(qdrant, collection_name, bulk_load=False):
+    """
+    Creates the collection with the profile. With `bulk_load`, HNSW indexing is off until
+    `finish_bulk_load` so a full rebuild does not re-index segments while they are being filled.
+    """
+    qdrant.create_collection(
+        collection_name=collection_name,
+        vectors_config=vectors_config(),
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization_config(),
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=0 if bulk_load else QDRANT_INDEXING_THRESHOLD),
+    )
+
+
+def apply_profile(qdrant, collection_name):
+    """Brings an existing collection to the profile: payload indexes, HNSW, on-disk vectors and quantization."""
+    existing = qdrant.get_collection(collection_name=collection_name).payload_schema or {}
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field not in existing:
+            qdrant.create_payload_index(collection_name=collection_name, field_name=field, field_schema=schema, wait=True)
+            print("Payload index created: ", field)
+    qdrant.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": VectorParamsDiff(on_disk=QDRANT_ON_DISK)},
+        hnsw_config=hnsw_config(),
+        quantization_config=quantization_config() or Disabled.DISABLED,
+    )
+
+
+def finish_bulk_load(qdrant, collection_name):
+    qdrant.update_collection(
+        collection_name=collection_name,
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=QDRANT_INDEXING_THRESHOLD),
+    )
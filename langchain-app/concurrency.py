@@ -0,0 +1,159 @@
+import asyncio
+import contextlib
+import functools
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import PIPELINE_REJECTED
+
+MAX_INFLIGHT_LLM = int(os.getenv("MAX_INFLIGHT_LLM", "4"))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", "32"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "120"))
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    A place in a PipelineRunner's queue, counted in `pending` from admit() until it is given
+    back, exactly once: by the slot that takes it over, or by release() (or leaving the `with`
+    block) on the paths that never reach a slot.
+    """
+    def __init__(self, runner):
+        self.runner = runner
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.runner.pending -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class PipelineRunner:
+    """
+    Runs the blocking RAG pipeline off the event loop on a bounded thread pool.
+
+    At most `max_inflight` runs execute at once; up to `max_queue` more wait for a slot
+    for at most `queue_timeout` seconds. Beyond that, or on timeout, `Overloaded` is
+    raised so the endpoint can answer 503 with Retry-After. Requests with the same key
+    that arrive while a run is in flight share that run's result.
+    """
+    def __init__(self, max_inflight=MAX_INFLIGHT_LLM, max_queue=MAX_QUEUED_REQUESTS, queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="pipeline")
+        self._semaphore = None
+        self._inflight = {}
+        self.pending = 0
+        self.running = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.avg_seconds = None
+
+    def retry_after(self):
+        # Rough time until a queued request would get a slot
+        avg = self.avg_seconds or 1.0
+        return max(1, math.ceil(avg * max(1, self.pending) / self.max_inflight))
+
+    def admit(self):
+        """
+        Rejects a request when the queue is full, or reserves it a place there. The only
+        admission check: `run` calls it, and the stream and batch endpoints call it before they
+        take slots. The place counts in `pending` at once, so a burst of requests admitted
+        before any of them reaches a slot cannot overfill the queue.
+        """
+        if self.pending >= self.max_inflight + self.max_queue:
+            self.rejected += 1
+            PIPELINE_REJECTED.labels(reason="queue_full").inc()
+            raise Overloaded("Too many requests in flight", self.retry_after())
+        self.pending += 1
+        return Admission(self)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, batch=False, admission=None):
+        """
+        Holds one of the max_inflight slots, e.g. for the length of a streamed answer, and
+        releases the request's `admission` when it ends. Items of a `batch` (already admitted
+        with it) take a place of their own and wait for the slot without a timeout.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+        if admission is None:
+            self.pending += 1
+            admission = Admission(self)
+        try:
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), None if batch else self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                PIPELINE_REJECTED.labels(reason="queue_timeout").inc()
+                raise Overloaded("Timed out waiting for a free pipeline slot", self.retry_after())
+            self.running += 1
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start
+                self.avg_seconds = elapsed if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * elapsed
+                self.running -= 1
+                self._semaphore.release()
+        finally:
+            admission.release()
+
+    async def run(self, key, fn, *args, **kwargs):
+        task = self._inflight.get(key) if key is not None else None
+        if task is not None:
+            self.coalesced += 1
+        else:
+            admission = self.admit()
+            task = asyncio.ensure_future(self._execute(functools.partial(fn, *args, **kwargs), admission))
+            if key is not None:
+                self._inflight[key] = task
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A client that goes away must not cancel the run other requests are waiting on
+        return await asyncio.shield(task)
+
+    async def _execute(self, call, admission):
+        async with self.slot(admission=admission):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def run_many(self, fn, items, parallelism=None):
+        """
+        Runs fn(item) for every item of an already admitted batch, at most `parallelism` at a
+        time and through the same slots as single runs, so a batch shares the LLM fairly with
+        /ask traffic instead of being rejected item by item. Returns results in input order,
+        with the exception in place of an item that failed.
+        """
+        limit = asyncio.Semaphore(min(parallelism or self.max_inflight, self.max_inflight))
+        loop = asyncio.get_running_loop()
+
+        async def one(item):
+            async with limit:
+                async with self.slot(batch=True):
+                    return await loop.run_in_executor(self._executor, fn, item)
+
+        return await asyncio.gather(*(one(item) for item in items), return_exceptions=True)
+
+    def stats(self):
+        return {
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.pending - self.running,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "avg_seconds": self.avg_seconds,
+        }
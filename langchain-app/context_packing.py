@@ -0,0 +1,88 @@
+import os
+import re
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "900"))
+# llama3's tokenizer averages roughly 3.5 characters per token on Spanish prose
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+# Sentences from better-ranked chunks win ties
+RANK_PENALTY = 0.01
+# Shorter sentences are never treated as overlap fragments
+MIN_FRAGMENT_CHARS = 20
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?=[¿¡\"'(«A-ZÁÉÍÓÚÑ0-9])|\n\s*\n")
+
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def _key(text):
+    return normalize_text(text).lower()
+
+
+def pack_context(docs, query_vector, embeddings, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Extractive compression of the retrieved chunks into at most `budget` (estimated) tokens.
+
+    Sentences repeated by the chunk overlap are kept once, each remaining sentence is scored
+    by cosine similarity with the query vector, and the best ones are kept greedily. The kept
+    sentences are returned in document order, grouped per source, together with stats.
+    """
+    sentences = []  # (doc_rank, document, text)
+    seen = set()
+    for rank, doc in enumerate(docs):
+        document = doc.metadata.get("document") or doc.metadata.get("source")
+        for sentence in split_sentences(doc.page_content):
+            key = _key(sentence)
+            if key not in seen:
+                seen.add(key)
+                sentences.append((rank, document, sentence, key))
+    # The chunk overlap also cuts sentences: drop fragments contained in a sentence of the same document
+    by_document = {}
+    for _, document, _, key in sentences:
+        by_document.setdefault(document, []).append(key)
+    sentences = [
+        (rank, document, sentence) for rank, document, sentence, key in sentences
+        if len(key) < MIN_FRAGMENT_CHARS or not any(len(other) > len(key) and key in other for other in by_document[document])
+    ]
+
+    stats = {
+        "input_tokens": sum(estimate_tokens(doc.page_content) for doc in docs),
+        "unique_sentences": len(sentences),
+    }
+    if not sentences:
+        stats.update(context_tokens=0, kept_sentences=0)
+        return "", stats
+
+    # Sentence vectors are throwaway: through CachedEmbeddings they skip the shared caches
+    embed = getattr(embeddings, "embed_transient", embeddings.embed_documents)
+    vectors = np.asarray(embed([s for _, _, s in sentences]), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    scores = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    scores -= RANK_PENALTY * np.array([rank for rank, _, _ in sentences], dtype=np.float32)
+
+    kept, used = [], 0
+    for i in np.argsort(-scores):
+        cost = estimate_tokens(sentences[i][2])
+        if used + cost > budget:
+            continue
+        kept.append(i)
+        used += cost
+
+    groups = {}
+    for i in sorted(kept):
+        rank, document, sentence = sentences[i]
+        source = docs[rank].metadata.get("source") or document
+        groups.setdefault(source, []).append(sentence)
+    context = "\n\n".join(f"[{source}]\n" + " ".join(group) for source, group in groups.items())
+    stats.update(context_tokens=estimate_tokens(context), kept_sentences=len(kept))
+    return context, stats
@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import threading
+import uuid
+import zlib
+
+import numpy as np
+
+from lexical_index import ascii_fold
+
+# Estimated Jaccard similarity of word 5-gram sets above which a chunk is a near-duplicate; 0 disables
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", "./dedup_index.npz")
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+# 16 bands of 8 rows: pairs at 0.85 similarity share a band 99% of the time, pairs at 0.5 only 6%
+BANDS = 16
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, _MERSENNE_PRIME, size=NUM_PERM, dtype=np.uint64)
+
+
+def minhash(text):
+    """MinHash signature (NUM_PERM uint32) of the word 5-grams of a chunk, or None when it has no words."""
+    words = re.findall(r"[a-z0-9]+", ascii_fold(text).lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("ascii")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Universal hashing (a * h + b) mod p; the uint64 product may wrap, which keeps it a hash
+    permuted = (hashes[:, None] * _A + _B) % _MERSENNE_PRIME
+    return (permuted & np.uint64(0xFFFFFFFF)).astype(np.uint32).min(axis=0)
+
+
+def source_entry(metadata):
+    # chunk, start and end locate the collapsed chunk in its own document
+    return {field: metadata.get(field) for field in ("corpus_id", "corpus_name", "document", "source", "chunk", "start", "end")}
+
+
+class NearDuplicates:
+    """
+    MinHash LSH over the chunks that own a point in the collection ("canonical" chunks).
+
+    A new chunk whose signature shares a band with a canonical one and agrees with it on at
+    least `threshold` of the permutations is collapsed into that point: it is neither embedded
+    nor stored, and its document is added to the point's `metadata.sources`. `members` maps
+    each canonical point id to the {point id: chunk metadata} of the chunks collapsed into it;
+    when the canonical chunk goes away the point is handed to one of them (see load.py).
+
+    Saved as one .npz (16-byte point ids, signatures, members as JSON) at the end of a run.
+    """
+    def __init__(self, path=DEDUP_INDEX_PATH, threshold=DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.rows = NUM_PERM // BANDS
+        self._lock = threading.Lock()
+        self.clear()
+        if threshold and os.path.exists(path):
+            with np.load(path) as data:
+                for raw, signature in zip(data["ids"], data["signatures"]):
+                    self._index(str(uuid.UUID(bytes=bytes(raw))), signature)
+                self.members = json.loads(str(data["members"]))
+            self.member_of = {m: c for c, members in self.members.items() for m in members}
+
+    def clear(self):
+        self.signatures = {}
+        self.buckets = {}
+        self.members = {}
+        self.member_of = {}
+        # Canonical points whose `sources` changed since they were written
+        self.dirty = set()
+        self.collapsed = 0
+
+    def _bands(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(BANDS)]
+
+    def _index(self, pid, signature):
+        self.signatures[pid] = signature
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, set()).add(pid)
+
+    def _unindex(self, pid):
+        signature = self.signatures.pop(pid, None)
+        if signature is not None:
+            for key in self._bands(signature):
+                bucket = self.buckets.get(key)
+                bucket.discard(pid)
+                if not bucket:
+                    del self.buckets[key]
+        return signature
+
+    def signature(self, text):
+        return minhash(text) if self.threshold else None
+
+    def find(self, signature):
+        """The canonical point most similar to `signature`, if one passes the threshold."""
+        if signature is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for key in self._bands(signature):
+                candidates |= self.buckets.get(key, set())
+            best, best_score = None, self.threshold
+            for pid in candidates:
+                score = float(np.mean(self.signatures[pid] == signature))
+                if score >= best_score:
+                    best, best_score = pid, score
+            return best
+
+    def add(self, pid, signature):
+        """Registers a chunk that is (or is being) stored as point `pid`."""
+        if signature is not None:
+            with self._lock:
+                self._unindex(pid)
+                self._index(pid, signature)
+
+    def add_member(self, canonical, pid, metadata):
+        """Records that chunk `pid` (with its chunk metadata) was collapsed into point `canonical`."""
+        with self._lock:
+            previous = self.member_of.get(pid)
+            if previous is not None and previous != canonical:
+                self.members[previous].pop(pid, None)
+                self.dirty.add(previous)
+            self.members.setdefault(canonical, {})[pid] = metadata
+            self.member_of[pid] = canonical
+            self.dirty.add(canonical)
+            self.collapsed += 1
+
+    def release(self, pid):
+        """
+        Takes chunk `pid` out of the index. Returns the signature and the members of the point
+        when `pid` was a canonical chunk others were collapsed into, else (None, {}).
+        """
+        with self._lock:
+            canonical = self.member_of.pop(pid, None)
+            if canonical is not None:
+                members = self.members.get(canonical, {})
+                members.pop(pid, None)
+                if not members:
+                    self.members.pop(canonical, None)
+                self.dirty.add(canonical)
+            signature = self._unindex(pid)
+            members = self.members.pop(pid, {})
+            self.dirty.discard(pid)
+            for member in members:
+                del self.member_of[member]
+            return signature, members
+
+    def inherit(self, heir, signature, members):
+        """Makes member `heir` the canonical chunk of a released point and of its other `members`."""
+        with self._lock:
+            if signature is not None:
+                self._index(heir, signature)
+            others = {pid: metadata for pid, metadata in members.items() if pid != heir}
+            if others:
+                self.members[heir] = others
+                for pid in others:
+                    self.member_of[pid] = heir
+
+    def sources(self, pid, metadata):
+        """`metadata.sources` of point `pid`: its own document plus the collapsed ones, or None if there are none."""
+        with self._lock:
+            members = list(self.members.get(pid, {}).values())
+        if not members:
+            return None
+        sources = {}
+        for entry in map(source_entry, [metadata] + members):
+            sources.setdefault((entry["corpus_id"], entry["document"]), entry)
+        return list(sources.values())
+
+    def take_dirty(self):
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            return dirty
+
+    def save(self):
+        if not self.threshold:
+            return
+        with self._lock:
+            ids = list(self.signatures)
+            signatures = np.array([self.signatures[pid] for pid in ids], dtype=np.uint32).reshape(len(ids), NUM_PERM)
+            raw_ids = np.array([uuid.UUID(pid).bytes for pid in ids], dtype="S16").view(np.uint8).reshape(len(ids), 16)
+            members = json.dumps(self.members, ensure_ascii=False)
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, ids=raw_ids, signatures=signatures, members=np.array(members))
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "points": len(self.signatures),
+                "collapsed_chunks": len(self.member_of),
+                "collapsed_this_run": self.collapsed,
+                "shared_points": len(self.members),
+            }
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+# torch: sentence-transformers in fp32 (what the collection was built with)
+# torch-int8: the same model with torch dynamic int8 quantization of the Linear layers
+# onnx-int8: ONNX export with onnxruntime dynamic int8 quantization (see `export_onnx`)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+# Intra-op threads of the embedding model; 0 keeps the library default (one per core)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# all-MiniLM-L6-v2 truncates at 256 word pieces, like sentence-transformers does
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", "256"))
+
+BACKENDS = ("torch", "torch-int8", "onnx-int8")
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Models loaded by `preload_embeddings`, by (model path, backend)
+_preloaded = {}
+
+
+def embedding_model_id(backend=EMBEDDING_BACKEND):
+    # Quantized vectors differ slightly from fp32 ones, so each backend gets its own cache keys
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}+{backend}"
+
+
+def onnx_paths(model_path):
+    return os.path.join(model_path, "onnx", "model.onnx"), os.path.join(model_path, "onnx", "model_int8.onnx")
+
+
+def export_onnx(model_path):
+    """Exports the transformer of a saved sentence-transformers model to ONNX and quantizes it to int8."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    fp32_path, int8_path = onnx_paths(model_path)
+    os.makedirs(os.path.dirname(fp32_path), exist_ok=True)
+    model = AutoModel.from_pretrained(model_path).eval()
+    sample = AutoTokenizer.from_pretrained(model_path)(["export sample"], return_tensors="pt")
+    axes = {0: "batch", 1: "sequence"}
+    with torch.inference_mode():
+        torch.onnx.export(
+            model, (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]), fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"], output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes, "last_hidden_state": axes},
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"Exported {fp32_path} and {int8_path}")
+    return int8_path
+
+
+class OnnxRunner:
+    def __init__(self, model_path, threads):
+        import onnxruntime as ort
+
+        _, int8_path = onnx_paths(model_path)
+        if not os.path.exists(int8_path):
+            # The Dockerfile exports at build time; this covers models copied in afterwards
+            export_onnx(model_path)
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(int8_path, options, providers=["CPUExecutionProvider"])
+        self.inputs = {i.name for i in self.session.get_inputs()}
+
+    def __call__(self, inputs):
+        return self.session.run(None, {name: value for name, value in inputs.items() if name in self.inputs})[0]
+
+
+class TorchInt8Runner:
+    def __init__(self, model_path, threads):
+        import torch
+        from transformers import AutoModel
+
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        model = AutoModel.from_pretrained(model_path).eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def __call__(self, inputs):
+        with self.torch.inference_mode():
+            output = self.model(**{name: self.torch.from_numpy(value) for name, value in inputs.items()})
+        return output.last_hidden_state.numpy()
+
+
+class QuantizedEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 on an int8 runner, with the sentence-transformers head (mean pooling
+    over the attention mask, then L2 normalization).
+
+    Texts are tokenized once, sorted by length and batched so that each batch is only padded
+    to its own longest text: short queries never pay for a long chunk in the same call.
+    """
+    def __init__(self, model_path, backend="onnx-int8", threads=EMBEDDING_THREADS,
+                 batch_size=EMBEDDING_BATCH_SIZE, max_length=EMBEDDING_MAX_LENGTH):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length)
+        self.batch_size = batch_size
+        self.runner = OnnxRunner(model_path, threads) if backend == "onnx-int8" else TorchInt8Runner(model_path, threads)
+        self.padded_tokens = 0
+        self.tokens = 0
+
+    def _batch(self, encodings):
+        length = max(len(e.ids) for e in encodings)
+        inputs = {name: np.zeros((len(encodings), length), dtype=np.int64)
+                  for name in ("input_ids", "attention_mask", "token_type_ids")}
+        for row, encoding in enumerate(encodings):
+            n = len(encoding.ids)
+            inputs["input_ids"][row, :n] = encoding.ids
+            inputs["attention_mask"][row, :n] = encoding.attention_mask
+            inputs["token_type_ids"][row, :n] = encoding.type_ids
+        self.tokens += int(inputs["attention_mask"].sum())
+        self.padded_tokens += inputs["input_ids"].size
+        return inputs
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(list(texts))
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            inputs = self._batch([encodings[i] for i in rows])
+            hidden = self.runner(inputs)
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for row, vector in zip(rows, pooled):
+                vectors[row] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def padding_ratio(self):
+        """Share of the model's input positions that were padding."""
+        return 1 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+
+def preload_embeddings(model_path, backend=EMBEDDING_BACKEND):
+    """
+    Loads the model before the process forks its workers (serve.py): their `make_embeddings`
+    then returns this instance and the weights stay shared copy-on-write. torch backend only,
+    and nothing runs on the model here, since intra-op thread pools do not survive a fork;
+    the int8 backends start theirs while loading, so each worker loads its own.
+    """
+    if backend != "torch":
+        print(f"Embedding backend {backend} is loaded by each worker (only torch is preloaded)")
+        return False
+    start = time.perf_counter()
+    _preloaded[(model_path, backend)] = HuggingFaceEmbeddings(model_name=model_path,
+                                                             encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE})
+    print(f"Embedding backend {backend} preloaded in {time.perf_counter() - start:.2f}s")
+    return True
+
+
+def make_embeddings(model_path, backend=EMBEDDING_BACKEND, threads=EMBEDDING_THREADS):
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}")
+    start = time.perf_counter()
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        embeddings = _preloaded.get((model_path, backend)) or HuggingFaceEmbeddings(
+            model_name=model_path, encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE})
+    else:
+        embeddings = QuantizedEmbeddings(model_path, backend, threads)
+    print(f"Embedding backend {backend} ({threads or 'default'} threads) loaded in {time.perf_counter() - start:.2f}s")
+    return embeddings
+
+
+if __name__ == "__main__":
+    # Build step: python embedding_backend.py export /app/local_models/all-MiniLM-L6-v2
+    if len(sys.argv) != 3 or sys.argv[1] != "export":
+        sys.exit("usage: python embedding_backend.py export <model path>")
+    export_onnx(sys.argv[2])
@@ -0,0 +1,273 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import CACHE_LOOKUPS, EMBEDDING_SECONDS, EMBEDDING_TEXTS, timed
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_QUERY_LRU_SIZE = int(os.getenv("EMBEDDING_QUERY_LRU_SIZE", "1024"))
+
+
+def normalize_text(text):
+    # The MiniLM tokenizer splits on whitespace, so collapsing it does not change the embedding
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model_id, text):
+    return hashlib.sha256((model_id + "\0" + normalize_text(text)).encode("utf-8")).hexdigest()
+
+
+def vector_checksum(vector):
+    return int.from_bytes(hashlib.blake2b(np.asarray(vector, dtype=np.float32).tobytes(), digest_size=8).digest(),
+                          "little", signed=True)
+
+
+class DiskEmbeddingCache:
+    """
+    Fixed-capacity on-disk store of float32 vectors.
+
+    Vectors live in a memory-mapped `vectors-<dim>x<max_entries>.f32` matrix of max_entries
+    rows; `index-<dim>x<max_entries>.sqlite` maps each content key to its row, a checksum of
+    the vector and its last use. When full, the least recently used rows are reused. SQLite
+    serializes slot allocation, so the loader and the query services can share one cache
+    directory (processes configured with another size use files of their own).
+
+    Rows are written after their slot is committed and readers check them against the
+    checksum: a row another process is rewriting, or never finished writing, is a miss.
+    """
+    def __init__(self, path, dim, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        os.makedirs(path, exist_ok=True)
+        self.dim = dim
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        layout = f"{dim}x{max_entries}"
+        self.db = sqlite3.connect(os.path.join(path, f"index-{layout}.sqlite"), timeout=30, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, "
+                        "checksum INTEGER NOT NULL, last_used INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('next_slot', 0)")
+
+        vectors_path = os.path.join(path, f"vectors-{layout}.f32")
+        expected_size = max_entries * dim * 4
+        if not os.path.exists(vectors_path):
+            # Sized under a temporary name and linked in, so another process never maps it half-made
+            tmp = f"{vectors_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.truncate(expected_size)
+            try:
+                os.link(tmp, vectors_path)
+            except FileExistsError:
+                pass
+            os.unlink(tmp)
+        size = os.path.getsize(vectors_path)
+        if size != expected_size:
+            raise RuntimeError(f"Embedding cache {vectors_path} has {size} bytes, expected {expected_size}; "
+                               f"remove {path} to start a new cache")
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(max_entries, dim))
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys that are cached."""
+        keys = list(keys)
+        found = {}
+        now = time.time_ns()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self.db.execute(
+                    f"SELECT key, slot, checksum FROM entries WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, slot, checksum in rows:
+                    vector = np.array(self.vectors[slot])
+                    if vector_checksum(vector) == checksum:
+                        found[key] = vector
+            if found:
+                self.db.execute("BEGIN")
+                self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self.db.execute("COMMIT")
+        return found
+
+    def put_many(self, items):
+        """Stores {key: vector}, evicting the least recently used entries when full."""
+        if not items:
+            return
+        now = time.time_ns()
+        checksums = {key: vector_checksum(vector) for key, vector in items.items()}
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                keys = list(items)
+                existing = {}
+                for i in range(0, len(keys), 500):
+                    part = keys[i:i + 500]
+                    existing.update((key, (slot, checksum)) for key, slot, checksum in self.db.execute(
+                        f"SELECT key, slot, checksum FROM entries WHERE key IN ({','.join('?' * len(part))})", part))
+                new_keys = [key for key in keys if key not in existing][:self.max_entries]
+                # Entries whose row was never written (a writer died after committing) are written again
+                rewrite = [(key, slot) for key, (slot, checksum) in existing.items()
+                           if vector_checksum(self.vectors[slot]) != checksum]
+
+                next_slot = self.db.execute("SELECT value FROM meta WHERE name = 'next_slot'").fetchone()[0]
+                fresh = min(len(new_keys), self.max_entries - next_slot)
+                slots = list(range(next_slot, next_slot + fresh))
+                if fresh:
+                    self.db.execute("UPDATE meta SET value = ? WHERE name = 'next_slot'", (next_slot + fresh,))
+                if len(new_keys) > fresh:
+                    evicted = self.db.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                                              (len(new_keys) - fresh,)).fetchall()
+                    self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    slots.extend(slot for _, slot in evicted)
+
+                written = list(zip(new_keys, slots)) + rewrite
+                self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)",
+                                    [(key, slot, checksums[key], now) for key, slot in zip(new_keys, slots)])
+                self.db.executemany("UPDATE entries SET checksum = ?, last_used = ? WHERE key = ?",
+                                    [(checksums[key], now, key) for key, _ in rewrite])
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+            # Only once the slots are ours: until then readers see the checksum disagree, not a wrong vector
+            for key, slot in written:
+                self.vectors[slot] = items[key]
+            self.vectors.flush()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a langchain Embeddings model with a content-addressed cache keyed by
+    sha256(model_id + normalized text): an in-process LRU for query strings in front
+    of the shared on-disk cache. Only texts missing from both reach the model.
+    """
+    def __init__(self, embeddings, model_id, dim=384, cache_dir=EMBEDDING_CACHE_DIR,
+                 max_entries=EMBEDDING_CACHE_MAX_ENTRIES, query_cache_size=EMBEDDING_QUERY_LRU_SIZE):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.disk = DiskEmbeddingCache(cache_dir, dim, max_entries) if cache_dir else None
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _lookup(self, keys):
+        return self.disk.get_many(set(keys)) if self.disk is not None else {}
+
+    def _remember_query(self, key, vector):
+        with self._lock:
+            self._queries[key] = vector
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_id, text) for text in texts]
+        found = self._lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            with timed(EMBEDDING_SECONDS, "embedding", kind="documents"):
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            EMBEDDING_TEXTS.labels(kind="documents").inc(len(missing))
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+            if self.disk is not None:
+                self.disk.put_many(computed)
+            found.update(computed)
+        with self._lock:
+            self.disk_hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        CACHE_LOOKUPS.labels(cache="embedding", result="disk").inc(len(texts) - len(missing))
+        CACHE_LOOKUPS.labels(cache="embedding", result="miss").inc(len(missing))
+        return [found[key].tolist() for key in keys]
+
+    def embed_transient(self, texts):
+        """
+        Embeds texts that are used once and thrown away (the sentences pack_context scores)
+        with the wrapped model, bypassing both cache tiers, so they neither take the disk
+        cache's write lock on the request path nor evict chunk and query vectors.
+        """
+        with timed(EMBEDDING_SECONDS, "embedding", kind="sentences"):
+            vectors = self.embeddings.embed_documents(list(texts))
+        EMBEDDING_TEXTS.labels(kind="sentences").inc(len(vectors))
+        return vectors
+
+    def embed_query(self, text):
+        key = cache_key(self.model_id, text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.memory_hits += 1
+                CACHE_LOOKUPS.labels(cache="embedding", result="memory").inc()
+                return vector.tolist()
+
+        found = self._lookup([key])
+        if key in found:
+            vector = found[key]
+            with self._lock:
+                self.disk_hits += 1
+            CACHE_LOOKUPS.labels(cache="embedding", result="disk").inc()
+        else:
+            with timed(EMBEDDING_SECONDS, "embedding", kind="query"):
+                vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            EMBEDDING_TEXTS.labels(kind="query").inc()
+            if self.disk is not None:
+                self.disk.put_many({key: vector})
+            with self._lock:
+                self.misses += 1
+            CACHE_LOOKUPS.labels(cache="embedding", result="miss").inc()
+        self._remember_query(key, vector)
+        return vector.tolist()
+
+    def embed_queries(self, texts):
+        """
+        embed_query for many texts at once: LRU hits come from memory, everything else goes
+        through a single embed_documents batch (the same vectors for MiniLM, which has no
+        query prefix) and is remembered as a query.
+        """
+        keys = [cache_key(self.model_id, text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._queries.get(key)
+                if vector is not None:
+                    self._queries.move_to_end(key)
+                    self.memory_hits += 1
+                    vectors[key] = vector
+        CACHE_LOOKUPS.labels(cache="embedding", result="memory").inc(len(vectors))
+        rest = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if rest:
+            for key, vector in zip(rest, self.embed_documents(list(rest.values()))):
+                vectors[key] = np.asarray(vector, dtype=np.float32)
+                self._remember_query(key, vectors[key])
+        return [vectors[key].tolist() for key in keys]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "query_lru_entries": len(self._queries),
+                "disk_entries": len(self.disk) if self.disk is not None else 0,
+            }
@@ -1,11 +1,43 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+GECO_API_URL = os.getenv("GECO_API_URL", "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs")
 
 class GECOClient:
-    def __init__(self, username: str, password: str):
-        self.token_url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/get-token"
+    def __init__(self, username: str, password: str, base_url: str = GECO_API_URL,
+                 max_workers: int = 8, retries: int = 3, backoff_factor: float = 0.5,
+                 timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.token_url = self.base_url + "/get-token"
         self.username = username
         self.password = password
         self.token = None
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._token_lock = threading.Lock()
+
+        # One pooled session shared by every call (and every worker thread), with
+        # retry + exponential backoff on 5xx responses, connection errors and timeouts.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def get_token(self):
         payload = {
@@ -13,7 +45,7 @@ class GECOClient:
             'password': self.password
         }
 
-        response = requests.post(self.token_url, data=payload)
+        response = self.session.post(self.token_url, data=payload, timeout=self.timeout)
 
         if response.status_code == 200:
             self.token = response.json().get('token')
@@ -22,88 +54,99 @@ class GECOClient:
         else:
             raise Exception(f"Failed to get token. Status: {response.status_code}, Response: {response.text}")
 
-    def make_authorized_request(self, url: str):
+    def _refresh_token(self, expired_token):
+        # Only the first thread that sees the expired token asks for a new one.
+        with self._token_lock:
+            if self.token == expired_token:
+                self.get_token()
+
+    def make_authorized_request(self, url: str, headers=None, stream=False):
         if not self.token:
-            raise Exception("No token available. Call get_token() first.")
+            self._refresh_token(None)
 
+        token = self.token
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
+            "Authorization": f"Token {token}",
+            **(headers or {}),
         }
-        return requests.get(url, headers=headers)
-
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+        if response.status_code in (401, 403):
+            response.close()
+            self._refresh_token(token)
+            headers["Authorization"] = f"Token {self.token}"
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+        return response
 
     def list_corpus(self):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/corpus"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        return requests.get(url, headers=headers)
+        return self.make_authorized_request(self.base_url + "/corpus")
 
     def corpus_metadata(self, corpus_id: str):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/corpus/" + corpus_id + "/meta"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        return requests.get(url, headers=headers)
+        return self.make_authorized_request(self.base_url + "/corpus/" + corpus_id + "/meta")
 
     def list_corpus_documents(self, corpus_id: str):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/corpus/" + corpus_id
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        return requests.get(url, headers=headers)
+        return self.make_authorized_request(self.base_url + "/corpus/" + corpus_id)
 
     def list_corpus_applications(self, corpus_id: str):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
+        return self.make_authorized_request(self.base_url + "/apps/" + corpus_id + "/aplicaciones")
 
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/apps/" + corpus_id + "/aplicaciones"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        return requests.get(url, headers=headers)
-    
     def list_corpus_files(self, corpus_id: str, documents_id: str):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
-
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/corpus/" + corpus_id + "/" + documents_id + "/adjuntos"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        return requests.get(url, headers=headers)
+        return self.make_authorized_request(self.base_url + "/corpus/" + corpus_id + "/" + documents_id + "/adjuntos")
 
     def get_corpus_file(self, corpus_id: str, documents_id):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
-
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/corpus/" + corpus_id + "/" + documents_id + "/" + '544'
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        return requests.get(url, headers=headers)
+        return self.make_authorized_request(self.base_url + "/corpus/" + corpus_id + "/" + documents_id + "/" + '544')
 
     def get_corpus_text(self, corpus_id: str, documents_id):
-        if not self.token:
-            raise Exception("No token available. Call get_token() first.")
-
-        url = "http://devsys.iingen.unam.mx/geco4/proyectos/apidocs/corpus/" + corpus_id + "/" + documents_id
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Token {self.token}"
-        }
-        response = requests.get(url, headers=headers)
+        response = self.make_authorized_request(self.base_url + "/corpus/" + corpus_id + "/" + documents_id)
+        response.raise_for_status()
         return response.json()
+
+    def stream_corpus_text(self, corpus_id: str, documents_id, etag=None, last_modified=None):
+        """
+        Conditional, streamed GET of a document text: the caller reads the body with
+        iter_content() and closes the response. A 304 means the copy behind `etag` /
+        `last_modified` is still current.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = self.make_authorized_request(self.base_url + "/corpus/" + corpus_id + "/" + documents_id,
+                                                headers=headers, stream=True)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def map_ordered(self, fn, items):
+        """
+        Runs fn(item) for every item on max_workers threads and yields (item, result or
+        exception) in the order the items were given. At most 2 * max_workers results are
+        in flight or buffered, so a slow consumer throttles the work instead of piling
+        results up in memory.
+        """
+        def call(item):
+            try:
+                return item, fn(item)
+            except Exception as e:
+                return item, e
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for item in items:
+                pending.append(pool.submit(call, item))
+                if len(pending) >= 2 * self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def get_corpus_texts(self, corpus_id: str, documents_ids):
+        """
+        Fetches the text of several documents of a corpus in parallel over the pooled session.
+        Yields (documents_id, response_json or exception) in the order the ids were given.
+        """
+        return self.map_ordered(lambda documents_id: self.get_corpus_text(corpus_id, documents_id),
+                                (str(documents_id) for documents_id in documents_ids))
+
+    def close(self):
+        self.session.close()
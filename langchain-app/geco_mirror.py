@@ -0,0 +1,272 @@
+import codecs
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:  # optional: the mirror falls back to gzip
+    zstandard = None
+
+from metrics import CACHE_LOOKUPS
+
+# Opt-in: empty (the default) disables the mirror and load.py reads every text from the GECO API
+GECO_MIRROR_DIR = os.getenv("GECO_MIRROR_DIR", "")
+# Seconds a mirrored text whose response had no ETag / Last-Modified is trusted before it is
+# downloaded again (0 = until its listing fields change)
+GECO_MIRROR_MAX_AGE = int(os.getenv("GECO_MIRROR_MAX_AGE", str(7 * 24 * 3600)))
+GECO_MIRROR_CODEC = os.getenv("GECO_MIRROR_CODEC", "zstd" if zstandard is not None else "gzip")
+GECO_MIRROR_LEVEL = int(os.getenv("GECO_MIRROR_LEVEL", "3"))
+STREAM_CHUNK_BYTES = 64 * 1024
+EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+
+# Listing fields that, when they change, mean the mirrored text may be stale
+LISTING_FIELDS = ("archivo", "derechos")
+
+# One step through a JSON string literal: plain characters, a simple escape, a \u escape
+# (surrogate pairs as one step) or a high surrogate known not to start a pair. Stops before
+# the closing quote and before an escape cut off at the end of the buffer.
+_STRING_STEP = re.compile(
+    r'(?:[^"\\]+|\\[^u]|\\u[dD][89abAB][0-9a-fA-F]{2}\\u[0-9a-fA-F]{4}'
+    r'|\\u(?![dD][89abAB])[0-9a-fA-F]{4}|\\u[dD][89abAB][0-9a-fA-F]{2}(?=[^\\]|\\[^u]))*'
+)
+
+
+def iter_json_string(chunks, key="data"):
+    """
+    Yields the decoded pieces of the string value of `key` in a JSON object that arrives as
+    byte `chunks`, so a large text never sits in memory as a whole body plus a parsed copy.
+    The first `"key":` in the body is taken, which is the only field of GECO text responses.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*(\S)')
+    buffer = ""
+    in_string = False
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        if not in_string:
+            match = start.search(buffer)
+            if match is None:
+                continue
+            if match.group(1) != '"':
+                raise ValueError(f"`{key}` is not a string")
+            buffer = buffer[match.end():]
+            in_string = True
+        end = _STRING_STEP.match(buffer).end()
+        if end < len(buffer) and buffer[end] == '"':
+            yield json.loads('"' + buffer[:end] + '"')
+            return
+        if end:
+            yield json.loads('"' + buffer[:end] + '"')
+            buffer = buffer[end:]
+    raise ValueError(f"response ended before the end of `{key}`")
+
+
+class GECOMirror:
+    """
+    Local copy of the GECO corpora: the corpus and document listings plus the text of every
+    fetched document, compressed (zstd, or gzip without zstandard) and stored once per content
+    under objects/<sha256 of the text>. `index.json` maps each document to its object, the
+    listing fields it was fetched under and the response's ETag / Last-Modified.
+
+    A text is downloaded again only when its listing fields change, its object is missing,
+    a conditional request says it changed or, without validators, it is older than `max_age`
+    seconds; with `offline` everything comes from disk.
+    """
+    def __init__(self, path=GECO_MIRROR_DIR, codec=GECO_MIRROR_CODEC, max_age=GECO_MIRROR_MAX_AGE):
+        if codec not in EXTENSIONS:
+            raise ValueError(f"GECO_MIRROR_CODEC must be zstd or gzip, not {codec!r}")
+        if codec == "zstd" and zstandard is None:
+            raise RuntimeError("GECO_MIRROR_CODEC=zstd needs the zstandard package")
+        self.path = path
+        self.codec = codec
+        self.max_age = max_age
+        self.index_path = os.path.join(path, "index.json")
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self.listing = {"corpora": [], "documents": {}}
+        self.texts = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.listing = data.get("listing", self.listing)
+            self.texts = data.get("texts", {})
+        self.local = 0
+        self.not_modified = 0
+        self.fetched = 0
+        self.compressed_bytes = 0
+        self.text_bytes = 0
+
+    # ==== Listings ====
+
+    def corpora(self):
+        return [dict(corpus) for corpus in self.listing["corpora"]]
+
+    def set_corpora(self, corpora):
+        """Stores the corpus listing and forgets the corpora no longer in it."""
+        self.listing["corpora"] = [{"id": corpus["id"], "nombre": corpus["nombre"]} for corpus in corpora]
+        listed = {str(corpus["id"]) for corpus in corpora}
+        with self._lock:
+            for corpus_id in [c for c in self.listing["documents"] if c not in listed]:
+                del self.listing["documents"][corpus_id]
+            for corpus_id in [c for c in self.texts if c not in listed]:
+                del self.texts[corpus_id]
+
+    def documents(self, corpus_id):
+        if str(corpus_id) not in self.listing["documents"]:
+            raise KeyError(f"corpus {corpus_id} is not in the GECO mirror")
+        return [dict(document) for document in self.listing["documents"][str(corpus_id)]]
+
+    def set_documents(self, corpus_id, documents):
+        """Stores the listing of a corpus and forgets the texts of documents no longer in it."""
+        self.listing["documents"][str(corpus_id)] = [dict(document) for document in documents]
+        listed = {str(document["id"]) for document in documents}
+        with self._lock:
+            texts = self.texts.get(str(corpus_id), {})
+            for document_id in [d for d in texts if d not in listed]:
+                del texts[document_id]
+
+    # ==== Texts ====
+
+    def object_path(self, entry):
+        return os.path.join(self.path, "objects", entry["sha256"][:2], f"{entry['sha256']}.txt.{EXTENSIONS[entry['codec']]}")
+
+    def get(self, corpus_id, document_id):
+        with self._lock:
+            return self.texts.get(str(corpus_id), {}).get(str(document_id))
+
+    def is_current(self, entry, document):
+        return entry is not None and all(entry.get(f) == document.get(f) for f in LISTING_FIELDS) \
+            and os.path.exists(self.object_path(entry))
+
+    def is_expired(self, entry):
+        """Whether an entry that cannot be revalidated is past `max_age` (entries without a fetch time are)."""
+        return bool(self.max_age) and time.time() - entry.get("fetched", 0) > self.max_age
+
+    def open_text(self, entry):
+        """Text stream that decompresses the object as it is read."""
+        path = self.object_path(entry)
+        if entry["codec"] != "zstd":
+            return gzip.open(path, "rt", encoding="utf-8")
+        if zstandard is None:
+            raise RuntimeError("the GECO mirror has zstd objects; install zstandard")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8")
+
+    def read_text(self, entry):
+        with self.open_text(entry) as f:
+            return f.read()
+
+    def _writer(self, raw):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=GECO_MIRROR_LEVEL).stream_writer(raw, closefd=False)
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GECO_MIRROR_LEVEL, mtime=0)
+
+    def store(self, corpus_id, document, response):
+        """Streams a GECO text response into a compressed object and records it for the document."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.path, "objects"), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                with self._writer(raw) as out:
+                    for piece in iter_json_string(response.iter_content(STREAM_CHUNK_BYTES)):
+                        data = piece.encode("utf-8")
+                        digest.update(data)
+                        out.write(data)
+                        size += len(data)
+                compressed = raw.tell()
+            entry = {field: document.get(field) for field in LISTING_FIELDS}
+            entry.update(corpus_id=str(corpus_id), sha256=digest.hexdigest(), codec=self.codec, bytes=size,
+                         etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"),
+                         fetched=int(time.time()))
+            path = self.object_path(entry)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Identical texts share one object
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            self.texts.setdefault(str(corpus_id), {})[str(document["id"])] = entry
+            self.fetched += 1
+            self.compressed_bytes += compressed
+            self.text_bytes += size
+        return entry
+
+    def fetch_texts(self, client, corpus_id, documents, refetch=False):
+        """
+        Yields (document_id, text or exception) for the {document_id: listing entry} in
+        `documents`, in order, on the client's worker threads. Mirrored texts whose listing
+        fields are unchanged are read from disk; with a validator from the last download they
+        are revalidated first (304 = keep), without one they are downloaded again once older
+        than `max_age`, and `refetch` downloads them all again. With `client` None (offline)
+        nothing is downloaded.
+        """
+        def fetch(document_id):
+            document = documents[document_id]
+            entry = self.get(corpus_id, document_id)
+            current = self.is_current(entry, document)
+            if current and (client is None or not refetch and not (entry["etag"] or entry["last_modified"])
+                            and not self.is_expired(entry)):
+                with self._lock:
+                    self.local += 1
+                CACHE_LOOKUPS.labels(cache="geco_mirror", result="local").inc()
+                return self.read_text(entry)
+            if client is None:
+                raise KeyError(f"document {document_id} of corpus {corpus_id} is not in the GECO mirror")
+            validators = {"etag": entry["etag"], "last_modified": entry["last_modified"]} if current and not refetch else {}
+            with client.stream_corpus_text(str(corpus_id), document_id, **validators) as response:
+                if response.status_code == 304:
+                    with self._lock:
+                        self.not_modified += 1
+                    CACHE_LOOKUPS.labels(cache="geco_mirror", result="not_modified").inc()
+                else:
+                    entry = self.store(corpus_id, document, response)
+                    CACHE_LOOKUPS.labels(cache="geco_mirror", result="fetched").inc()
+            return self.read_text(entry)
+
+        if client is None:
+            for document_id in documents:
+                try:
+                    yield document_id, fetch(document_id)
+                except Exception as e:
+                    yield document_id, e
+        else:
+            yield from client.map_ordered(fetch, list(documents))
+
+    def prune(self):
+        """Deletes the objects no document refers to any more; returns how many."""
+        with self._lock:
+            referenced = {os.path.basename(self.object_path(entry))
+                          for texts in self.texts.values() for entry in texts.values()}
+        removed = 0
+        for directory, _, files in os.walk(os.path.join(self.path, "objects")):
+            for name in files:
+                if name not in referenced and not name.endswith(".tmp"):
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        return removed
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({"listing": self.listing, "texts": self.texts}, ensure_ascii=False)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.index_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "local": self.local,
+                "not_modified": self.not_modified,
+                "fetched": self.fetched,
+                "compression_ratio": round(self.text_bytes / self.compressed_bytes, 2) if self.compressed_bytes else None,
+                "documents": sum(len(texts) for texts in self.texts.values()),
+            }
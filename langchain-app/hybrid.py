@@ -0,0 +1,169 @@
+import os
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from qdrant_client.models import FieldCondition, Filter, MatchValue, QueryRequest
+
+from manifest import point_id
+from metrics import SEARCH_SECONDS, timed
+
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Both legs fetch k * RETRIEVAL_OVERFETCH candidates, so that k remain after `diversify`
+RETRIEVAL_OVERFETCH = int(os.getenv("RETRIEVAL_OVERFETCH", "4"))
+# Chunks of one GECO document an unfiltered result may hold; 0 = no limit
+MAX_CHUNKS_PER_DOCUMENT = int(os.getenv("MAX_CHUNKS_PER_DOCUMENT", "1"))
+# Chunks of the same document on each side of a result that are fetched by id and joined to it; 0 = none
+CONTEXT_NEIGHBOURS = int(os.getenv("CONTEXT_NEIGHBOURS", "0"))
+
+
+def per_document_limit(source):
+    # A search filtered to one routed `source` has all its candidates in one file (often one
+    # document): capping it would leave the LLM a single chunk
+    return 0 if source else MAX_CHUNKS_PER_DOCUMENT
+
+
+def fetch_k(k):
+    return k * max(RETRIEVAL_OVERFETCH, 1)
+
+
+def diversify(docs, k, per_document=MAX_CHUNKS_PER_DOCUMENT):
+    """The first `k` of `docs` (best first), skipping chunks of documents that already have `per_document`."""
+    kept, taken = [], {}
+    for doc in docs:
+        key = (doc.metadata.get("corpus_id"), doc.metadata.get("document"))
+        if per_document and taken.get(key, 0) >= per_document:
+            continue
+        taken[key] = taken.get(key, 0) + 1
+        kept.append(doc)
+        if len(kept) == k:
+            break
+    return kept
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses lists of point ids (best first) into one list sorted by sum(1 / (k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, pid in enumerate(ranking):
+            scores[pid] = scores.get(pid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def point_document(point, collection_name):
+    """A point as a Document shaped like the ones the langchain Qdrant store returns."""
+    metadata = dict(point.payload.get("metadata") or {})
+    metadata["_id"] = point.id
+    metadata["_collection_name"] = collection_name
+    return Document(page_content=point.payload.get("page_content", ""), metadata=metadata)
+
+
+def fetch_documents(client, collection_name, ids):
+    """Loads points by id as Documents."""
+    return {str(point.id): point_document(point, collection_name)
+            for point in client.retrieve(collection_name=collection_name, ids=ids, with_payload=True)}
+
+
+def neighbour_ids(metadata, radius):
+    """Point ids of the chunks around a result's; none for points written before chunks had offsets."""
+    chunk = metadata.get("chunk")
+    if not isinstance(chunk, int) or "start" not in metadata:
+        return []
+    return [point_id(metadata["corpus_id"], metadata["document"], chunk + step)
+            for step in range(-radius, radius + 1) if step and chunk + step >= 0]
+
+
+def with_neighbours(client, collection_name, docs, radius=CONTEXT_NEIGHBOURS):
+    """
+    Each of `docs` extended with up to `radius` chunks on each side: one retrieve by point id
+    for all of them (no search), joined by their character offsets so the overlap between
+    chunks is not repeated. A neighbour that is missing (collapsed into another document's
+    point, see dedup.py) ends the span on its side.
+    """
+    if radius <= 0:
+        return docs
+    ids = {pid for doc in docs for pid in neighbour_ids(doc.metadata, radius)}
+    if not ids:
+        return docs
+    neighbours = fetch_documents(client, collection_name, list(ids))
+    extended = []
+    for doc in docs:
+        chunks = {doc.metadata.get("chunk"): doc}
+        for pid in neighbour_ids(doc.metadata, radius):
+            if pid in neighbours and neighbours[pid].metadata.get("document") == doc.metadata.get("document"):
+                chunks[neighbours[pid].metadata["chunk"]] = neighbours[pid]
+        if len(chunks) == 1:
+            extended.append(doc)
+            continue
+        first = last = doc.metadata["chunk"]
+        while first - 1 in chunks:
+            first -= 1
+        while last + 1 in chunks:
+            last += 1
+        text, end = chunks[first].page_content, chunks[first].metadata["end"]
+        for index in range(first + 1, last + 1):
+            chunk = chunks[index]
+            start = chunk.metadata["start"]
+            text += chunk.page_content[end - start:] if start < end else " " + chunk.page_content
+            end = chunk.metadata["end"]
+        extended.append(Document(page_content=text, metadata={
+            **doc.metadata, "start": chunks[first].metadata["start"], "end": end, "chunks": [first, last]}))
+    return extended
+
+
+def source_filter(source):
+    return Filter(must=[FieldCondition(key="metadata.source", match=MatchValue(value=source))]) if source else None
+
+
+def batch_hybrid_search(client, collection_name, queries, vectors, sources, lexical_index, k=5, search_params=None):
+    """
+    hybrid_search for many queries: the dense leg of all of them is a single batched request
+    (per-query `source` filters), then each result list is fused with its BM25 hits.
+    """
+    with timed(SEARCH_SECONDS, "vector_search", kind="dense_batch"):
+        responses = client.query_batch_points(collection_name=collection_name, requests=[
+            QueryRequest(query=vector, filter=source_filter(source), limit=fetch_k(k), with_payload=True, params=search_params)
+            for vector, source in zip(vectors, sources)
+        ])
+    return [
+        hybrid_search([point_document(point, collection_name) for point in response.points],
+                      lexical_index, client, collection_name, query, k=k, source=source)
+        for query, source, response in zip(queries, sources, responses)
+    ]
+
+
+def hybrid_search(dense_docs, lexical_index, client, collection_name, query, k=5, source=None):
+    """
+    Merges the dense results (`fetch_k(k)` of them) with as many BM25 hits for the same query
+    (and `source` filter) by reciprocal-rank fusion, then keeps the best `k` that `diversify`
+    allows (no per-document cap when `source` is set). Chunks only found by BM25 are fetched from Qdrant by id, and so are the
+    CONTEXT_NEIGHBOURS chunks around each result (`with_neighbours`).
+    """
+    if lexical_index is None:
+        return with_neighbours(client, collection_name, diversify(dense_docs, k, per_document_limit(source)))
+    docs = {str(doc.metadata["_id"]): doc for doc in dense_docs}
+    with timed(SEARCH_SECONDS, "lexical_search", kind="lexical"):
+        lexical_ids = [pid for pid, _ in lexical_index.search(query, k=fetch_k(k), source=source)]
+    fused = reciprocal_rank_fusion([list(docs), lexical_ids])[:fetch_k(k)]
+    missing = [pid for pid in fused if pid not in docs]
+    if missing:
+        docs.update(fetch_documents(client, collection_name, missing))
+    return with_neighbours(client, collection_name,
+                           diversify([docs[pid] for pid in fused if pid in docs], k, per_document_limit(source)))
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense similarity search over the vector store fused with the BM25 index, diversified by document."""
+    vectorstore: Any
+    lexical: Any
+    collection_name: str
+    k: int = 5
+    search_kwargs: dict = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        # Embedded apart from the search so the two show up separately in the metrics
+        vector = self.vectorstore.embeddings.embed_query(query)
+        with timed(SEARCH_SECONDS, "vector_search", kind="dense"):
+            dense_docs = self.vectorstore.similarity_search_by_vector(vector, k=fetch_k(self.k), **self.search_kwargs)
+        return hybrid_search(dense_docs, self.lexical.get(), self.vectorstore.client, self.collection_name, query, k=self.k)
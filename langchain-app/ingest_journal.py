@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+
+# Attempts per document fetch, corpus listing or upsert before giving up on it
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "4"))
+# Seconds before the first retry, doubled after every further failure
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", "2.0"))
+
+
+def backoff(attempt, base=INGEST_RETRY_BACKOFF):
+    """Seconds to wait after the `attempt`-th failure."""
+    return base * 2 ** (attempt - 1)
+
+
+def with_retries(fn, what, attempts=INGEST_MAX_ATTEMPTS):
+    """Calls fn() until it returns, sleeping `backoff` between failures; the last failure is raised."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff(attempt)
+            print(f"{what} failed (attempt {attempt} of {attempts}): {e}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class IngestJournal:
+    """
+    Progress of one load.py run, appended as JSON lines and fsynced: the run start, every
+    upserted batch of chunks, every finished document and corpus and every failed fetch.
+
+    After a crash the next run replays it and resumes: finished corpora are skipped,
+    finished documents are put back into the manifest and the chunks of a half-written
+    document that are already in the collection are not embedded again. Documents that fail
+    INGEST_MAX_ATTEMPTS times are dead-lettered. The file is removed when a run completes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._load()
+
+    def _load(self):
+        self.run = None
+        self.corpora = {}
+        self.documents = {}
+        self.upserted = {}
+        self.failures = {}
+        self.dead_letters = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last line of a crashed run
+                    self._apply(record)
+
+    def _apply(self, record):
+        event = record["event"]
+        if event == "run":
+            self.run = record
+        elif event == "batch":
+            for corpus_id, document_id, hash, indexes in record["documents"]:
+                entry = self.upserted.setdefault((corpus_id, document_id), {"hash": hash, "chunks": set()})
+                if entry["hash"] != hash:
+                    entry.update(hash=hash, chunks=set())
+                entry["chunks"].update(indexes)
+        elif event == "document":
+            key = (record["corpus_id"], record["document_id"])
+            self.documents[key] = {"hash": record["hash"], "chunks": record["chunks"], "collapsed": record.get("collapsed", [])}
+            self.upserted.pop(key, None)
+        elif event == "corpus":
+            self.corpora[record["corpus_id"]] = record
+        elif event == "failure":
+            key = (record["corpus_id"], record["document_id"])
+            self.failures[key] = {"attempts": record["attempt"], "error": record["error"]}
+            if record["attempt"] >= INGEST_MAX_ATTEMPTS:
+                self.dead_letters[key] = self.failures[key]
+
+    def _write(self, record):
+        with self._lock:
+            self._apply(record)
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def begin(self, full):
+        """Starts a run, or resumes the interrupted one; returns True when resuming."""
+        if self.run is not None:
+            return True
+        self._write({"event": "run", "full": full, "started": int(time.time())})
+        return False
+
+    @property
+    def full(self):
+        return self.run["full"]
+
+    def discard(self):
+        """Forgets an interrupted run, so the next `begin` starts over."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._load()
+
+    # ==== Progress ====
+
+    def batch_upserted(self, chunks):
+        """Records upserted chunks: dicts with "key" (corpus_id, document_id), "hash" and "index"."""
+        documents = {}
+        for chunk in chunks:
+            documents.setdefault((*chunk["key"], chunk["hash"]), []).append(chunk["index"])
+        self._write({"event": "batch", "documents": [[c, d, h, indexes] for (c, d, h), indexes in documents.items()]})
+
+    def upserted_chunks(self, corpus_id, document_id, hash):
+        """Chunk indexes of this version of the document already in the collection."""
+        with self._lock:
+            entry = self.upserted.get((corpus_id, document_id))
+            return set(entry["chunks"]) if entry and entry["hash"] == hash else set()
+
+    def document_done(self, corpus_id, document_id, hash, chunks, collapsed=()):
+        """`collapsed` lists the [point id, canonical point id, chunk metadata] of its near-duplicate chunks."""
+        self._write({"event": "document", "corpus_id": corpus_id, "document_id": document_id, "hash": hash, "chunks": chunks,
+                     "collapsed": list(collapsed)})
+
+    def corpus_done(self, corpus_id, documents, restricted):
+        """
+        `documents` are the open ids the corpus listed, so a resumed run can still remove the
+        others; `restricted` the ones not open for download (`derechos`), for the report.
+        """
+        self._write({"event": "corpus", "corpus_id": corpus_id, "documents": sorted(documents),
+                     "restricted": sorted(restricted)})
+
+    def corpus_documents(self, corpus_id):
+        """Listed document ids of a corpus finished by the interrupted run, or None."""
+        record = self.corpora.get(corpus_id)
+        return record["documents"] if record else None
+
+    def failed(self, corpus_id, document_id, error):
+        """Records a failed attempt and returns how many there have been; the last one dead-letters the document."""
+        with self._lock:
+            attempt = self.failures.get((corpus_id, document_id), {"attempts": 0})["attempts"] + 1
+        self._write({"event": "failure", "corpus_id": corpus_id, "document_id": document_id,
+                     "attempt": attempt, "error": str(error)})
+        if attempt >= INGEST_MAX_ATTEMPTS:
+            print(f"Dead-lettered document {document_id} of corpus {corpus_id} after {attempt} attempts: {error}")
+        return attempt
+
+    def is_dead_letter(self, corpus_id, document_id):
+        with self._lock:
+            return (corpus_id, document_id) in self.dead_letters
+
+    def restore(self, manifest, duplicates):
+        """Puts the documents finished by the interrupted run into the manifest and their collapsed chunks into `duplicates`."""
+        for (corpus_id, document_id), entry in self.documents.items():
+            manifest.set(corpus_id, document_id, entry["hash"], entry["chunks"])
+            for pid, canonical, metadata in entry["collapsed"]:
+                duplicates.add_member(canonical, pid, metadata)
+
+    def complete(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "started": self.run["started"] if self.run else None,
+                "corpora_done": len(self.corpora),
+                "documents_done": len(self.documents),
+                "retried": sorted(f"{c}/{d}" for (c, d), f in self.failures.items()
+                                  if (c, d) not in self.dead_letters),
+                "dead_letters": [{"corpus_id": c, "document_id": d, **entry}
+                                 for (c, d), entry in sorted(self.dead_letters.items())],
+                "restricted_documents": [f"{c}/{d}" for c, record in self.corpora.items() for d in record["restricted"]],
+            }
@@ -0,0 +1,257 @@
+import json
+import os
+import re
+import shutil
+import time
+import unicodedata
+import uuid
+
+import numpy as np
+from qdrant_client.models import FieldCondition, Filter, MatchValue
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "./lexical_index")
+
+STOPWORDS = set("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde durante e el ella
+ellas ellos en entre era es esa esas ese eso esos esta estan estas este esto estos fue fueron ha han hay
+la las le les lo los mas me mi mucho muy nada ni no nos o otra otros para pero poco por porque que quien
+se sea ser si sin sobre su sus tambien tan te tiene todo todos tu un una unas uno unos y ya yo
+""".split())
+
+
+def scroll_points(qdrant, collection_name, with_payload, with_vectors=False, source=None, batch_size=1024):
+    """Every point of the collection, or only those of one `source` (keyword index on metadata.source)."""
+    scroll_filter = Filter(must=[FieldCondition(key="metadata.source", match=MatchValue(value=source))]) if source else None
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(collection_name=collection_name, limit=batch_size, offset=offset,
+                                       with_payload=with_payload, with_vectors=with_vectors, scroll_filter=scroll_filter)
+        yield from points
+        if offset is None:
+            break
+
+
+def _chunks(points):
+    for point in points:
+        payload = point.payload or {}
+        yield point.id, payload.get("page_content", ""), payload.get("metadata", {}).get("source")
+
+
+def ascii_fold(text):
+    # Same NFKD -> ASCII folding load.py applies to `archivo` names
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8')
+
+
+def stem(token):
+    # Light Spanish plural stripping: nodos -> nodo, ecuaciones -> ecuacion, clases -> clase
+    if len(token) > 4 and token.endswith("es") and token[-3] in "lnrdzjy":
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(t) for t in re.findall(r"[a-z0-9]+", ascii_fold(text).lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of the collection.
+
+    Stored as a directory of .npy arrays (CSR postings: term offsets, chunk numbers and
+    uint16 term frequencies; chunk lengths; 16-byte point ids; source numbers) plus the
+    vocabulary and source names, memory-mapped on load.
+    """
+    def __init__(self, terms, sources, offsets, postings, freqs, lengths, point_ids, doc_sources, k1=1.2, b=0.75):
+        self.terms = terms if isinstance(terms, dict) else {t: i for i, t in enumerate(terms)}
+        self.sources = list(sources)
+        self.source_numbers = {s: i for i, s in enumerate(self.sources)}
+        self.offsets = offsets
+        self.postings = postings
+        self.freqs = freqs
+        self.lengths = lengths
+        self.point_ids = point_ids
+        self.doc_sources = doc_sources
+        self.k1 = k1
+        self.b = b
+        n = len(lengths)
+        self.avg_length = float(lengths.mean()) if n else 0.0
+        self.norm = k1 * (1.0 - b + b * np.asarray(lengths, dtype=np.float32) / max(self.avg_length, 1e-9))
+        df = np.diff(offsets).astype(np.float64)
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @classmethod
+    def build(cls, chunks):
+        """`chunks` yields (point_id, text, source)."""
+        postings_by_term = {}
+        lengths, point_ids, doc_sources = [], [], []
+        sources = {}
+        for n, (pid, text, source) in enumerate(chunks):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            point_ids.append(uuid.UUID(str(pid)).bytes)
+            doc_sources.append(sources.setdefault(source, len(sources)))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings_by_term.setdefault(token, []).append((n, min(count, 65535)))
+
+        terms = sorted(postings_by_term)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        postings, freqs = [], []
+        for i, term in enumerate(terms):
+            entries = postings_by_term[term]
+            offsets[i + 1] = offsets[i] + len(entries)
+            postings.extend(n for n, _ in entries)
+            freqs.extend(c for _, c in entries)
+        return cls(
+            terms, sorted(sources, key=sources.get), offsets,
+            np.array(postings, dtype=np.int32), np.array(freqs, dtype=np.uint16),
+            np.array(lengths, dtype=np.int32),
+            np.frombuffer(b"".join(point_ids), dtype=np.uint8).reshape(-1, 16),
+            np.array(doc_sources, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_collection(cls, qdrant, collection_name, batch_size=1024):
+        return cls.build(_chunks(scroll_points(qdrant, collection_name, ["page_content", "metadata.source"],
+                                               batch_size=batch_size)))
+
+    def update(self, qdrant, collection_name, sources):
+        """
+        A new index where the chunks of `sources` (the ones a sync wrote or deleted points of)
+        are replaced by their points now in the collection; only those sources are scrolled,
+        the postings of the rest are carried over as they are.
+        """
+        removed = [self.source_numbers[s] for s in sources if s in self.source_numbers]
+        keep = ~np.isin(np.asarray(self.doc_sources), removed)
+        renumber = np.cumsum(keep) - 1
+        posting_terms = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        kept = keep[self.postings]
+        terms = sorted(self.terms, key=self.terms.get)
+        term_numbers = dict(self.terms)
+        source_names = list(self.sources)
+        source_numbers = dict(self.source_numbers)
+
+        n = int(keep.sum())
+        new_terms, new_chunks, new_freqs, lengths, point_ids, doc_sources = [], [], [], [], [], []
+        for source in sources:
+            for pid, text, chunk_source in _chunks(scroll_points(qdrant, collection_name, ["page_content", "metadata.source"],
+                                                                 source=source)):
+                tokens = tokenize(text)
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    if token not in term_numbers:
+                        term_numbers[token] = len(terms)
+                        terms.append(token)
+                    new_terms.append(term_numbers[token])
+                    new_chunks.append(n)
+                    new_freqs.append(min(count, 65535))
+                lengths.append(len(tokens))
+                point_ids.append(uuid.UUID(str(pid)).bytes)
+                if chunk_source not in source_numbers:
+                    source_numbers[chunk_source] = len(source_names)
+                    source_names.append(chunk_source)
+                doc_sources.append(source_numbers[chunk_source])
+                n += 1
+
+        all_terms = np.concatenate([posting_terms[kept], np.array(new_terms, dtype=np.int64)])
+        all_chunks = np.concatenate([renumber[self.postings[kept]], np.array(new_chunks, dtype=np.int64)])
+        all_freqs = np.concatenate([self.freqs[kept], np.array(new_freqs, dtype=np.uint16)])
+        # Terms left without postings are dropped
+        used = np.bincount(all_terms, minlength=len(terms)) > 0
+        all_terms = (np.cumsum(used) - 1)[all_terms]
+        terms = [term for term, u in zip(terms, used) if u]
+        order = np.lexsort((all_chunks, all_terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_terms, minlength=len(terms)), out=offsets[1:])
+        return LexicalIndex(
+            terms, source_names, offsets, all_chunks[order].astype(np.int32), all_freqs[order].astype(np.uint16),
+            np.concatenate([self.lengths[keep], np.array(lengths, dtype=np.int32)]),
+            np.concatenate([self.point_ids[keep], np.frombuffer(b"".join(point_ids), dtype=np.uint8).reshape(-1, 16)]),
+            np.concatenate([self.doc_sources[keep], np.array(doc_sources, dtype=np.int32)]),
+            k1=self.k1, b=self.b,
+        )
+
+    def save(self, path=LEXICAL_INDEX_PATH):
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in ("offsets", "postings", "freqs", "lengths", "point_ids", "doc_sources"):
+            np.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+        terms = sorted(self.terms, key=self.terms.get)
+        with open(os.path.join(tmp, "terms.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(terms))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"sources": self.sources, "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+        old = path + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path=LEXICAL_INDEX_PATH):
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                  for name in ("offsets", "postings", "freqs", "lengths", "point_ids", "doc_sources")}
+        with open(os.path.join(path, "terms.txt"), encoding="utf-8") as f:
+            text = f.read()
+        terms = text.split("\n") if text else []
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(terms, meta["sources"], k1=meta["k1"], b=meta["b"], **arrays)
+
+    def search(self, query, k=5, source=None):
+        """Returns [(point_id, score)] of the k best chunks, optionally only those of one `source`."""
+        n = len(self.lengths)
+        if n == 0:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.terms.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.postings[start:end]
+            tf = self.freqs[start:end].astype(np.float32)
+            scores[docs] += self.idf[term] * tf * (self.k1 + 1.0) / (tf + self.norm[docs])
+        if source is not None:
+            number = self.source_numbers.get(source)
+            if number is None:
+                return []
+            scores[self.doc_sources != number] = 0.0
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(str(uuid.UUID(bytes=self.point_ids[i].tobytes())), float(scores[i])) for i in top if scores[i] > 0]
+
+
+class LexicalIndexFile:
+    """Loads the index written by load.py and reloads it when a new one is saved."""
+    def __init__(self, path=LEXICAL_INDEX_PATH, check_every=30.0):
+        self.path = path
+        self.check_every = check_every
+        self.index = None
+        self._mtime = None
+        self._checked = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked >= self.check_every:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(os.path.join(self.path, "meta.json"))
+            except OSError:
+                return self.index
+            if mtime != self._mtime:
+                self.index = LexicalIndex.load(self.path)
+                self._mtime = mtime
+        return self.index
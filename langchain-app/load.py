@@ -1,134 +1,509 @@
 from gecko_client import GECOClient
-
-from typing import Literal
-
-from langchain_ollama import OllamaEmbeddings
+from geco_mirror import GECOMirror, GECO_MIRROR_DIR
+from ingest_journal import IngestJournal, INGEST_MAX_ATTEMPTS, backoff, with_retries
+from embedding_cache import CachedEmbeddings
+from embedding_backend import embedding_model_id, make_embeddings
+from manifest import Manifest, content_hash, point_id
+from pipeline import Pipeline, Stage
+from section_router import SectionRouter, SECTION_ROUTER_PATH
+from lexical_index import LexicalIndex, LEXICAL_INDEX_PATH, ascii_fold
+from local_store import LocalStore, VECTOR_BACKEND
+from collection_profile import apply_profile, create_collection, finish_bulk_load
+from dedup import NearDuplicates
+from chunking import Chunker
+from answer_cache import INGEST_EPOCH_PATH, write_epoch
+import metrics
 
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance
-from langchain_community.vectorstores import Qdrant
-from langchain_huggingface import HuggingFaceEmbeddings
+from qdrant_client.models import PointIdsList, PointStruct
 
-import unicodedata
 import re
-
-from langchain.schema import Document
-from langchain_ollama import ChatOllama
-
-from langchain import hub
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_core.documents import Document
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langgraph.graph import START, StateGraph
-from typing_extensions import Annotated, List, TypedDict
-
-from langchain.schema import Document
+import argparse
 import json
 import os
+import threading
+import time
+
+parser = argparse.ArgumentParser(description="Sync GECO corpora into the corpus_gecko3 Qdrant collection")
+parser.add_argument("--full", action="store_true",
+                    help="drop and recreate the collection instead of syncing only new/changed/removed documents")
+parser.add_argument("--offline", action="store_true",
+                    help="read corpora and texts from the local GECO mirror (GECO_MIRROR_DIR) without contacting the GECO API")
+parser.add_argument("--refetch", action="store_true",
+                    help="download every text again instead of reading unchanged ones from the GECO mirror")
+parser.add_argument("--restart", action="store_true",
+                    help="discard the journal of an interrupted run instead of resuming it")
+args = parser.parse_args()
+if args.offline and not GECO_MIRROR_DIR:
+    parser.error("--offline needs GECO_MIRROR_DIR")
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "256"))
+UPSERT_PARALLELISM = int(os.getenv("UPSERT_PARALLELISM", "2"))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "256"))
 
-docs = []
 host = "qdrant"
+EMBEDDING_MODEL_PATH = "./local_models/all-MiniLM-L6-v2"
 #embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-embedding_model = HuggingFaceEmbeddings(
-    model_name="./local_models/all-MiniLM-L6-v2"
-)
-# Connect to remote Qdrant
-qdrant = QdrantClient(
-    host=host,  # Replace with actual IP or domain
-    port=6333,
-    https=False
+# Chunks embedded by an earlier run (or by a --full rebuild) come from the shared on-disk cache
+embedding_model = CachedEmbeddings(
+    make_embeddings(EMBEDDING_MODEL_PATH),
+    model_id=embedding_model_id(),
 )
+if VECTOR_BACKEND == "local":
+    # Embedded engine: same client calls, written to LOCAL_STORE_PATH
+    qdrant = LocalStore()
+else:
+    # Connect to remote Qdrant
+    qdrant = QdrantClient(
+        host=host,  # Replace with actual IP or domain
+        port=6333,
+        https=False
+    )
 
 collection_name = "corpus_gecko3"
-# Delete if exists (optional - if you want to recreate every time)
-if qdrant.collection_exists(collection_name=collection_name):
-    qdrant.delete_collection(collection_name=collection_name)
-    print("colection deleted: ", collection_name)
-qdrant.create_collection(
-    collection_name=collection_name,
-    vectors_config=VectorParams(size=384, distance=Distance.COSINE)
-)
+manifest = Manifest(os.getenv("MANIFEST_PATH", f"./{collection_name}_manifest.json"))
+# Progress of this run; after a crash the next run resumes from it (see ingest_journal.py)
+journal = IngestJournal(os.getenv("INGEST_JOURNAL_PATH", f"./{collection_name}_journal.jsonl"))
+REPORT_PATH = os.getenv("INGEST_REPORT_PATH", f"./{collection_name}_ingest_report.json")
+# MinHash signatures of the stored chunks; near-duplicate chunks are collapsed into one point (see dedup.py)
+duplicates = NearDuplicates()
 
+if args.restart:
+    journal.discard()
+resumed = journal.begin(full=args.full)
+# A resumed run keeps the mode it was started with: a --full rebuild must not drop what it already wrote
+full = journal.full
+if resumed:
+    print(f"Resuming the {'--full ' if full else ''}run started at {time.ctime(journal.run['started'])}: "
+          f"{len(journal.corpora)} corpora and {len(journal.documents)} documents already done")
+    journal.restore(manifest, duplicates)
+elif full:
+    # Full rebuild: search has no index until the run finishes
+    if qdrant.collection_exists(collection_name=collection_name):
+        qdrant.delete_collection(collection_name=collection_name)
+        print("colection deleted: ", collection_name)
+    manifest.clear()
+    manifest.save()
+    duplicates.clear()
+    duplicates.save()
+if not qdrant.collection_exists(collection_name=collection_name):
+    create_collection(qdrant, collection_name, bulk_load=full)
+if VECTOR_BACKEND != "local":
+    # Payload indexes for the filtered searches, HNSW/quantization settings (see collection_profile.py)
+    apply_profile(qdrant, collection_name)
 
-client = GECOClient("usuario_anonimo", "2024anonimo")
-client.get_token()
+# Chunks sized in the model's word pieces at sentence ends; large documents are chunked by a process
+# pool, forked here before any pipeline thread starts (see chunking.py)
+chunker = Chunker(os.path.join(EMBEDDING_MODEL_PATH, "tokenizer.json"))
 
-corpus_response = client.list_corpus()
-corpus_data = corpus_response.json()["data"]["proyectos"]
 
-def split_text_into_chunks(text, chunk_size):
+# Sources this run wrote or deleted points of: the only ones the router and BM25 index rescan.
+# Its own lock: delete_points runs both with and without bookkeeping_lock held
+touched_sources = set()
+touched_lock = threading.Lock()
+
+
+def delete_points(corpus_id, document_id, chunk_indexes):
+    ids = [point_id(corpus_id, document_id, k) for k in chunk_indexes]
+    if ids:
+        # Collapsed chunks have no point of their own (and in-process Qdrant rejects unknown ids)
+        points = qdrant.retrieve(collection_name=collection_name, ids=ids, with_payload=["metadata.source"])
+        ids = [point.id for point in points]
+        with touched_lock:
+            touched_sources.update((point.payload or {}).get("metadata", {}).get("source") for point in points)
+    if ids:
+        qdrant.delete(collection_name=collection_name, points_selector=PointIdsList(points=ids))
+
+
+def point_metadata(pid, metadata):
+    # Points that near-duplicate chunks were collapsed into list every document they stand for
+    sources = duplicates.sources(pid, metadata)
+    return {**metadata, "sources": sources} if sources else metadata
+
+
+def release_chunks(corpus_id, document_id, chunk_indexes):
     """
-    Splits text into chunks of fixed integer size and includes leftover characters in the final chunk.
+    Takes chunks of an old or removed version of a document out of the near-duplicate index.
+    A point other chunks were collapsed into is copied to one of them first, so their documents
+    keep it; the caller deletes the points themselves.
     """
-    chunks = []
-    for i in range(0, len(text), chunk_size):
-        chunks.append(text[i:i + chunk_size])
-    return chunks
+    for k in chunk_indexes:
+        pid = point_id(corpus_id, document_id, k)
+        signature, members = duplicates.release(pid)
+        if not members:
+            continue
+        heir = min(members)
+        points = qdrant.retrieve(collection_name=collection_name, ids=[pid], with_payload=True, with_vectors=True)
+        if not points:
+            print(f"Point {pid} with {len(members)} collapsed chunks is missing; their documents lose it")
+            continue
+        duplicates.inherit(heir, signature, members)
+        with touched_lock:
+            touched_sources.add(members[heir].get("source"))
+        qdrant.upsert(collection_name=collection_name, points=[PointStruct(
+            id=heir, vector=points[0].vector,
+            payload={"page_content": points[0].payload["page_content"], "metadata": point_metadata(heir, members[heir])})])
+
+
+def remove_document(corpus_id, document_id):
+    entry = manifest.remove(corpus_id, document_id)
+    if entry:
+        release_chunks(corpus_id, document_id, range(entry["chunks"]))
+        delete_points(corpus_id, document_id, range(entry["chunks"]))
+
+
+def index_finished_points():
+    """Signs the points of documents the interrupted run finished, which the near-duplicate index was saved without."""
+    ids = []
+    for (corpus_id, document_id), entry in journal.documents.items():
+        collapsed = {pid for pid, _, _ in entry["collapsed"]}
+        ids.extend(pid for pid in (point_id(corpus_id, document_id, k) for k in range(entry["chunks"]))
+                   if pid not in collapsed and pid not in duplicates.signatures)
+    for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+        for point in qdrant.retrieve(collection_name=collection_name, ids=ids[start:start + UPSERT_BATCH_SIZE], with_payload=True):
+            duplicates.add(str(point.id), duplicates.signature(point.payload["page_content"]))
+
+
+def refresh_sources():
+    """Rewrites `metadata.sources` of the stored points whose collapsed chunks changed after they were written."""
+    dirty = list(duplicates.take_dirty())
+    for start in range(0, len(dirty), UPSERT_BATCH_SIZE):
+        points = qdrant.retrieve(collection_name=collection_name, ids=dirty[start:start + UPSERT_BATCH_SIZE],
+                                 with_payload=True, with_vectors=True)
+        for point in points:
+            metadata = {key: value for key, value in point.payload["metadata"].items() if key != "sources"}
+            point.payload["metadata"] = point_metadata(str(point.id), metadata)
+        if points:
+            qdrant.upsert(collection_name=collection_name, points=[
+                PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points])
+
+
+if resumed and duplicates.threshold:
+    index_finished_points()
+
+# Compressed local copy of the GECO texts: unchanged documents are read from disk, not downloaded again
+mirror = GECOMirror() if GECO_MIRROR_DIR else None
+
+if args.offline:
+    client = None
+    corpus_data = mirror.corpora()
+else:
+    client = GECOClient("usuario_anonimo", "2024anonimo", max_workers=int(os.getenv("GECO_MAX_WORKERS", "8")))
+    client.get_token()
+
+    corpus_response = client.list_corpus()
+    corpus_data = corpus_response.json()["data"]["proyectos"]
+    if mirror is not None:
+        mirror.set_corpora(corpus_data)
+
+counts = {"unchanged": 0, "embedded": 0, "removed": 0, "resumed": 0}
+# corpus_id -> ids of the documents still listed; missing when the listing failed, so nothing gets removed
+listed_documents = {}
+# Corpora whose listing failed, for the report
+failed_corpora = {}
+# (corpus_id, document_id) -> chunks still waiting to be upserted for a new or changed document
+pending = {}
+# corpus_id -> {"fetched": listing and texts all read, "documents": ids not yet finished, "seen": listed open ids,
+# "restricted": listed ids with `derechos`};
+# the corpus is journaled as done when both are true
+open_corpora = {}
+bookkeeping_lock = threading.Lock()
+
+# ==== Pipeline stages: fetch -> chunk -> embed -> upsert ====
+
+def list_documents(corpus_id):
+    response = client.list_corpus_documents(corpus_id=corpus_id)
+    response.raise_for_status()
+    return response.json().get("data", [])
+
+
+def fetch_texts(corpus_id, documents):
+    """Yields (document_id, text or exception) for {document_id: listing entry}, from the mirror or the API."""
+    if mirror is not None:
+        return mirror.fetch_texts(client, corpus_id, documents, refetch=args.refetch)
+    return ((document_id, response if isinstance(response, Exception) else response['data'])
+            for document_id, response in client.get_corpus_texts(corpus_id=corpus_id, documents_ids=documents.keys()))
+
+
+def fetch_with_retries(corpus_id, documents):
+    """
+    fetch_texts, retrying the failed documents in rounds with exponential backoff. A document
+    is dead-lettered, keeping whatever is indexed for it, once the journal counts
+    INGEST_MAX_ATTEMPTS failures (across resumed runs too).
+    """
+    attempt = 0
+    while documents:
+        if attempt:
+            time.sleep(backoff(attempt))
+        attempt += 1
+        retry = {}
+        for document_id, text in fetch_texts(corpus_id, documents):
+            if isinstance(text, Exception):
+                print(f"Failed to fetch document {document_id} of corpus {corpus_id}: {text}")
+                if journal.failed(corpus_id, document_id, text) < INGEST_MAX_ATTEMPTS:
+                    retry[document_id] = documents[document_id]
+                continue
+            yield document_id, text
+        documents = retry
+
+
+def corpus_progress(corpus_id, document_id=None):
+    # Called with bookkeeping_lock held, when the corpus has been read (document_id None) or one of
+    # its documents is finished; the corpus is done once both leave nothing outstanding
+    state = open_corpora[corpus_id]
+    if document_id is None:
+        state["fetched"] = True
+    else:
+        state["documents"].discard(document_id)
+    if state["fetched"] and not state["documents"]:
+        journal.corpus_done(corpus_id, state["seen"], state["restricted"])
+        del open_corpora[corpus_id]
+
 
-# Iterate through each corpus and enrich it with documents
-corpus_count = str(len(corpus_data))
-for j,corpus in enumerate(corpus_data):
-    corpus_id = str(corpus["id"])
-    corpus_name = str(corpus["nombre"])
-    #print("Corpus " + corpus_id + " (" + str(j+1) + " of " + corpus_count + ")")
-    docs = []
-
-    try:
-        doc_response = client.list_corpus_documents(corpus_id=corpus_id)
-        if doc_response.status_code == 200:
-            doc_data = doc_response.json().get("data", [])
-            docs_count = str(len(doc_data))
-            if len(doc_data) > 0:
-                for i, document in enumerate(doc_data):
-                    #print("Corpus " + corpus_id + " (" + str(j+1) + " of " + corpus_count + ")" + " - Document " + str(document['id']) + " (" + str(i+1) + " of " + docs_count + ")")
-                    #print( str(corpus_id) + ' - ' + str(document['id']) + ' - ' + str(document['derechos']))
-                    if document['derechos'] is False:
-                        response = client.get_corpus_text(corpus_id = str(corpus_id), documents_id = str(document['id']))
-                        text = response['data']
-                        document['archivo'] = re.sub(r'[()\s]', lambda m: '_' if m.group(0) == ' ' else '', 
-                            unicodedata.normalize('NFKD', document['archivo'])
-                            .encode('ascii', 'ignore')
-                            .decode('utf-8')
-                        )
-                        #if len(text) > 1500:
-                        #    chunks = split_text_into_chunks(text, 1500)
-                        #    for k, chunk in enumerate(chunks):
-                        #        #docs.append(Document(page_content=chunk, metadata=metadata))
-                        #        #print("Corpus " + corpus_id + " (" + str(j+1) + " of " + corpus_count + ")" + " - Document " + str(document['id']) + " (" + str(i+1) + " of " + docs_count + ")")
-                        #        docs.append(Document(page_content=chunk, metadata={"source": str(document['archivo']), "corpus_id": str(corpus_id), "corpus_name": corpus_name, "document": str(document['id']), "chunk": str(k+1)}))
-                        #else:
-                            #docs.append(Document(page_content=text, metadata=metadata))
-                        docs.append(Document(page_content=response["data"], metadata={"source": str(document['archivo']), "corpus_id": str(corpus_id), "corpus_name": corpus_name, "document": str(document['id']), "chunk": '1'}))
-            #print("Corpus " + corpus_id + " (" + str(j+1) + " of " + corpus_count + ")" + " - Document " + str(document['id']) + " (" + str(i+1) + " of " + docs_count + ")")            
+def fetch_documents():
+    """Yields every new or changed document of every corpus; unchanged ones never leave this stage."""
+    corpus_count = str(len(corpus_data))
+    for j,corpus in enumerate(corpus_data):
+        corpus_id = str(corpus["id"])
+        corpus_name = str(corpus["nombre"])
+        #print("Corpus " + corpus_id + " (" + str(j+1) + " of " + corpus_count + ")")
+        finished = journal.corpus_documents(corpus_id)
+        if finished is not None:
+            # Done before the interruption; its listing still decides which documents get removed
+            listed_documents[corpus_id] = set(finished)
+            counts["resumed"] += 1
+            continue
+        changed_count = 0
+        text_length = 0
+
+        try:
+            if args.offline:
+                doc_data = mirror.documents(corpus_id)
+            else:
+                doc_data = with_retries(lambda: list_documents(corpus_id), f"Listing of corpus {corpus_id}")
+                if mirror is not None:
+                    mirror.set_documents(corpus_id, doc_data)
+            seen = {str(document['id']) for document in doc_data if document['derechos'] is False}
+            with bookkeeping_lock:
+                open_corpora[corpus_id] = {"fetched": False, "documents": set(), "seen": seen,
+                                           "restricted": [str(d['id']) for d in doc_data if str(d['id']) not in seen]}
+            # Fetch the text of every open document of the corpus in parallel
+            fetchable = {str(document['id']): document for document in doc_data
+                         if str(document['id']) in seen and not journal.is_dead_letter(corpus_id, str(document['id']))}
+            for document_id, text in fetch_with_retries(corpus_id, fetchable):
+                document = fetchable[document_id]
+                document['archivo'] = re.sub(r'[()\s]', lambda m: '_' if m.group(0) == ' ' else '', 
+                    ascii_fold(document['archivo'])
+                )
+                metadata = {"source": str(document['archivo']), "corpus_id": str(corpus_id), "corpus_name": corpus_name, "document": str(document['id'])}
+                # Re-chunked (and embedded) again when the chunking changes, like when the text does
+                doc_hash = content_hash(text, {**metadata, "chunking": chunker.version})
+                entry = manifest.get(corpus_id, document_id)
+                if entry and entry["hash"] == doc_hash:
+                    counts["unchanged"] += 1
+                    continue
+                changed_count += 1
+                text_length += len(text)
+                with bookkeeping_lock:
+                    open_corpora[corpus_id]["documents"].add(document_id)
+                yield {"corpus_id": corpus_id, "document_id": document_id, "text": text, "metadata": metadata,
+                       "hash": doc_hash, "old_chunks": entry["chunks"] if entry else 0}
+            listed_documents[corpus_id] = seen
             corpus["documents"] = doc_data
-        else:
+            with bookkeeping_lock:
+                corpus_progress(corpus_id)
+
+        except Exception as e:
+            print(f"Failed to fetch documents for corpus {corpus_id}: {e}")
+            failed_corpora[corpus_id] = str(e)
             corpus["documents"] = []
+        if mirror is not None:
+            mirror.save()
+
+        if changed_count > 0:
+            print("Corpus id: ", str(corpus_id))
+            print("Text Document Size: ", text_length)
+            print("Number of new or changed Docs: ", str(changed_count))
+
+
+def finish_document(key):
+    # Every chunk of the document is in Qdrant: drop the points of its older version that are
+    # trailing or were replaced by a collapsed chunk
+    entry = pending.pop(key)
+    corpus_id, document_id = key
+    collapsed = {k for k, _, _ in entry["collapsed"]}
+    delete_points(corpus_id, document_id, [k for k in range(entry["old_chunks"]) if k >= entry["chunks"] or k in collapsed])
+    journal.document_done(corpus_id, document_id, entry["hash"], entry["chunks"],
+                          [[point_id(corpus_id, document_id, k), canonical, metadata]
+                           for k, canonical, metadata in entry["collapsed"]])
+    manifest.set(corpus_id, document_id, entry["hash"], entry["chunks"])
+    counts["embedded"] += 1
+    corpus_progress(corpus_id, document_id)
+
+
+def chunk_metadata(metadata, index, start, end):
+    # The chunk's position in its document: neighbours are fetched by point id and joined by offsets (hybrid.py)
+    return {**metadata, "chunk": index, "start": start, "end": end}
+
+
+def chunk_document(doc):
+    key = (doc["corpus_id"], doc["document_id"])
+    # (start, end) character offsets; the chunk text is the slice, so spans can be joined exactly
+    spans = chunker.split(doc["text"])
+    # Chunks of this version an interrupted run already upserted are neither embedded nor written again
+    done = journal.upserted_chunks(doc["corpus_id"], doc["document_id"], doc["hash"])
+    # The old version's chunks stop being collapse targets; points other documents share are handed over
+    release_chunks(doc["corpus_id"], doc["document_id"], [k for k in range(doc["old_chunks"]) if k not in done])
+    todo, collapsed = [], []
+    for k, (start, end) in enumerate(spans):
+        pid = point_id(doc["corpus_id"], doc["document_id"], k)
+        signature = duplicates.signature(doc["text"][start:end])
+        canonical = None if k in done else duplicates.find(signature)
+        if canonical is None:
+            duplicates.add(pid, signature)
+            if k not in done:
+                todo.append(k)
+        else:
+            # Near-duplicate of a stored chunk: its document is listed on that point instead
+            metadata = chunk_metadata(doc["metadata"], k, start, end)
+            duplicates.add_member(canonical, pid, metadata)
+            collapsed.append((k, canonical, metadata))
+    pending[key] = {"remaining": len(todo), "chunks": len(spans), "old_chunks": doc["old_chunks"], "hash": doc["hash"],
+                    "collapsed": collapsed}
+    if not todo:
+        with bookkeeping_lock:
+            finish_document(key)
+    for k in todo:
+        start, end = spans[k]
+        yield {"id": point_id(doc["corpus_id"], doc["document_id"], k), "key": key, "index": k, "hash": doc["hash"],
+               "text": doc["text"][start:end], "metadata": chunk_metadata(doc["metadata"], k, start, end)}
+
+
+def embed_batch(chunks):
+    vectors = embedding_model.embed_documents([chunk["text"] for chunk in chunks])
+    for chunk, vector in zip(chunks, vectors):
+        chunk["vector"] = vector
+    return chunks
+
+
+def upsert_batch(chunks):
+    # Same payload layout the langchain Qdrant vector store reads in the query services
+    points = [PointStruct(id=chunk["id"], vector=chunk["vector"],
+                          payload={"page_content": chunk["text"], "metadata": point_metadata(chunk["id"], chunk["metadata"])})
+              for chunk in chunks]
+    # A Qdrant blip costs a retry, not the run
+    with_retries(lambda: qdrant.upsert(collection_name=collection_name, points=points), "Upsert")
+    journal.batch_upserted(chunks)
+    with touched_lock:
+        touched_sources.update(chunk["metadata"]["source"] for chunk in chunks)
+    # Upsert workers run in parallel; the per-document bookkeeping and the manifest are shared
+    with bookkeeping_lock:
+        finished = False
+        for chunk in chunks:
+            entry = pending[chunk["key"]]
+            entry["remaining"] -= 1
+            if entry["remaining"] == 0:
+                finish_document(chunk["key"])
+                finished = True
+        if finished:
+            manifest.save()
+    return chunks
+
+
+# Incremental sync writes into the live collection, so queries keep being served meanwhile.
+# Bounded queues between the stages keep memory flat however large a corpus is.
+pipeline = Pipeline(
+    fetch_documents(),
+    [
+        Stage("chunk", chunk_document),
+        Stage("embed", embed_batch, batch_size=EMBED_BATCH_SIZE),
+        Stage("upsert", upsert_batch, batch_size=UPSERT_BATCH_SIZE, workers=UPSERT_PARALLELISM if VECTOR_BACKEND != "local" else 1),
+    ],
+    queue_size=QUEUE_SIZE,
+).run()
+chunker.close()
+
+for corpus_id, seen in listed_documents.items():
+    for document_id in manifest.documents(corpus_id):
+        if document_id not in seen:
+            remove_document(corpus_id, document_id)
+            counts["removed"] += 1
+
+# Corpora that are no longer listed at all
+listed = {str(corpus["id"]) for corpus in corpus_data}
+for corpus_id in manifest.corpus_ids():
+    if corpus_id not in listed:
+        for document_id in manifest.documents(corpus_id):
+            remove_document(corpus_id, document_id)
+            counts["removed"] += 1
+
+# Points written before chunks were collapsed into them, or that lost some, get their `sources` now
+refresh_sources()
+duplicates.save()
+
+if full and VECTOR_BACKEND != "local":
+    # Indexing was off during the rebuild; Qdrant builds the HNSW graph once now
+    finish_bulk_load(qdrant, collection_name)
+
+if VECTOR_BACKEND == "local":
+    # Compact away replaced/deleted rows and build the HNSW graph for large collections
+    qdrant.optimize(collection_name)
+manifest.save()
+
+# Per-source centroids for the query router in main.py and the BM25 index for the lexical leg of
+# hybrid retrieval in the query services. A resumed run does not know what the interrupted one wrote
+touched_sources.discard(None)
+artifacts_exist = os.path.exists(SECTION_ROUTER_PATH) and os.path.exists(os.path.join(LEXICAL_INDEX_PATH, "meta.json"))
+if full or resumed or not artifacts_exist:
+    section_router = SectionRouter.from_collection(qdrant, collection_name)
+    section_router.save()
+    lexical_index = LexicalIndex.from_collection(qdrant, collection_name)
+    lexical_index.save()
+elif touched_sources:
+    # Only the sources this run changed are scrolled again
+    section_router = SectionRouter.load().update(qdrant, collection_name, sorted(touched_sources))
+    section_router.save()
+    lexical_index = LexicalIndex.load().update(qdrant, collection_name, sorted(touched_sources))
+    lexical_index.save()
+else:
+    section_router = SectionRouter.load()
+    lexical_index = LexicalIndex.load()
+    print("Section router and lexical index unchanged")
+print("Section router: ", len(section_router.sources), "sources")
+print("Lexical index: ", len(lexical_index), "chunks,", len(lexical_index.terms), "terms")
+
+if full or resumed or counts["embedded"] or counts["removed"] or not os.path.exists(INGEST_EPOCH_PATH):
+    # The services stop serving answers cached from the collection as it was before this run
+    write_epoch(embedded=counts["embedded"], removed=counts["removed"])
+
+if mirror is not None:
+    if not args.offline:
+        # Texts of documents and corpora that are no longer listed
+        mirror.prune()
+    mirror.save()
+    print("GECO mirror: ", mirror.stats())
+
+print(pipeline.report())
+print("Embedding cache: ", embedding_model.stats())
+print("Near-duplicates: ", duplicates.stats())
+print(f"Sync done: {counts['embedded']} documents embedded, {counts['unchanged']} unchanged, {counts['removed']} removed"
+      + (f", {counts['resumed']} corpora finished before the interruption" if resumed else ""))
+
+# What this run (and the interrupted one it resumed) skipped
+report = {"full": full, "resumed": resumed, "finished": int(time.time()), "counts": counts, **journal.summary(),
+          "failed_corpora": failed_corpora}
+with open(REPORT_PATH, "w", encoding="utf-8") as f:
+    json.dump(report, f, ensure_ascii=False, indent=2)
+print(f"Skipped: {len(report['dead_letters'])} dead-lettered documents, {len(failed_corpora)} corpora whose listing failed, "
+      f"{len(report['restricted_documents'])} restricted documents (see {REPORT_PATH})")
+# Everything is in the collection, the manifest and the artifacts: the next run starts afresh
+journal.complete()
 
-    except Exception as e:
-        print(f"Failed to fetch documents for corpus {corpus_id}: {e}")
-        corpus["documents"] = []
-
-    text_length = len(response["data"])
-    if len(docs) > 0:
-        print("Corpus id: ", str(corpus_id))
-        print("Text Document Size: ", text_length)
-        print("Number of Docs: ", str(len(docs)))
-        # print(docs[0])
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-        split_docs = splitter.split_documents(docs)
-        # Create vector store
-        print("embedding")    
-        vector_store = Qdrant.from_documents(
-            documents=split_docs,
-            embedding=embedding_model,
-            location="http://" + host + ":6333",
-            collection_name=collection_name,
-        )
-        #vector_store = InMemoryVectorStore(llm)
-        _ = vector_store.add_documents(split_docs)
-        #print("Document added: ", corpus_id)
-#        print("Example: ", docs[0])
+# Stage throughput, embedding latency and cache hits for Prometheus (METRICS_TEXTFILE)
+for outcome in ("embedded", "unchanged", "removed"):
+    metrics.INGEST_DOCUMENTS.labels(outcome=outcome).set(counts[outcome])
+metrics.write_textfile()
 
 # Now `corpus_data` has each corpus with its documents attached
 
@@ -0,0 +1,534 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import hnswlib
+except ImportError:  # optional: large collections fall back to exact search
+    hnswlib = None
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant")
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "./vector_store")
+LOCAL_STORE_DTYPE = os.getenv("LOCAL_STORE_DTYPE", "int8")
+HNSW_MIN_POINTS = int(os.getenv("HNSW_MIN_POINTS", "200000"))
+HNSW_EF = int(os.getenv("HNSW_EF", "128"))
+
+# Payload fields kept as integer-coded columns for equality filters
+FILTER_FIELDS = ("source", "corpus_id")
+COLUMNS = {"ids": (np.uint8, 16), "alive": (np.uint8, None), "payload_index": (np.int64, 2),
+           "source": (np.int32, None), "corpus_id": (np.int32, None)}
+BLOCK_ROWS = 8192
+
+Point = namedtuple("Point", "id payload vector score")
+QueryResponse = namedtuple("QueryResponse", "points")
+CountResult = namedtuple("CountResult", "count")
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def _filter_dict(query_filter):
+    # Qdrant Filter(must=[FieldCondition(key, match=MatchValue(value))]) -> {key: value}
+    if query_filter is None or isinstance(query_filter, dict):
+        return query_filter
+    return {condition.key: condition.match.value for condition in query_filter.must or []}
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class LocalCollection:
+    """
+    One append-only collection directory:
+
+        vectors.bin        N x dim normalized vectors (float16 / float32, or int8 codes + scales.f32)
+        ids.bin            N x 16 point id bytes
+        alive.bin          1 per live row; upserts of an existing id and deletes clear the old row
+        source.bin, corpus_id.bin
+                           int32 codes of the filter columns (names in meta.json)
+        payload.jsonl, payload_index.bin
+                           JSON payloads and their (offset, length)
+        meta.json          dim, dtype, committed row count, column dictionaries
+
+    Only the rows counted in meta.json are visible, so readers never see a half-written
+    batch. A single writer (load.py) appends; readers memory-map the files and pick up
+    new rows when meta.json changes.
+    """
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self._lock = threading.RLock()
+        self._files = {}
+        self.hnsw = None
+        self._open()
+
+    @classmethod
+    def create(cls, path, dim, dtype=LOCAL_STORE_DTYPE):
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        os.makedirs(path)
+        for name in ("vectors", "scales", *COLUMNS):
+            open(os.path.join(path, name + ".bin"), "wb").close()
+        open(os.path.join(path, "payload.jsonl"), "wb").close()
+        _write_json(os.path.join(path, "meta.json"), {
+            "dim": dim, "dtype": dtype, "count": 0, "payload_bytes": 0, "hnsw_count": 0,
+            "codes": {field: [] for field in FILTER_FIELDS},
+        })
+
+    def _open(self):
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path, encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._mtime = os.path.getmtime(meta_path)
+        self.dim = self.meta["dim"]
+        self.dtype = self.meta["dtype"]
+        self.count = self.meta["count"]
+        self.code_names = {field: list(names) for field, names in self.meta["codes"].items()}
+        self.codes = {field: {name: i for i, name in enumerate(names)} for field, names in self.code_names.items()}
+
+        n = self.count
+        storage = np.int8 if self.dtype == "int8" else np.dtype(self.dtype)
+        # name -> (dtype, width) of every row-aligned file
+        self._layout = {"vectors": (storage, self.dim), **COLUMNS}
+        if self.dtype == "int8":
+            self._layout["scales"] = (np.float32, None)
+        self.scales = None
+        self._map_rows()
+        self.payload_fd = os.open(os.path.join(self.path, "payload.jsonl"), os.O_RDONLY)
+        self._id_order = None
+
+        self.hnsw = None
+        hnsw_path = os.path.join(self.path, "hnsw.bin")
+        if hnswlib is not None and self.meta.get("hnsw_count") and os.path.exists(hnsw_path):
+            self.hnsw = hnswlib.Index(space="ip", dim=self.dim)
+            self.hnsw.load_index(hnsw_path, max_elements=self.meta["hnsw_count"])
+            self.hnsw.set_ef(HNSW_EF)
+
+        if self.writable:
+            self.rows = {bytes(self.ids[i]): i for i in np.flatnonzero(self.alive)}
+            self._files = {name: open(os.path.join(self.path, name + ".bin"), "r+b")
+                           for name in ("vectors", "scales", *COLUMNS)}
+            self._files["payload"] = open(os.path.join(self.path, "payload.jsonl"), "r+b")
+            # Drop whatever an interrupted writer appended after the last commit
+            sizes = {name: 0 for name in self._files}
+            sizes["payload"] = self.meta["payload_bytes"]
+            for name, (dtype, width) in self._layout.items():
+                sizes[name] = n * (width or 1) * np.dtype(dtype).itemsize
+            for name, f in self._files.items():
+                f.truncate(sizes[name])
+                f.seek(0, os.SEEK_END)
+
+    def _map_rows(self):
+        for name, (dtype, width) in self._layout.items():
+            setattr(self, name, self._map(name, dtype, self.count, width))
+
+    def _map(self, name, dtype, n, width):
+        shape = (n, width) if width else (n,)
+        if n == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name + ".bin"), dtype=dtype, mode="r", shape=shape)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        os.close(self.payload_fd)
+
+    def refresh(self):
+        """Re-maps the files if a writer committed since they were opened."""
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, "meta.json"))
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                old_fd = self.payload_fd
+                self._open()
+                os.close(old_fd)
+
+    # ==== Writes ====
+    def upsert(self, points):
+        ids, vectors, payloads = [], [], []
+        for point in points:
+            ids.append(uuid.UUID(str(point.id)).bytes)
+            vectors.append(_normalize(point.vector))
+            payloads.append(point.payload or {})
+        if not ids:
+            return
+        vectors = np.stack(vectors)
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            self._files["vectors"].write(np.round(vectors / scales[:, None]).astype(np.int8).tobytes())
+            self._files["scales"].write(scales.astype(np.float32).tobytes())
+        else:
+            self._files["vectors"].write(vectors.astype(self.dtype).tobytes())
+
+        offset = self.meta["payload_bytes"]
+        index = []
+        for payload in payloads:
+            line = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+            self._files["payload"].write(line)
+            index.append((offset, len(line)))
+            offset += len(line)
+        self.meta["payload_bytes"] = offset
+        self._files["payload_index"].write(np.array(index, dtype=np.int64).tobytes())
+
+        metadata = [payload.get("metadata") or {} for payload in payloads]
+        for field in FILTER_FIELDS:
+            codes = [self._code(field, m.get(field)) for m in metadata]
+            self._files[field].write(np.array(codes, dtype=np.int32).tobytes())
+        self._files["ids"].write(b"".join(ids))
+        self._files["alive"].write(b"\1" * len(ids))
+
+        stale = []
+        for k, pid in enumerate(ids):
+            if pid in self.rows:
+                stale.append(self.rows[pid])
+            self.rows[pid] = self.meta["count"] + k
+        self.meta["count"] += len(ids)
+        self._kill(stale)
+        self._commit()
+
+    def delete(self, ids):
+        rows = []
+        for pid in ids:
+            row = self.rows.pop(uuid.UUID(str(pid)).bytes, None)
+            if row is not None:
+                rows.append(row)
+        if rows:
+            self._kill(rows)
+            self._commit(appended=False)
+
+    def _code(self, field, value):
+        if value is None:
+            return -1
+        value = str(value)
+        code = self.codes[field].get(value)
+        if code is None:
+            code = self.codes[field][value] = len(self.code_names[field])
+            self.code_names[field].append(value)
+        return code
+
+    def _kill(self, rows):
+        f = self._files["alive"]
+        for row in rows:
+            f.seek(row)
+            f.write(b"\0")
+        f.seek(0, os.SEEK_END)
+
+    def _commit(self, appended=True):
+        for f in self._files.values():
+            f.flush()
+        self.meta["codes"] = self.code_names
+        meta_path = os.path.join(self.path, "meta.json")
+        _write_json(meta_path, self.meta)
+        # The writer's meta, codes, row map, payload fd and HNSW graph are current already; only the
+        # files rows were appended to are mapped again. Deletes flip alive.bin in place, which the
+        # shared map sees without remapping
+        with self._lock:
+            self._mtime = os.path.getmtime(meta_path)
+            self.count = self.meta["count"]
+            if appended:
+                self._map_rows()
+
+    def dead_rows(self):
+        return self.count - int(np.count_nonzero(self.alive))
+
+    # ==== Reads ====
+    def payload(self, row):
+        offset, length = self.payload_index[row]
+        return json.loads(os.pread(self.payload_fd, int(length), int(offset)))
+
+    def vector(self, row):
+        vector = np.asarray(self.vectors[row], dtype=np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+    def point(self, row, with_payload=True, with_vectors=False, score=None):
+        return Point(
+            id=str(uuid.UUID(bytes=bytes(self.ids[row]))),
+            payload=self.payload(row) if with_payload else None,
+            vector=self.vector(row).tolist() if with_vectors else None,
+            score=score,
+        )
+
+    def row_of(self, pid):
+        pid = uuid.UUID(str(pid)).bytes
+        if self.writable:
+            return self.rows.get(pid)
+        # Readers do not keep an id map: binary search on the first 8 id bytes, sorted on first use
+        if self._id_order is None:
+            high = self.ids[:, :8].copy().view(">u8").ravel()
+            order = np.argsort(high, kind="stable")
+            self._id_order = (high[order], order)
+        high, order = self._id_order
+        key = np.frombuffer(pid[:8], dtype=">u8")[0]
+        for row in order[np.searchsorted(high, key, "left"):np.searchsorted(high, key, "right")][::-1]:
+            if self.alive[row] and bytes(self.ids[row]) == pid:
+                return int(row)
+        return None
+
+    def mask(self, filter):
+        """Live rows matching an equality filter on the coded columns, e.g. {"source": "x.txt"}."""
+        mask = self.alive == 1
+        for field, value in (filter or {}).items():
+            field = field.removeprefix("metadata.")
+            if field not in self.codes:
+                raise ValueError(f"Local store can only filter on {', '.join(FILTER_FIELDS)}, not {field!r}")
+            code = self.codes[field].get(str(value))
+            if code is None:
+                return np.zeros(self.count, dtype=bool)
+            mask &= getattr(self, field) == code
+        return mask
+
+    def _scores(self, query, rows=None):
+        """Dot products with the query for `rows` (or every row), decoded block by block."""
+        total = self.count if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, BLOCK_ROWS):
+            block = slice(start, min(start + BLOCK_ROWS, total))
+            index = block if rows is None else rows[block]
+            scores[block] = np.asarray(self.vectors[index], dtype=np.float32) @ query
+            if self.scales is not None:
+                scores[block] *= self.scales[index]
+        return scores
+
+    def search(self, query_vector, k=5, filter=None, exact=False):
+        """Returns [(row, score)] of the k most similar live rows (cosine)."""
+        with self._lock:
+            if self.count == 0:
+                return []
+            query = _normalize(query_vector)
+            if not filter and self.hnsw is not None and not exact:
+                return self._search_hnsw(query, k)
+            if filter:
+                rows = np.flatnonzero(self.mask(filter))
+                scores = self._scores(query, rows)
+            else:
+                rows = None
+                scores = self._scores(query)
+                scores[self.alive == 0] = -np.inf
+            k = min(k, len(scores))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(rows[i] if rows is not None else i), float(scores[i])) for i in top if scores[i] > -np.inf]
+
+    def _search_hnsw(self, query, k):
+        covered = self.meta["hnsw_count"]
+        dead = covered - int(np.count_nonzero(self.alive[:covered]))
+        labels, distances = self.hnsw.knn_query(query, k=min(covered, k + min(dead, 4 * k)))
+        results = [(int(row), 1.0 - float(d)) for row, d in zip(labels[0], distances[0]) if self.alive[row]]
+        if self.count > covered:
+            # Rows appended since the graph was built are scanned exactly
+            tail = np.arange(covered, self.count)
+            tail = tail[self.alive[covered:] == 1]
+            results += zip(tail.tolist(), self._scores(query, tail).tolist())
+        return sorted(results, key=lambda r: -r[1])[:k]
+
+    def build_hnsw(self, m=16, ef_construction=200):
+        rows = np.arange(self.count)
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=self.count, M=m, ef_construction=ef_construction)
+        for start in range(0, self.count, BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            vectors = self.vectors[block].astype(np.float32)
+            if self.scales is not None:
+                vectors *= self.scales[block][:, None]
+            index.add_items(vectors, block)
+        index.save_index(os.path.join(self.path, "hnsw.bin"))
+        index.set_ef(HNSW_EF)
+        self.meta["hnsw_count"] = self.count
+        self.hnsw = index
+        self._commit(appended=False)
+
+
+class LocalStore:
+    """
+    In-process vector engine with the subset of the QdrantClient API this repo uses
+    (collections, upsert, delete, scroll, retrieve, search), so load.py, the section
+    router, the lexical index and the services run against it unchanged.
+
+    Each collection is a directory under `path` (see LocalCollection). Payload filters
+    are equality matches on `source` and `corpus_id`.
+    """
+    def __init__(self, path=LOCAL_STORE_PATH, dtype=LOCAL_STORE_DTYPE, check_every=5.0):
+        self.path = path
+        self.dtype = dtype
+        self.check_every = check_every
+        self._collections = {}
+        self._checked = {}
+
+    def _dir(self, collection_name):
+        return os.path.join(self.path, collection_name)
+
+    def _collection(self, collection_name, writable=False):
+        collection = self._collections.get(collection_name)
+        if collection is None or (writable and not collection.writable):
+            if collection is not None:
+                collection.close()
+            collection = self._collections[collection_name] = LocalCollection(self._dir(collection_name), writable)
+            self._checked[collection_name] = time.monotonic()
+        elif not collection.writable and time.monotonic() - self._checked[collection_name] >= self.check_every:
+            self._checked[collection_name] = time.monotonic()
+            collection.refresh()
+        return collection
+
+    def collection_exists(self, collection_name):
+        return os.path.exists(os.path.join(self._dir(collection_name), "meta.json"))
+
+    def create_collection(self, collection_name, vectors_config, **kwargs):
+        LocalCollection.create(self._dir(collection_name), vectors_config.size, self.dtype)
+
+    def delete_collection(self, collection_name):
+        collection = self._collections.pop(collection_name, None)
+        if collection is not None:
+            collection.close()
+        shutil.rmtree(self._dir(collection_name), ignore_errors=True)
+
+    def upsert(self, collection_name, points, **kwargs):
+        collection = self._collection(collection_name, writable=True)
+        # load.py writes from its chunk and upsert stages at the same time
+        with collection._lock:
+            collection.upsert(points)
+
+    def delete(self, collection_name, points_selector, **kwargs):
+        collection = self._collection(collection_name, writable=True)
+        with collection._lock:
+            collection.delete(points_selector.points)
+
+    def count(self, collection_name):
+        collection = self._collection(collection_name)
+        return CountResult(count=collection.count - collection.dead_rows())
+
+    def scroll(self, collection_name, limit=10, offset=None, with_payload=True, with_vectors=False, scroll_filter=None, **kwargs):
+        collection = self._collection(collection_name)
+        with collection._lock:
+            start, rows = offset or 0, []
+            if scroll_filter is not None:
+                matching = np.flatnonzero(collection.mask(_filter_dict(scroll_filter)))
+                rows = matching[np.searchsorted(matching, start):][:limit + 1].tolist()
+            while scroll_filter is None and len(rows) <= limit and start < collection.count:
+                window = collection.alive[start:start + 4 * limit + 1]
+                rows.extend((np.flatnonzero(window == 1) + start).tolist())
+                start += len(window)
+            points = [collection.point(row, bool(with_payload), with_vectors) for row in rows[:limit]]
+            return points, (rows[limit] if len(rows) > limit else None)
+
+    def retrieve(self, collection_name, ids, with_payload=True, with_vectors=False, **kwargs):
+        collection = self._collection(collection_name)
+        with collection._lock:
+            rows = [collection.row_of(pid) for pid in ids]
+            return [collection.point(row, bool(with_payload), with_vectors) for row in rows if row is not None]
+
+    def search(self, collection_name, query_vector, query_filter=None, limit=10, with_payload=True, exact=False, **kwargs):
+        collection = self._collection(collection_name)
+        with collection._lock:
+            return [collection.point(row, bool(with_payload), score=score)
+                    for row, score in collection.search(query_vector, limit, _filter_dict(query_filter), exact=exact)]
+
+    def query_batch_points(self, collection_name, requests, **kwargs):
+        return [QueryResponse(points=self.search(collection_name, request.query, request.filter, request.limit,
+                                                 with_payload=request.with_payload))
+                for request in requests]
+
+    def compact(self, collection_name):
+        """Rewrites the collection without dead rows and swaps it in."""
+        collection = self._collection(collection_name)
+        tmp = self._dir(collection_name) + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        LocalCollection.create(tmp, collection.dim, collection.dtype)
+        fresh = LocalCollection(tmp, writable=True)
+        live = np.flatnonzero(collection.alive == 1)
+        for start in range(0, len(live), 4096):
+            fresh.upsert([collection.point(int(row), with_vectors=True) for row in live[start:start + 4096]])
+        fresh.close()
+        collection.close()
+        self._collections.pop(collection_name, None)
+        old = self._dir(collection_name) + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(self._dir(collection_name), old)
+        os.rename(tmp, self._dir(collection_name))
+        shutil.rmtree(old, ignore_errors=True)
+
+    def optimize(self, collection_name, max_dead_fraction=0.25):
+        """End-of-load housekeeping: compact when many rows are dead, (re)build HNSW for large collections."""
+        collection = self._collection(collection_name)
+        if collection.count and collection.dead_rows() / collection.count > max_dead_fraction:
+            self.compact(collection_name)
+            collection = self._collection(collection_name, writable=True)
+        live = collection.count - collection.dead_rows()
+        if hnswlib is not None and live >= HNSW_MIN_POINTS and collection.meta["hnsw_count"] < collection.count:
+            self._collection(collection_name, writable=True).build_hnsw()
+
+    def close(self):
+        for collection in self._collections.values():
+            collection.close()
+        self._collections = {}
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain vector store over a LocalStore collection, returning the same Documents as the Qdrant store."""
+    def __init__(self, client, collection_name, embeddings):
+        self.client = client
+        self.collection_name = collection_name
+        self._embeddings = embeddings
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [
+            (Document(page_content=point.payload.get("page_content", ""),
+                      metadata={**(point.payload.get("metadata") or {}), "_id": point.id,
+                                "_collection_name": self.collection_name}),
+             point.score)
+            for point in self.client.search(self.collection_name, embedding, query_filter=filter, limit=k)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        from qdrant_client.models import PointStruct
+
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = self._embeddings.embed_documents(texts)
+        self.client.upsert(self.collection_name, [
+            PointStruct(id=pid, vector=vector, payload={"page_content": text, "metadata": metadata})
+            for pid, vector, text, metadata in zip(ids, vectors, texts, metadatas or [{}] * len(texts))
+        ])
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, collection_name="corpus_gecko3", path=LOCAL_STORE_PATH, **kwargs):
+        from qdrant_client.models import VectorParams, Distance
+
+        client = LocalStore(path)
+        if not client.collection_exists(collection_name):
+            client.create_collection(collection_name, VectorParams(size=len(embedding.embed_query("")), distance=Distance.COSINE))
+        store = cls(client, collection_name, embedding)
+        store.add_texts(texts, metadatas)
+        return store
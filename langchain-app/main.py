@@ -1,4 +1,8 @@
-from fastapi import FastAPI, Request
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from langchain_core.documents import Document
 #from fastapi.middleware.cors import CORSMiddleware
@@ -8,86 +12,382 @@ from starlette.middleware.cors import CORSMiddleware
 # Your RAG logic imports here
 # ✅ Use new langchain-ollama
 #from langchain_ollama import OllamaLLM
-from langchain_ollama import ChatOllama
 from langchain_community.llms import Ollama
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_qdrant import Qdrant
-from langchain import hub
 from langgraph.graph import START, StateGraph
-from typing_extensions import TypedDict, Annotated, Literal, List
+from embedding_cache import CachedEmbeddings, normalize_text
+from embedding_backend import embedding_model_id, make_embeddings, preload_embeddings
+from concurrency import MAX_INFLIGHT_LLM, PipelineRunner, Overloaded
+from streaming import stream_answer, SSE_HEADERS
+from section_router import SectionRouter, SECTION_ROUTER_PATH
+from lexical_index import LexicalIndexFile
+from local_store import LocalStore, LocalVectorStore, VECTOR_BACKEND
+from hybrid import batch_hybrid_search, fetch_k, hybrid_search
+from collection_profile import search_params
+from context_packing import pack_context
+from pipelines import Pipeline, PipelineRegistry, RefinePipeline, StuffPipeline
+import metrics
+from prompts import RAG_PROMPT, RAG_PROMPT_VERSION
+from startup import WARMUP_OLLAMA, Readiness
+from ollama_pool import OllamaPool
+from typing_extensions import TypedDict, Annotated, Literal, List, Optional
 
+import asyncio
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://ollama:11434")
 QDRANT_HOST = os.getenv("QDRANT_HOST", "http://qdrant:6333")
+# "embedding": centroid router (no LLM call); "llm": structured-output llama3 call
+QUERY_ROUTER = os.getenv("QUERY_ROUTER", "embedding")
+# Default mode of the graph pipeline: "full", the retrieved chunks as they are (what it has always sent);
+# "stuff" (opt-in, per request or here): question-relevant sentences packed into CONTEXT_TOKEN_BUDGET
+ANSWER_MODE = os.getenv("ANSWER_MODE", "full")
+# /ask/batch: questions per request and llama3 calls a batch may have in flight
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "256"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "2"))
+EMBEDDING_MODEL_PATH = "/app/local_models/all-MiniLM-L6-v2"
 
 
 
 # ==== Setup ====
+# Models, the Qdrant connection and the ingestion artifacts are loaded by the lifespan hook
+# (see `startup`), so importing this module stays fast and needs no network. They are loaded
+# once per process and shared by every registered pipeline (graph, refine, stuff).
 
-embedding_model = HuggingFaceEmbeddings(model_name="/app/local_models/all-MiniLM-L6-v2")
-
-vector_store = Qdrant.from_existing_collection(
-    collection_name="corpus_gecko3",
-    url=QDRANT_HOST,
-    embedding=embedding_model,
-    timeout=600.0
-)
+embedding_model = None
+vector_store = None
+# hnsw_ef and quantization rescoring matching the collection profile load.py applies
+SEARCH_PARAMS = search_params() if VECTOR_BACKEND != "local" else None
+section_router = None
+# BM25 index written by load.py; retrieval stays dense-only until it exists
+lexical_index = LexicalIndexFile()
 
 #llm = ChatOllama(model="llama3")
 
 #llm = Ollama(model="llama3", base_url=OLLAMA_HOST)
-llm = ChatOllama(model="llama3", base_url=OLLAMA_HOST)
+# Every llama3 call (graph, stream, batch) goes to the least busy node of OLLAMA_HOSTS
+# and reports its latency and token counts
+llm = OllamaPool(model="llama3", callbacks=[metrics.CALLBACK])
 #llm = OllamaLLM(model="llama3", base_url=OLLAMA_HOST)
-prompt = hub.pull("rlm/rag-prompt")
+# Bundled copy of rlm/rag-prompt (no hub.pull at startup)
+prompt = RAG_PROMPT
+# Named pipelines selectable per request (`pipeline`) or per route (/pipelines/{name}/ask);
+# filled by the register_pipelines startup step
+pipelines = PipelineRegistry()
+graph_pipeline = None
+
+def preload_models():
+    # serve.py calls this before forking its workers, which then share the weights copy-on-write
+    preload_embeddings(EMBEDDING_MODEL_PATH)
+
+def load_models():
+    global embedding_model, vector_store
+    embedding_model = CachedEmbeddings(
+        make_embeddings(EMBEDDING_MODEL_PATH),
+        model_id=embedding_model_id(),
+    )
+    if VECTOR_BACKEND == "local":
+        # In-process engine over the files written by load.py (no Qdrant server needed)
+        vector_store = LocalVectorStore(LocalStore(), "corpus_gecko3", embedding_model)
+    else:
+        vector_store = Qdrant.from_existing_collection(
+            collection_name="corpus_gecko3",
+            url=QDRANT_HOST,
+            embedding=embedding_model,
+            timeout=600.0
+        )
+
+def load_artifacts():
+    global section_router
+    # Sections come from the `source` payloads of the collection; the centroids are written by load.py
+    if os.path.exists(SECTION_ROUTER_PATH):
+        section_router = SectionRouter.load()
+    else:
+        section_router = SectionRouter.from_collection(vector_store.client, "corpus_gecko3")
+    lexical_index.get()
+
+def warm_up_embeddings():
+    # One forward pass outside the cache, so the first question does not pay for lazy initialization
+    embedding_model.embeddings.embed_query("warm-up")
 
 class Search(TypedDict):
     query: Annotated[str, ..., "Search query to run."]
-    section: Annotated[
-        Literal["aprendiendo_sobre_el_metodo_de_los_elementos_finitos.txt", "mtds.txt", "ame1co.txt", "ame1cr.txt", "ame1jn.txt"],
-        ..., "Section to query."
-    ]
+    section: Annotated[Optional[str], ..., "Section to query, None to search every section."]
+
+def llm_search_schema(sections):
+    class LLMSearch(TypedDict):
+        query: Annotated[str, ..., "Search query to run."]
+        section: Annotated[Literal[tuple(sections)], ..., "Section to query."]
+    return LLMSearch
 
 class State(TypedDict):
     question: str
+    mode: str
+    # False skips the answer cache lookup; the fresh answer is still stored
+    cache: bool
     query: Search
     context: List[Document]
     answer: str
+    cached: bool
+
+def route_question(question, vector):
+    """The centroid router's section for a question (None = search every section)."""
+    section, score, margin = section_router.route(vector)
+    # Scores near ROUTER_MIN_SCORE / ROUTER_MIN_MARGIN are the ones worth looking at when tuning them
+    logger.debug("Routed to %s (score %.3f, margin %.3f): %s", section, score, margin, question)
+    return section
 
 def analyze_query(state: State):
-    structured_llm = llm.with_structured_output(Search)
-    query = structured_llm.invoke(state["question"])
-    return {"query": query}
+    if QUERY_ROUTER == "llm" and section_router.sources:
+        structured_llm = llm.with_structured_output(llm_search_schema(section_router.sources))
+        query = structured_llm.invoke(state["question"])
+        return {"query": query}
+    # The query vector lands in the embedding LRU, so retrieve() does not embed it again
+    section = route_question(state["question"], embedding_model.embed_query(state["question"]))
+    return {"query": {"query": state["question"], "section": section}}
 
 def retrieve(state: State):
     query = state["query"]
-    retrieved_docs = vector_store.similarity_search(
-        query["query"], k=5,
-        filter={"source": query["section"]}
-    )
+    vector = embedding_model.embed_query(query["query"])
+    with metrics.timed(metrics.SEARCH_SECONDS, "vector_search", kind="dense"):
+        retrieved_docs = vector_store.similarity_search_by_vector(
+            vector, k=fetch_k(5),
+            filter={"source": query["section"]} if query["section"] else None,
+            search_params=SEARCH_PARAMS,
+        )
+    retrieved_docs = hybrid_search(retrieved_docs, lexical_index.get(), vector_store.client, "corpus_gecko3",
+                                   query["query"], k=5, source=query["section"])
     return {"context": retrieved_docs}
 
+def build_context(question, docs, mode):
+    if mode == "full":
+        return "\n\n".join(doc.page_content for doc in docs)
+    # Same query vector analyze_query computed (memory hit in the embedding LRU)
+    with metrics.stage("pack_context"):
+        context, _ = pack_context(docs, embedding_model.embed_query(question), embedding_model)
+    return context
+
 def generate(state: State):
-    docs_content = "\n\n".join(doc.page_content for doc in state["context"])
-    messages = prompt.invoke({"question": state["question"], "context": docs_content})
-    response = llm.invoke(messages)
-    return {"answer": response.content}
+    # Looks the answer up in the graph pipeline's answer cache before calling llama3
+    answer, cached = graph_pipeline.answer(state["question"], state["context"], state.get("mode") or ANSWER_MODE,
+                                           state.get("cache", True))
+    return {"answer": answer, "cached": cached}
+
+def retrieve_batch(questions):
+    """analyze_query + retrieve for many questions: one embedding batch and one batched search."""
+    vectors = embedding_model.embed_queries(questions)
+    if QUERY_ROUTER == "llm" and section_router.sources:
+        queries = [analyze_query({"question": q})["query"] for q in questions]
+    else:
+        queries = [{"query": q, "section": route_question(q, v)} for q, v in zip(questions, vectors)]
+    # LLM routing may rewrite the query; those few are embedded again (LRU hits otherwise)
+    rewritten = [i for i, (q, query) in enumerate(zip(questions, queries)) if query["query"] != q]
+    for i, vector in zip(rewritten, embedding_model.embed_queries([queries[i]["query"] for i in rewritten])):
+        vectors[i] = vector
+    return batch_hybrid_search(vector_store.client, "corpus_gecko3", [query["query"] for query in queries], vectors,
+                               [query["section"] for query in queries], lexical_index.get(), k=5,
+                               search_params=SEARCH_PARAMS)
 
 graph_builder = StateGraph(State).add_sequence([analyze_query, retrieve, generate])
 graph_builder.add_edge(START, "analyze_query")
 graph = graph_builder.compile()
 
-app = FastAPI()
+class GraphPipeline(Pipeline):
+    """The LangGraph route -> retrieve -> generate graph answered with the RAG prompt."""
+    name = "graph"
+    # "full": the chunks as they are; "stuff": question-relevant sentences packed into CONTEXT_TOKEN_BUDGET
+    modes = ("full", "stuff")
+    prompt_version = RAG_PROMPT_VERSION
+
+    def retrieve(self, question):
+        # The nodes run outside the graph here, so they are timed explicitly
+        state = {"question": question}
+        with metrics.stage("analyze_query"):
+            state.update(analyze_query(state))
+        with metrics.stage("retrieve"):
+            return retrieve(state)["context"]
+
+    def retrieve_batch(self, questions):
+        return retrieve_batch(questions)
+
+    def final_prompt(self, question, docs, mode):
+        return prompt.invoke({"question": question, "context": build_context(question, docs, mode)})
+
+    def generate(self, question, docs, mode):
+        return llm.invoke(self.final_prompt(question, docs, mode)).content
+
+    def run(self, question, mode, cache=True):
+        with metrics.request_timings() as timings:
+            steps = graph.invoke({"question": question, "mode": mode, "cache": cache}, config={"callbacks": [metrics.CALLBACK]})
+        return {**steps, "timings": timings}
+
+def register_pipelines():
+    global graph_pipeline
+    # Same embedding model, store client, BM25 index and LLM pool for all of them
+    graph_pipeline = pipelines.register(GraphPipeline(embedding_model, llm, ANSWER_MODE))
+    for pipeline in (RefinePipeline, StuffPipeline):
+        pipelines.register(pipeline(embedding_model, llm, vector_store, lexical_index, "corpus_gecko3", k=5,
+                                    search_params=SEARCH_PARAMS))
+
+# Runs the pipelines on a bounded pool so a slow llama3 call never blocks the event loop;
+# MAX_INFLIGHT_LLM slots per Ollama node, shared by all pipelines
+runner = PipelineRunner(max_inflight=MAX_INFLIGHT_LLM * len(llm.nodes))
+metrics.track_runner(runner)
+
+readiness = Readiness(IMPORT_STARTED)
+startup_steps = [
+    ("load_models", load_models, True),
+    ("load_artifacts", load_artifacts, True),
+    ("register_pipelines", register_pipelines, True),
+    ("warm_up_embeddings", warm_up_embeddings, True),
+]
+if WARMUP_OLLAMA:
+    # Optional: readiness does not wait for Ollama, which may still be pulling llama3
+    startup_steps.append(("warm_up_ollama", llm.warm_up, False))
+
+app = FastAPI(lifespan=readiness.lifespan(startup_steps))
 class Question(BaseModel):
     question: str
 
 class QuestionRequest(BaseModel):
     question: str
+    # Registered pipeline (GET /pipelines): "graph", "refine" or "stuff"; DEFAULT_PIPELINE when omitted
+    pipeline: Optional[str] = None
+    # One of the pipeline's modes ("stuff" or "full" for graph); its default when omitted
+    mode: Optional[str] = None
+    # Include the seconds spent per graph node / step in the response
+    timings: bool = False
+    # False generates a fresh answer instead of serving a cached one (the new answer replaces it)
+    cache: bool = True
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    pipeline: Optional[str] = None
+    mode: Optional[str] = None
+    cache: bool = True
+
+def select_pipeline(name, mode):
+    try:
+        return pipelines.select(name, mode)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"error": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
 
 @app.post("/ask")
 async def ask_question(request: QuestionRequest):
-    steps = graph.invoke({"question": request.question})
-    return {"answer": steps["answer"]}
+    readiness.check()
+    pipeline, mode = select_pipeline(request.pipeline, request.mode)
+    # Identical questions already in flight share one pipeline run
+    steps = await runner.run((pipeline.name, mode, request.cache, normalize_text(request.question)), pipeline.run,
+                             request.question, mode, request.cache)
+    response = {"answer": steps["answer"], "cached": steps["cached"], "pipeline": pipeline.name}
+    if request.timings:
+        response["timings"] = steps["timings"]
+    return response
+
+@app.post("/ask/stream")
+async def ask_stream(request: QuestionRequest, http_request: Request):
+    readiness.check()
+    pipeline, mode = select_pipeline(request.pipeline, request.mode)
+    question = request.question
+    return StreamingResponse(
+        stream_answer(http_request, runner, llm, lambda: pipeline.retrieve(question),
+                      lambda docs: pipeline.final_prompt(question, docs, mode),
+                      lambda docs: pipeline.cached(question, docs, mode, request.cache),
+                      lambda docs, answer, seconds: pipeline.remember(question, docs, mode, answer, seconds),
+                      admission=runner.admit()),
+        media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/ask/batch")
+async def ask_batch(request: BatchRequest):
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="questions is empty")
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+    readiness.check()
+    pipeline, mode = select_pipeline(request.pipeline, request.mode)
+    # The batch holds one place in the runner's queue until its last answer
+    with runner.admit():
+        start = time.perf_counter()
+        contexts = await asyncio.to_thread(pipeline.retrieve_batch, request.questions)
+        retrieved = time.perf_counter()
+
+        def generate_one(item):
+            question, docs = item
+            with metrics.stage("generate"):
+                return pipeline.answer(question, docs, mode, request.cache)[0]
+
+        answers = await runner.run_many(generate_one, list(zip(request.questions, contexts)), BATCH_PARALLELISM)
+    seconds = time.perf_counter() - start
+    results = [{"question": q, "error": str(a)} if isinstance(a, Exception) else {"question": q, "answer": a}
+               for q, a in zip(request.questions, answers)]
+    return {
+        "results": results,
+        "questions": len(results),
+        "pipeline": pipeline.name,
+        "seconds": round(seconds, 3),
+        "questions_per_minute": round(len(results) * 60 / seconds, 2),
+        "timings": {"retrieve": round(retrieved - start, 3), "generate": round(seconds - (retrieved - start), 3)},
+    }
+
+# The same endpoints with the pipeline in the route; it takes precedence over a `pipeline` field
+@app.post("/pipelines/{name}/ask")
+async def ask_pipeline(name: str, request: QuestionRequest):
+    return await ask_question(request.model_copy(update={"pipeline": name}))
+
+@app.post("/pipelines/{name}/ask/stream")
+async def ask_pipeline_stream(name: str, request: QuestionRequest, http_request: Request):
+    return await ask_stream(request.model_copy(update={"pipeline": name}), http_request)
+
+@app.post("/pipelines/{name}/ask/batch")
+async def ask_pipeline_batch(name: str, request: BatchRequest):
+    return await ask_batch(request.model_copy(update={"pipeline": name}))
+
+@app.get("/pipelines")
+async def list_pipelines():
+    readiness.check()
+    return pipelines.describe()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    readiness.check()
+    return {"embedding": embedding_model.stats(), "answer": pipelines.cache_stats()}
+
+@app.get("/llm/stats")
+async def llm_stats():
+    return {"nodes": llm.stats(), "pipeline": runner.stats()}
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process serves HTTP; models may still be loading
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    status = {**readiness.status(), "prompt_version": RAG_PROMPT_VERSION, "pipelines": pipelines.names()}
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=status)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return Response(body, media_type=content_type)
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.labels(endpoint=route.path if route else "other", status=response.status_code).observe(
+        time.perf_counter() - start)
+    return response
 
 # ==== FastAPI setup ==== #
 #app = FastAPI()
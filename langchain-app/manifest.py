@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import uuid
+
+# Fixed namespace so the same (corpus, document, chunk) always maps to the same Qdrant point id
+POINT_NAMESPACE = uuid.UUID("6f1c1a52-4c1e-4d9b-9a57-3f0e2b8d6a10")
+
+
+def point_id(corpus_id, document_id, chunk_index):
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{corpus_id}:{document_id}:{chunk_index}"))
+
+
+def content_hash(text, metadata):
+    h = hashlib.sha256()
+    h.update(json.dumps(metadata, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Content hash and chunk count of every indexed document, keyed by corpus and document id.
+    Stored as JSON next to the loader and rewritten atomically after each corpus.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.corpora = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.corpora = json.load(f).get("corpora", {})
+
+    def get(self, corpus_id, document_id):
+        return self.corpora.get(str(corpus_id), {}).get(str(document_id))
+
+    def set(self, corpus_id, document_id, hash, chunks):
+        self.corpora.setdefault(str(corpus_id), {})[str(document_id)] = {"hash": hash, "chunks": chunks}
+
+    def remove(self, corpus_id, document_id):
+        documents = self.corpora.get(str(corpus_id), {})
+        entry = documents.pop(str(document_id), None)
+        if not documents:
+            self.corpora.pop(str(corpus_id), None)
+        return entry
+
+    def documents(self, corpus_id):
+        return list(self.corpora.get(str(corpus_id), {}))
+
+    def corpus_ids(self):
+        return list(self.corpora)
+
+    def clear(self):
+        self.corpora = {}
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"corpora": self.corpora}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
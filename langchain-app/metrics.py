@@ -0,0 +1,171 @@
+import contextlib
+import contextvars
+import os
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest, write_to_textfile
+
+# load.py writes its metrics here at the end of a run (node_exporter textfile collector format)
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+# Same estimate as context_packing when the LLM does not report token counts
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+
+# Embedding and vector search take milliseconds, llama3 calls seconds to minutes
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+SLOW_BUCKETS = (.01, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+REQUEST_SECONDS = Histogram("rag_request_seconds", "HTTP request latency (time to response headers)",
+                            ["endpoint", "status"], buckets=SLOW_BUCKETS)
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time per graph node / chain step", ["stage"],
+                          buckets=FAST_BUCKETS + SLOW_BUCKETS[7:])
+EMBEDDING_SECONDS = Histogram("rag_embedding_seconds", "Embedding model calls (cache misses only)", ["kind"],
+                              buckets=FAST_BUCKETS)
+EMBEDDING_TEXTS = Counter("rag_embedding_texts_total", "Texts sent to the embedding model", ["kind"])
+SEARCH_SECONDS = Histogram("rag_vector_search_seconds", "Dense and lexical searches", ["kind"], buckets=FAST_BUCKETS)
+LLM_SECONDS = Histogram("rag_llm_seconds", "LLM calls", ["model"], buckets=SLOW_BUCKETS)
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM prompt and completion tokens", ["model", "type"])
+LLM_NODE_OUTSTANDING = Gauge("rag_llm_node_outstanding", "LLM calls in flight per Ollama node", ["node"])
+LLM_NODE_AVAILABLE = Gauge("rag_llm_node_available", "1 while an Ollama node is not ejected", ["node"])
+LLM_NODE_REQUESTS = Counter("rag_llm_node_requests_total", "LLM calls per Ollama node by outcome", ["node", "result"])
+LLM_NODE_EJECTIONS = Counter("rag_llm_node_ejections_total", "Times an Ollama node was taken out of the pool", ["node"])
+CACHE_LOOKUPS = Counter("rag_cache_lookups_total", "Cache lookups by result", ["cache", "result"])
+ANSWER_SECONDS_SAVED = Counter("rag_answer_cache_saved_seconds_total", "Generation time of the answers served from the answer cache")
+PIPELINE_RUNNING = Gauge("rag_pipeline_running", "Pipeline runs holding an LLM slot")
+PIPELINE_QUEUED = Gauge("rag_pipeline_queued", "Requests waiting for an LLM slot")
+PIPELINE_REJECTED = Counter("rag_pipeline_rejected_total", "Requests answered 503 by reason", ["reason"])
+STARTUP_SECONDS = Gauge("rag_startup_seconds", "Module import time, each startup step and time to ready", ["phase"])
+INGEST_ITEMS = Counter("rag_ingest_items_total", "Items out of each load.py pipeline stage", ["stage", "unit"])
+INGEST_BUSY = Counter("rag_ingest_busy_seconds_total", "Busy time of each load.py pipeline stage", ["stage"])
+INGEST_DOCUMENTS = Gauge("rag_ingest_documents", "Documents of the last load.py run by outcome", ["outcome"])
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+@contextlib.contextmanager
+def request_timings():
+    """Collects the seconds spent per stage by everything the block runs (see `record`)."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def record(stage, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+
+
+@contextlib.contextmanager
+def timed(histogram, name, **labels):
+    """Observes the block's duration in `histogram` and adds it to the request breakdown as `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        (histogram.labels(**labels) if labels else histogram).observe(seconds)
+        record(name, seconds)
+
+
+def stage(name):
+    return timed(STAGE_SECONDS, name, stage=name)
+
+
+def track_runner(runner):
+    """In-flight gauges read from the service's PipelineRunner at scrape time."""
+    PIPELINE_RUNNING.set_function(lambda: runner.running)
+    PIPELINE_QUEUED.set_function(lambda: runner.pending - runner.running)
+
+
+def latest():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def write_textfile(path=METRICS_TEXTFILE):
+    if path:
+        write_to_textfile(path, REGISTRY)
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """
+    LangChain callbacks timing every graph node, chain step and retriever call, and every
+    LLM call with its token counts. Pass it in `config={"callbacks": [...]}` (it propagates
+    to nested runs) or to the LLM constructor.
+    """
+    run_inline = True
+
+    def __init__(self):
+        self._starts = {}
+
+    def _start(self, run_id, name, tags):
+        if "langsmith:hidden" not in (tags or []):
+            self._starts[run_id] = (name, time.perf_counter(), 0)
+
+    def _end(self, run_id):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            name, start, _ = started
+            seconds = time.perf_counter() - start
+            STAGE_SECONDS.labels(stage=name).observe(seconds)
+            record(name, seconds)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, tags=None, **kwargs):
+        self._start(run_id, kwargs.get("name") or (serialized or {}).get("name") or "chain", tags)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, tags=None, **kwargs):
+        self._start(run_id, kwargs.get("name") or (serialized or {}).get("name") or "retriever", tags)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model") or "llm"
+        self._starts[run_id] = (model, time.perf_counter(), sum(estimate_tokens(p) for p in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model") or "llm"
+        prompt = sum(estimate_tokens(str(m.content)) for batch in messages for m in batch)
+        self._starts[run_id] = (model, time.perf_counter(), prompt)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started is None:
+            return
+        model, start, prompt_tokens = started
+        seconds = time.perf_counter() - start
+        LLM_SECONDS.labels(model=model).observe(seconds)
+        record("llm", seconds)
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+        info = getattr(generation, "generation_info", None) or {}
+        completion_tokens = usage.get("output_tokens") or info.get("eval_count")
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(generation.text) if generation else 0
+        LLM_TOKENS.labels(model=model, type="prompt").inc(usage.get("input_tokens") or info.get("prompt_eval_count") or prompt_tokens)
+        LLM_TOKENS.labels(model=model, type="completion").inc(completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started is not None:
+            LLM_SECONDS.labels(model=started[0]).observe(time.perf_counter() - started[1])
+
+
+# One handler per process: it only keeps the start times of the runs in progress
+CALLBACK = MetricsCallback()
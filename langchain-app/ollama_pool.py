@@ -0,0 +1,307 @@
+import itertools
+import math
+import os
+import threading
+import time
+
+import httpx
+import requests
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_ollama import ChatOllama
+from pydantic import PrivateAttr
+
+from concurrency import Overloaded
+from metrics import LLM_NODE_EJECTIONS, LLM_NODE_AVAILABLE, LLM_NODE_OUTSTANDING, LLM_NODE_REQUESTS, PIPELINE_REJECTED
+from startup import OLLAMA_HOST, OLLAMA_KEEP_ALIVE, warm_up_ollama
+
+try:
+    from ollama import ResponseError
+except ImportError:  # the ollama client comes with langchain_ollama
+    ResponseError = None
+
+# Comma-separated Ollama endpoints serving llama3; defaults to the single OLLAMA_HOST
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", OLLAMA_HOST).split(",") if h.strip()]
+# Seconds between GET /api/version probes of every node (0 = no probes; ejected nodes come back after OLLAMA_EJECT_SECONDS)
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+# A node that fails a call or a probe gets no requests for this long, or until a probe succeeds
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+# Nodes tried per call before its last error is raised
+OLLAMA_MAX_ATTEMPTS = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "3"))
+HEALTH_TIMEOUT_SECONDS = 5.0
+
+
+def retryable(error):
+    """Errors where the node, not the request, is at fault: worth another node."""
+    if isinstance(error, (ConnectionError, TimeoutError, httpx.TransportError, requests.ConnectionError)):
+        return True
+    # 503 is Ollama's "server busy" (OLLAMA_MAX_QUEUE reached)
+    return ResponseError is not None and isinstance(error, ResponseError) and error.status_code >= 500
+
+
+class OllamaNode:
+    """One Ollama endpoint: its chat model (one persistent HTTP client) and scheduling state."""
+    def __init__(self, host, chat):
+        self.host = host
+        self.chat = chat
+        self.session = requests.Session()
+        self.outstanding = 0
+        self.avg_seconds = None
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def cost(self):
+        # Expected wait for a new call: everything already sent to it plus the call itself
+        return (self.outstanding + 1) * (self.avg_seconds or 0.0)
+
+
+class OllamaPool(BaseChatModel):
+    """
+    llama3 behind several Ollama endpoints, used wherever the services used one ChatOllama.
+
+    Every call goes to the available node with the least outstanding work (calls in flight
+    times its average call time; idle or unmeasured nodes first) through that node's
+    ChatOllama, which keeps its HTTP connections open and sends `keep_alive`. A node that
+    fails with a connection error, a timeout or a 5xx is ejected for `eject_seconds` and the
+    call is retried on another node, up to `max_attempts` nodes; a stream is only retried
+    before its first token. A background thread probes every node each `health_interval`
+    seconds, ejecting dead ones and taking back recovered ones early; it is started by the
+    first call of each process, so a pool built before serve.py forks its workers still
+    gets one per worker. With every node ejected, calls raise `Overloaded` (503 with
+    Retry-After).
+    """
+    model: str = "llama3"
+    hosts: list = OLLAMA_HOSTS
+    keep_alive: str = OLLAMA_KEEP_ALIVE
+    eject_seconds: float = OLLAMA_EJECT_SECONDS
+    max_attempts: int = OLLAMA_MAX_ATTEMPTS
+    health_interval: float = OLLAMA_HEALTH_INTERVAL
+
+    _nodes: list = PrivateAttr(default_factory=list)
+    _lock: object = PrivateAttr(default_factory=threading.Lock)
+    _turn: object = PrivateAttr(default_factory=itertools.count)
+    _health: object = PrivateAttr(default=None)
+    _health_pid: int = PrivateAttr(default=None)
+
+    def model_post_init(self, __context):
+        if not self.hosts:
+            raise ValueError("OllamaPool needs at least one host (OLLAMA_HOSTS)")
+        self._nodes = [OllamaNode(host, ChatOllama(model=self.model, base_url=host, keep_alive=self.keep_alive))
+                       for host in self.hosts]
+        for node in self._nodes:
+            LLM_NODE_OUTSTANDING.labels(node=node.host).set_function(lambda node=node: node.outstanding)
+            LLM_NODE_AVAILABLE.labels(node=node.host).set_function(lambda node=node: float(node.available(time.monotonic())))
+
+    @property
+    def _llm_type(self):
+        return "ollama-pool"
+
+    @property
+    def _identifying_params(self):
+        return {"model": self.model, "hosts": self.hosts}
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    # ==== Scheduling ====
+
+    def _acquire(self, tried, error):
+        """The node for the next attempt; raises `error` (or Overloaded) when there is none."""
+        self._start_health()
+        with self._lock:
+            now = time.monotonic()
+            candidates = [n for n in self._nodes if n not in tried and n.available(now)]
+            if not candidates or len(tried) >= self.max_attempts:
+                if error is not None:
+                    raise error
+                retry_after = min(n.ejected_until for n in self._nodes) - now
+                PIPELINE_REJECTED.labels(reason="no_llm_node").inc()
+                raise Overloaded("No Ollama node is available", max(1, math.ceil(retry_after)))
+            # Ties (e.g. all idle) rotate instead of always picking the first node
+            turn = next(self._turn)
+            node = min(candidates, key=lambda n: (n.cost(), n.outstanding, (self._nodes.index(n) - turn) % len(self._nodes)))
+            node.outstanding += 1
+            node.requests += 1
+        return node
+
+    def _release(self, node, seconds=None, error=None, cancelled=False):
+        with self._lock:
+            node.outstanding -= 1
+            if seconds is not None:
+                node.avg_seconds = seconds if node.avg_seconds is None else 0.8 * node.avg_seconds + 0.2 * seconds
+        if cancelled:
+            # The consumer stopped reading (client went away): says nothing about the node
+            LLM_NODE_REQUESTS.labels(node=node.host, result="cancelled").inc()
+        elif error is None:
+            LLM_NODE_REQUESTS.labels(node=node.host, result="ok").inc()
+        elif retryable(error):
+            LLM_NODE_REQUESTS.labels(node=node.host, result="failed").inc()
+            self._eject(node, error)
+        else:
+            # The request itself was bad (e.g. 400): the node is fine
+            LLM_NODE_REQUESTS.labels(node=node.host, result="error").inc()
+
+    def _eject(self, node, error):
+        with self._lock:
+            newly = node.available(time.monotonic())
+            node.ejected_until = time.monotonic() + self.eject_seconds
+            node.failures += 1
+            node.last_error = str(error)
+        if newly:
+            LLM_NODE_EJECTIONS.labels(node=node.host).inc()
+            print(f"Ejected Ollama node {node.host} for {self.eject_seconds:.0f}s: {error}")
+
+    # ==== BaseChatModel ====
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tried, error = set(), None
+        while True:
+            node = self._acquire(tried, error)
+            tried.add(node)
+            start = time.perf_counter()
+            try:
+                result = node.chat._generate(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                self._release(node, error=e)
+                if not retryable(e):
+                    raise
+                error = e
+                continue
+            self._release(node, time.perf_counter() - start)
+            return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tried, error = set(), None
+        while True:
+            node = self._acquire(tried, error)
+            tried.add(node)
+            start = time.perf_counter()
+            try:
+                result = await node.chat._agenerate(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                self._release(node, error=e)
+                if not retryable(e):
+                    raise
+                error = e
+                continue
+            self._release(node, time.perf_counter() - start)
+            return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tried, error = set(), None
+        while True:
+            node = self._acquire(tried, error)
+            tried.add(node)
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in node.chat._stream(messages, stop, run_manager, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self._release(node, error=e)
+                if started or not retryable(e):
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # Closed by the consumer (GeneratorExit) or interrupted: neither a success nor the node's fault
+                self._release(node, cancelled=True)
+                raise
+            self._release(node, time.perf_counter() - start)
+            return
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tried, error = set(), None
+        while True:
+            node = self._acquire(tried, error)
+            tried.add(node)
+            start = time.perf_counter()
+            started = False
+            try:
+                async for chunk in node.chat._astream(messages, stop, run_manager, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self._release(node, error=e)
+                if started or not retryable(e):
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # Closed by the consumer or cancelled (CancelledError)
+                self._release(node, cancelled=True)
+                raise
+            self._release(node, time.perf_counter() - start)
+            return
+
+    def with_structured_output(self, schema, **kwargs):
+        # ChatOllama's version only binds `format` (or tools), which the pool passes on to the node
+        return ChatOllama.with_structured_output(self, schema, **kwargs)
+
+    def bind_tools(self, tools, **kwargs):
+        return ChatOllama.bind_tools(self, tools, **kwargs)
+
+    # ==== Health ====
+
+    def probe(self, node):
+        """GET /api/version on the node's own session; ejects it or takes it back."""
+        try:
+            response = node.session.get(f"{node.host.rstrip('/')}/api/version", timeout=HEALTH_TIMEOUT_SECONDS)
+            response.raise_for_status()
+        except Exception as e:
+            self._eject(node, e)
+            return False
+        with self._lock:
+            recovered = not node.available(time.monotonic())
+            node.ejected_until = 0.0
+        if recovered:
+            print(f"Ollama node {node.host} is back")
+        return True
+
+    def _start_health(self):
+        # Threads do not survive a fork: a forked worker starts its own
+        if self.health_interval <= 0 or self._health_pid == os.getpid():
+            return
+        with self._lock:
+            if self._health_pid != os.getpid():
+                self._health_pid = os.getpid()
+                self._health = threading.Thread(target=self._probe_forever, name="ollama-health", daemon=True)
+                self._health.start()
+
+    def _probe_forever(self):
+        while True:
+            time.sleep(self.health_interval)
+            for node in self._nodes:
+                self.probe(node)
+
+    def warm_up(self):
+        """Loads llama3 on every node; fails only when no node could load it."""
+        self._start_health()
+        errors = {}
+        for node in self._nodes:
+            try:
+                warm_up_ollama(self.model, node.host)
+            except Exception as e:
+                errors[node.host] = str(e)
+                self._eject(node, e)
+        if len(errors) == len(self._nodes):
+            raise RuntimeError(f"llama3 could not be loaded on any Ollama node: {errors}")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "host": node.host,
+                "available": node.available(now),
+                "outstanding": node.outstanding,
+                "requests": node.requests,
+                "failures": node.failures,
+                "avg_seconds": round(node.avg_seconds, 3) if node.avg_seconds is not None else None,
+                "last_error": node.last_error,
+            } for node in self._nodes]
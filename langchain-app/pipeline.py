@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+
+from metrics import INGEST_BUSY, INGEST_ITEMS
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items_in, items_out, busy):
+        with self.lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.busy += busy
+        INGEST_ITEMS.labels(stage=self.name, unit=self.unit).inc(items_out)
+        INGEST_BUSY.labels(stage=self.name).inc(busy)
+
+    def rate(self):
+        return self.items_out / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        return f"{self.name:>8}: {self.items_out:8d} {self.unit:<6} busy {self.busy:8.2f}s  {self.rate():10.1f} {self.unit}/s"
+
+
+class Stage:
+    """
+    One pipeline step. `fn` receives one item (or a list of up to `batch_size` items when
+    batching) and returns an iterable of output items, which are passed on one by one.
+    """
+    def __init__(self, name, fn, batch_size=None, workers=1, unit="chunks"):
+        self.name = name
+        self.fn = fn
+        self.batch_size = batch_size
+        self.workers = workers
+        self.stats = StageStats(name, unit)
+
+
+class Pipeline:
+    """
+    Runs a source iterator and a chain of stages in threads connected by bounded queues.
+    A full queue blocks the stage feeding it, so a slow stage throttles everything
+    upstream and memory stays bounded by the queue sizes, not by the input size.
+    """
+    def __init__(self, source, stages, queue_size=64, source_name="fetch", source_unit="docs"):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.source_stats = StageStats(source_name, source_unit)
+        self._abort = threading.Event()
+        self._errors = []
+
+    def _put(self, q, item):
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fail(self, e):
+        self._errors.append(e)
+        self._abort.set()
+
+    def _run_source(self, out):
+        try:
+            it = iter(self.source)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                self.source_stats.add(0, 1, time.perf_counter() - start)
+                if not self._put(out, item):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out, _DONE)
+
+    def _run_stage(self, stage, inq, outq, remaining):
+        def emit(items):
+            start = time.perf_counter()
+            results = list(stage.fn(items))
+            stage.stats.add(len(items) if stage.batch_size else 1, len(results), time.perf_counter() - start)
+            for result in results:
+                if outq is not None and not self._put(outq, result):
+                    return False
+            return True
+
+        try:
+            batch = []
+            while True:
+                item = self._get(inq)
+                if item is _DONE:
+                    # Let sibling workers of this stage see the end marker too
+                    self._put(inq, _DONE)
+                    break
+                if stage.batch_size:
+                    batch.append(item)
+                    if len(batch) < stage.batch_size:
+                        continue
+                    item, batch = batch, []
+                if not emit(item):
+                    return
+            if batch and not self._abort.is_set():
+                emit(batch)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with remaining["lock"]:
+                remaining["count"] -= 1
+                last = remaining["count"] == 0
+            if last and outq is not None:
+                self._put(outq, _DONE)
+
+    def run(self):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0],), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            outq = queues[i + 1] if i + 1 < len(self.stages) else None
+            remaining = {"count": stage.workers, "lock": threading.Lock()}
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._run_stage, args=(stage, queues[i], outq, remaining), daemon=True))
+
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.elapsed = time.perf_counter() - start
+        if self._errors:
+            raise self._errors[0]
+        return self
+
+    def stats(self):
+        return [self.source_stats] + [stage.stats for stage in self.stages]
+
+    def report(self):
+        lines = [str(s) for s in self.stats()]
+        lines.append(f"{'total':>8}: {self.elapsed:.2f}s wall")
+        return "\n".join(lines)
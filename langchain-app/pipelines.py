@@ -0,0 +1,183 @@
+import logging
+import os
+import time
+
+from langchain.chains import RetrievalQA
+from langchain.chains.question_answering.stuff_prompt import PROMPT as STUFF_PROMPT
+
+from answer_cache import AnswerCache
+from context_packing import pack_context
+from hybrid import HybridRetriever, batch_hybrid_search
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pipeline answering the requests that do not name one
+DEFAULT_PIPELINE = os.getenv("DEFAULT_PIPELINE", "graph")
+# The stuff and refine prompts come from LangChain: bump the version when upgrading it changes them
+QA_PROMPT_VERSION = "langchain-qa/1"
+
+
+class Pipeline:
+    """
+    One named way of answering a question. The pipelines of a service share its embedding
+    model (and caches), vector store client, BM25 index, LLM pool and PipelineRunner; each
+    has its own answer cache, keyed by its prompt version.
+
+    Subclasses implement `retrieve(question)` and `retrieve_batch(questions)` (the context
+    documents), `final_prompt(question, docs, mode)` (the LLM input whose answer /ask/stream
+    streams) and `generate(question, docs, mode)`; /ask runs `run`.
+    """
+    name = None
+    modes = ()
+    prompt_version = ""
+
+    def __init__(self, embedding, llm, default_mode=None):
+        self.embedding = embedding
+        self.llm = llm
+        self.default_mode = default_mode or self.modes[0]
+        # Opened here, in the worker process: SQLite connections must not cross a fork
+        self.answer_cache = AnswerCache(self.prompt_version)
+
+    def mode(self, mode=None):
+        """The requested mode, or the pipeline's default; ValueError for one it does not have."""
+        mode = mode or self.default_mode
+        if mode not in self.modes:
+            raise ValueError(f"Pipeline {self.name} has no mode {mode!r} (modes: {', '.join(self.modes)})")
+        return mode
+
+    def cached(self, question, docs, mode, cache=True):
+        """The answer cache's answer over `docs`, or None (always None when `cache` is False)."""
+        if not cache:
+            self.answer_cache.bypass()
+            return None
+        # Same query vector retrieval computed (memory hit in the embedding LRU)
+        return self.answer_cache.get(question, self.embedding.embed_query(question), mode, docs)
+
+    def remember(self, question, docs, mode, answer, seconds):
+        self.answer_cache.put(question, self.embedding.embed_query(question), mode, docs, answer, seconds)
+
+    def answer(self, question, docs, mode, cache=True):
+        """Returns (answer, whether it came from the answer cache)."""
+        answer = self.cached(question, docs, mode, cache)
+        if answer is not None:
+            return answer, True
+        start = time.perf_counter()
+        answer = self.generate(question, docs, mode)
+        self.remember(question, docs, mode, answer, time.perf_counter() - start)
+        return answer, False
+
+    def run(self, question, mode, cache=True):
+        with metrics.request_timings() as timings:
+            answer, cached = self.answer(question, self.retrieve(question), mode, cache)
+        return {"answer": answer, "cached": cached, "timings": timings}
+
+    def describe(self):
+        return {"name": self.name, "modes": list(self.modes), "default_mode": self.default_mode,
+                "prompt_version": self.prompt_version}
+
+
+class PipelineRegistry:
+    """The pipelines of one service by name, and the one (and mode) a request selects."""
+    def __init__(self, default=DEFAULT_PIPELINE):
+        self.default = default
+        self._pipelines = {}
+
+    def register(self, pipeline):
+        self._pipelines[pipeline.name] = pipeline
+        return pipeline
+
+    def get(self, name=None):
+        """LookupError for a name that is not registered."""
+        name = name or self.default
+        if name not in self._pipelines:
+            raise LookupError(f"No pipeline {name!r} (pipelines: {', '.join(self._pipelines)})")
+        return self._pipelines[name]
+
+    def select(self, name=None, mode=None):
+        """(pipeline, mode) for a request; LookupError or ValueError when it names neither validly."""
+        pipeline = self.get(name)
+        return pipeline, pipeline.mode(mode)
+
+    def names(self):
+        return list(self._pipelines)
+
+    def describe(self):
+        return {"default": self.default, "pipelines": [p.describe() for p in self._pipelines.values()]}
+
+    def cache_stats(self):
+        return {name: pipeline.answer_cache.stats() for name, pipeline in self._pipelines.items()}
+
+
+# ==== RetrievalQA pipelines ====
+
+class RetrievalQAPipeline(Pipeline):
+    """
+    Hybrid retrieval over the whole collection (no section routing), answered with one of
+    LangChain's question-answering chains.
+    """
+    prompt_version = QA_PROMPT_VERSION
+
+    def __init__(self, embedding, llm, vectorstore, lexical, collection_name, k=5, search_params=None, default_mode=None):
+        super().__init__(embedding, llm, default_mode)
+        # Dense similarity search fused with the BM25 index written by load.py
+        self.retriever = HybridRetriever(
+            vectorstore=vectorstore, lexical=lexical, collection_name=collection_name, k=k,
+            search_kwargs={"search_params": search_params} if search_params is not None else {},
+        )
+
+    def retrieve(self, question):
+        # The retriever over-fetches and keeps at most MAX_CHUNKS_PER_DOCUMENT chunks per document,
+        # so the chain still gets k chunks instead of fewer after deduplication
+        unique_docs = self.retriever.get_relevant_documents(question, callbacks=[metrics.CALLBACK])
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, doc in enumerate(unique_docs):
+                logger.debug("Doc #%d %s: %s", i + 1, doc.metadata, doc.page_content[:500])
+        return unique_docs
+
+    def retrieve_batch(self, questions):
+        """Retrieval for many questions: one embedding batch and one batched dense search."""
+        vectors = self.embedding.embed_queries(questions)
+        return batch_hybrid_search(self.retriever.vectorstore.client, self.retriever.collection_name, questions, vectors,
+                                   [None] * len(questions), self.retriever.lexical.get(), k=self.retriever.k,
+                                   search_params=self.retriever.search_kwargs.get("search_params"))
+
+
+class StuffPipeline(RetrievalQAPipeline):
+    """One llama3 call over the question-relevant sentences of the retrieved chunks."""
+    name = "stuff"
+    modes = ("stuff",)
+
+    def final_prompt(self, question, docs, mode):
+        # The query vector is still in the embedding LRU from retrieval
+        with metrics.stage("pack_context"):
+            context, _ = pack_context(docs, self.embedding.embed_query(question), self.embedding)
+        return STUFF_PROMPT.format_prompt(context=context, question=question)
+
+    def generate(self, question, docs, mode):
+        return self.llm.invoke(self.final_prompt(question, docs, mode)).content
+
+
+class RefinePipeline(RetrievalQAPipeline):
+    """The RetrievalQA refine chain: one llama3 call per retrieved document."""
+    name = "refine"
+    modes = ("refine",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.qa = RetrievalQA.from_chain_type(llm=self.llm, retriever=self.retriever, chain_type="refine")
+
+    def final_prompt(self, question, docs, mode):
+        # Same passes as RefineDocumentsChain.combine_docs, except the last one is returned
+        # as a prompt so that only the final answer gets streamed
+        chain = self.qa.combine_documents_chain
+        inputs = chain._construct_initial_inputs(docs, question=question)
+        llm_chain = chain.initial_llm_chain
+        for doc in docs[1:]:
+            res = llm_chain.predict(callbacks=[metrics.CALLBACK], **inputs)
+            inputs = {**chain._construct_refine_inputs(doc, res), "question": question}
+            llm_chain = chain.refine_llm_chain
+        return llm_chain.prompt.format_prompt(**inputs)
+
+    def generate(self, question, docs, mode):
+        return self.qa.combine_documents_chain.run(input_documents=docs, question=question, callbacks=[metrics.CALLBACK])
@@ -0,0 +1,14 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+# Copy of rlm/rag-prompt from the LangChain hub, bundled so that startup needs no network.
+# Bump the version whenever the text changes; /readyz reports it.
+RAG_PROMPT_VERSION = "rag-prompt/1"
+RAG_PROMPT = ChatPromptTemplate.from_messages([(
+    "human",
+    "You are an assistant for question-answering tasks. Use the following pieces of retrieved context to "
+    "answer the question. If you don't know the answer, just say that you don't know. Use three sentences "
+    "maximum and keep the answer concise.\n"
+    "Question: {question} \n"
+    "Context: {context} \n"
+    "Answer:",
+)])
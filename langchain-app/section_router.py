@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+
+from lexical_index import scroll_points
+
+SECTION_ROUTER_PATH = os.getenv("SECTION_ROUTER_PATH", "./section_router.npz")
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.25"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.02"))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class SectionRouter:
+    """
+    Picks the `source` filter for a question from per-source centroid embeddings.
+
+    Each centroid is the normalized mean of the (normalized) chunk vectors of one source,
+    so routing is a single matrix-vector product. When the best centroid is not similar
+    enough, or not clearly ahead of the runner-up, `route` returns None and the caller
+    searches without a filter.
+    """
+    def __init__(self, sources, centroids, counts, min_score=ROUTER_MIN_SCORE, min_margin=ROUTER_MIN_MARGIN):
+        self.sources = list(sources)
+        self.centroids = _normalize(np.asarray(centroids, dtype=np.float32))
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.min_score = min_score
+        self.min_margin = min_margin
+
+    @staticmethod
+    def _sum_vectors(points, sums, counts):
+        for point in points:
+            source = (point.payload or {}).get("metadata", {}).get("source")
+            if source is None or point.vector is None:
+                continue
+            vector = np.asarray(point.vector, dtype=np.float32)
+            vector /= max(np.linalg.norm(vector), 1e-12)
+            if source in sums:
+                sums[source] += vector
+                counts[source] += 1
+            else:
+                sums[source] = vector
+                counts[source] = 1
+
+    @classmethod
+    def from_collection(cls, qdrant, collection_name, batch_size=1024, **kwargs):
+        """Builds the centroids by scrolling every point of the collection."""
+        sums, counts = {}, {}
+        cls._sum_vectors(scroll_points(qdrant, collection_name, ["metadata.source"], with_vectors=True, batch_size=batch_size),
+                         sums, counts)
+        return cls._from_sums(sums, counts, **kwargs)
+
+    @classmethod
+    def _from_sums(cls, sums, counts, **kwargs):
+        sources = sorted(sums)
+        centroids = np.stack([sums[s] for s in sources]) if sources else np.zeros((0, 384), dtype=np.float32)
+        return cls(sources, centroids, [counts[s] for s in sources], **kwargs)
+
+    def update(self, qdrant, collection_name, sources):
+        """
+        A router where the centroids of `sources` (the ones a sync wrote or deleted points of)
+        are recomputed from their points, scrolling only those; a source left without points
+        is dropped. The other centroids are kept as they are.
+        """
+        sums = {source: centroid * count for source, centroid, count in zip(self.sources, self.centroids, self.counts)}
+        counts = dict(zip(self.sources, self.counts.tolist()))
+        for source in sources:
+            sums.pop(source, None)
+            counts.pop(source, None)
+            self._sum_vectors(scroll_points(qdrant, collection_name, ["metadata.source"], with_vectors=True, source=source),
+                              sums, counts)
+        return self._from_sums(sums, counts, min_score=self.min_score, min_margin=self.min_margin)
+
+    @classmethod
+    def load(cls, path=SECTION_ROUTER_PATH, **kwargs):
+        data = np.load(path, allow_pickle=False)
+        return cls(data["sources"].tolist(), data["centroids"], data["counts"], **kwargs)
+
+    def save(self, path=SECTION_ROUTER_PATH):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, sources=np.array(self.sources, dtype=str), centroids=self.centroids, counts=self.counts)
+        os.replace(tmp, path)
+
+    def scores(self, query_vector):
+        query = np.asarray(query_vector, dtype=np.float32)
+        return self.centroids @ (query / max(np.linalg.norm(query), 1e-12))
+
+    def route(self, query_vector):
+        """Returns (source or None, best score, margin over the second best)."""
+        if not self.sources:
+            return None, 0.0, 0.0
+        scores = self.scores(query_vector)
+        if len(scores) == 1:
+            best, margin = 0, float(scores[0])
+        else:
+            top2 = np.argpartition(-scores, 1)[:2]
+            best, second = (top2[0], top2[1]) if scores[top2[0]] >= scores[top2[1]] else (top2[1], top2[0])
+            margin = float(scores[best] - scores[second])
+        score = float(scores[best])
+        if score < self.min_score or margin < self.min_margin:
+            return None, score, margin
+        return self.sources[best], score, margin
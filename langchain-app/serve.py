@@ -0,0 +1,102 @@
+"""
+Entry point of the langchain-backend container: uvicorn serving main:app on PORT with
+WEB_WORKERS worker processes.
+
+With one worker this is plain `uvicorn main:app`. With more, this process imports main.py
+and loads the embedding model once (EMBEDDING_PRELOAD, torch backend), then forks the
+workers: they share the imported libraries and the model weights copy-on-write instead of
+holding a copy each. Each worker runs the rest of the startup itself (vector store, caches,
+artifacts, warm-up), since connections, SQLite handles and thread pools must not cross a
+fork. All workers accept on one listening socket; one that dies is replaced.
+
+    WEB_WORKERS=4 python serve.py
+"""
+import gc
+import os
+import signal
+import time
+import traceback
+
+import uvicorn
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Worker processes; each has its own event loop, PipelineRunner, metrics and in-memory caches
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Load the embedding model before forking, so the workers share its weights
+EMBEDDING_PRELOAD = os.getenv("EMBEDDING_PRELOAD", "true").lower() == "true"
+# Seconds before replacing a worker that exited, so one failing at startup does not spin
+RESPAWN_DELAY_SECONDS = 1.0
+
+
+def split_threads(workers):
+    # One intra-op thread per core in every worker would oversubscribe the CPU; an explicit
+    # EMBEDDING_THREADS is kept (read by embedding_backend at import, so set before main is imported)
+    if os.getenv("EMBEDDING_THREADS", "0") == "0":
+        os.environ["EMBEDDING_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+
+
+def run_worker(app, sock):
+    code = 0
+    try:
+        # uvicorn installs its own SIGINT/SIGTERM handlers (graceful shutdown)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        uvicorn.Server(uvicorn.Config(app, host=HOST, port=PORT)).run(sockets=[sock])
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def spawn(app, sock):
+    pid = os.fork()
+    if pid == 0:
+        run_worker(app, sock)
+    return pid
+
+
+def serve_forked(workers):
+    split_threads(workers)
+    import main
+
+    if EMBEDDING_PRELOAD:
+        main.preload_models()
+    sock = uvicorn.Config(main.app, host=HOST, port=PORT).bind_socket()
+    # Keep the collector from touching (and so copying) every object loaded so far in each worker
+    gc.freeze()
+    pids = {spawn(main.app, sock) for _ in range(workers)}
+    print(f"Started {workers} workers on {HOST}:{PORT}: {sorted(pids)}")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        pids.discard(pid)
+        if stopping:
+            continue
+        print(f"Worker {pid} exited with {os.waitstatus_to_exitcode(status)}; starting another")
+        time.sleep(RESPAWN_DELAY_SECONDS)
+        if not stopping:
+            pids.add(spawn(main.app, sock))
+
+
+if __name__ == "__main__":
+    if WEB_WORKERS > 1:
+        serve_forked(WEB_WORKERS)
+    else:
+        uvicorn.run("main:app", host=HOST, port=PORT)
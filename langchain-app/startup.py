@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import os
+import time
+
+import requests
+
+from concurrency import Overloaded
+from metrics import STARTUP_SECONDS
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://ollama:11434")
+# Load llama3 into Ollama during startup so the first question does not wait for it
+WARMUP_OLLAMA = os.getenv("WARMUP_OLLAMA", "true").lower() == "true"
+# How long Ollama keeps llama3 in memory after the last request (also passed on every call)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "300"))
+
+
+def warm_up_ollama(model="llama3", host=OLLAMA_HOST):
+    # A generate request without a prompt only loads the model
+    response = requests.post(f"{host}/api/generate", json={"model": model, "keep_alive": OLLAMA_KEEP_ALIVE},
+                             timeout=WARMUP_TIMEOUT_SECONDS)
+    response.raise_for_status()
+
+
+class Readiness:
+    """
+    Startup state of a service. The lifespan hook runs the startup steps in a background task,
+    so /healthz answers as soon as the process serves HTTP while /readyz (and the endpoints
+    that need the models, through `check`) answer 503 until every required step is done.
+    """
+    def __init__(self, import_started):
+        self.import_seconds = time.perf_counter() - import_started
+        self.startup_seconds = None
+        self.steps = {}
+        self.errors = {}
+        self.ready = False
+        self.started = None
+        STARTUP_SECONDS.labels(phase="import").set(self.import_seconds)
+
+    async def run(self, steps):
+        """`steps` are (name, blocking fn, required); optional ones may fail without blocking readiness."""
+        self.started = time.perf_counter()
+        for name, fn, required in steps:
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(fn)
+            except Exception as e:
+                self.errors[name] = str(e)
+                print(f"Startup step {name} failed: {e}")
+                if required:
+                    return
+            self.steps[name] = round(time.perf_counter() - start, 3)
+            STARTUP_SECONDS.labels(phase=name).set(self.steps[name])
+        self.startup_seconds = time.perf_counter() - self.started
+        STARTUP_SECONDS.labels(phase="startup").set(self.startup_seconds)
+        self.ready = True
+        print(f"Ready in {self.startup_seconds:.2f}s after {self.import_seconds:.2f}s of imports: {self.steps}")
+
+    def lifespan(self, steps):
+        @contextlib.asynccontextmanager
+        async def lifespan(app):
+            task = asyncio.create_task(self.run(steps))
+            yield
+            task.cancel()
+        return lifespan
+
+    def check(self):
+        if not self.ready:
+            raise Overloaded("Service is starting up" if not self.errors else "Service failed to start", 5)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "import_seconds": round(self.import_seconds, 3),
+            "startup_seconds": round(self.startup_seconds, 3) if self.startup_seconds is not None else None,
+            "steps": self.steps,
+            "errors": self.errors,
+        }
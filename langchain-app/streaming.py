@@ -0,0 +1,84 @@
+import asyncio
+import json
+import time
+import weakref
+
+from concurrency import Overloaded
+
+# Keep proxies from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def source_payload(docs):
+    return [
+        {"document": doc.metadata.get("document"), "source": doc.metadata.get("source"), "corpus_id": doc.metadata.get("corpus_id"),
+         "chunk": doc.metadata.get("chunk"), "start": doc.metadata.get("start"), "end": doc.metadata.get("end")}
+        for doc in docs
+    ]
+
+
+def stream_answer(request, runner, llm, retrieve, build_prompt, cached=None, remember=None, admission=None):
+    """
+    Server-Sent Events for one question:
+
+        event: sources  -> retrieved document ids and `source` metadata (sent as soon as retrieval ends)
+        event: token    -> answer tokens as the LLM produces them (the whole answer at once when cached)
+        event: done     -> timing info
+        event: error    -> on overload or failure
+
+    `retrieve()` returns the context documents and `build_prompt(docs)` the LLM input; both are
+    blocking and run in a worker thread. The LLM is consumed with `astream`, so when the
+    client disconnects the generation request to Ollama is closed and stops. `cached(docs)`
+    may return a stored answer that replaces the LLM call, and `remember(docs, answer, seconds)`
+    receives every answer streamed to the end. `admission` is the endpoint's runner.admit():
+    the stream's slot takes it over.
+    """
+    events = _events(request, runner, llm, retrieve, build_prompt, cached, remember, admission)
+    if admission is not None:
+        # A response whose client left before the headers never starts the generator, so no
+        # slot releases the place; it is given back when the generator is dropped
+        weakref.finalize(events, admission.release)
+    return events
+
+
+async def _events(request, runner, llm, retrieve, build_prompt, cached, remember, admission):
+    start = time.perf_counter()
+    timings = {"tokens": 0}
+    try:
+        async with runner.slot(admission=admission):
+            docs = await asyncio.to_thread(retrieve)
+            timings["retrieval_seconds"] = time.perf_counter() - start
+            yield sse_event("sources", {"sources": source_payload(docs), "retrieval_seconds": timings["retrieval_seconds"]})
+
+            answer = await asyncio.to_thread(cached, docs) if cached is not None else None
+            if answer is not None:
+                timings.update(cached=True, first_token_seconds=time.perf_counter() - start, tokens=1)
+                yield sse_event("token", {"token": answer})
+            else:
+                generation_start = time.perf_counter()
+                messages = await asyncio.to_thread(build_prompt, docs)
+                tokens = []
+                async for chunk in llm.astream(messages):
+                    if await request.is_disconnected():
+                        return
+                    if not chunk.content:
+                        continue
+                    if "first_token_seconds" not in timings:
+                        timings["first_token_seconds"] = time.perf_counter() - start
+                    timings["tokens"] += 1
+                    tokens.append(chunk.content)
+                    yield sse_event("token", {"token": chunk.content})
+                if remember is not None:
+                    await asyncio.to_thread(remember, docs, "".join(tokens), time.perf_counter() - generation_start)
+    except Overloaded as e:
+        yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        return
+    except Exception as e:
+        yield sse_event("error", {"error": str(e)})
+        return
+    timings["total_seconds"] = time.perf_counter() - start
+    yield sse_event("done", timings)
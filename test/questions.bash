@@ -1,7 +1,9 @@
-curl -X POST http://18.191.114.230:8000/ask -H "Content-Type: application/json" -d '{"question": "Que es intestino?"}'
-curl -X POST http://18.191.114.230:8000/ask -H "Content-Type: application/json" -d '{"question": "Que me puedes decir del Método de los Elementos Finitos ?"}'
+HOST=${HOST:-localhost}
 
-curl -X POST http://18.191.114.230:8002/ask -H "Content-Type: application/json" -d '{"question": "que ecuaciones diferenciales están entre las más complejas de resolver teórica o numéricamente?"}'
+curl -X POST http://${HOST}:8000/ask -H "Content-Type: application/json" -d '{"question": "Que es intestino?"}'
+curl -X POST http://${HOST}:8000/ask -H "Content-Type: application/json" -d '{"question": "Que me puedes decir del Método de los Elementos Finitos ?"}'
+
+curl -X POST http://${HOST}:8000/ask -H "Content-Type: application/json" -d '{"question": "que ecuaciones diferenciales están entre las más complejas de resolver teórica o numéricamente?", "pipeline": "refine"}'
   que  ecuaciones diferenciales están entre las más complejas de resolver teórica o numéricamente?
 
 # values for type of search 'stuff', 'map_reduce', 'refine', 'map_rerank'
\ No newline at end of file
@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "langchain-app"))
+
+from langchain_core.documents import Document
+
+import hybrid
+
+
+class FakeLexical:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def search(self, query, k=5, source=None):
+        return [(pid, 1.0) for pid in self.ids[:k]]
+
+
+def chunks(document, n, source="mtds.txt"):
+    return [Document(page_content=f"fragmento {i}", metadata={"_id": f"{document}-{i}", "corpus_id": "1",
+                                                              "document": document, "source": source})
+            for i in range(n)]
+
+
+def test_routed_query_keeps_k_chunks_of_one_document(monkeypatch):
+    monkeypatch.setattr(hybrid, "MAX_CHUNKS_PER_DOCUMENT", 1)
+    docs = chunks("1001", 20)
+    result = hybrid.hybrid_search(docs, FakeLexical([d.metadata["_id"] for d in docs]), None, "corpus_gecko3",
+                                  "pregunta", k=5, source="mtds.txt")
+    assert len(result) == 5
+    assert {doc.metadata["document"] for doc in result} == {"1001"}
+
+
+def test_routed_query_without_lexical_index_keeps_k_chunks():
+    result = hybrid.hybrid_search(chunks("1001", 20), None, None, "corpus_gecko3", "pregunta", k=5, source="mtds.txt")
+    assert len(result) == 5
+
+
+def test_unfiltered_query_caps_chunks_per_document(monkeypatch):
+    monkeypatch.setattr(hybrid, "MAX_CHUNKS_PER_DOCUMENT", 1)
+    docs = chunks("1001", 10) + chunks("1002", 10, source="otro.txt")
+    result = hybrid.hybrid_search(docs, None, None, "corpus_gecko3", "pregunta", k=5)
+    assert [doc.metadata["document"] for doc in result] == ["1001", "1002"]